@@ -67,6 +67,12 @@ def job_disable_snippets_past_publish_date():
     call_command('disable_snippets_past_publish_date')
 
 
+@scheduled_job('cron', month='*', day='*', hour='*', minute='*/30', max_instances=1, coalesce=True)
+@babis.decorator(ping_after=settings.DEAD_MANS_SNITCH_PREGENERATE_BUNDLES)
+def job_pregenerate_bundles():
+    call_command('pregenerate_bundles')
+
+
 @scheduled_job('cron', month='*', day='*', hour='08', minute='20', max_instances=1, coalesce=True)
 @babis.decorator(ping_after=settings.DEAD_MANS_SNITCH_CSV_EXPORT)
 def job_export_to_csv():
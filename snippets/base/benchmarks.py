@@ -0,0 +1,72 @@
+"""
+Random fixtures shared by the benchmark and load testing commands.
+
+All of them take a random.Random to draw from, so that runs with the same
+seed get the same fixtures.
+"""
+import json
+
+from snippets.base.managers import LANGUAGE_VALUES
+from snippets.base.models import CHANNELS, Client, ClientMatchRule
+
+
+OS_VERSIONS = ['Darwin 17.7.0', 'Darwin 18.2.0', 'Windows_NT 6.1', 'Windows_NT 10.0',
+               'Linux 4.15.0']
+DISTRIBUTIONS = ['default', 'mozilla-EMEfree', 'yahoo', 'canonical', 'acer']
+WORDS = ['Firefox', 'privacy', 'browser', 'protect', 'your', 'data', 'download', 'the',
+         'new', 'extension', 'today', 'learn', 'more', 'about', 'tracking', 'and', 'sync',
+         'passwords', 'across', 'devices', 'Mozilla', 'donate', 'to', 'open', 'web']
+
+
+def random_rule(rule_id, rng):
+    """Return an unsaved ClientMatchRule resembling the ones in production."""
+    rule = ClientMatchRule(id=rule_id, description='Rule {0}'.format(rule_id),
+                           is_exclusion=rng.random() < 0.2)
+    choice = rng.randrange(6)
+    if choice == 0:
+        rule.channel = rng.choice(CHANNELS)
+    elif choice == 1:
+        rule.channel = '/^({0}|{1})/'.format(*rng.sample(CHANNELS, 2))
+    elif choice == 2:
+        rule.version = '/^{0}\\./'.format(rng.randrange(55, 70))
+    elif choice == 3:
+        rule.locale = rng.choice(LANGUAGE_VALUES)
+    elif choice == 4:
+        rule.os_version = '/^{0}/'.format(rng.choice(OS_VERSIONS).split(' ')[0])
+    else:
+        rule.distribution = rng.choice(DISTRIBUTIONS)
+        rule.version = '/^6[{0}-9]/'.format(rng.randrange(0, 9))
+    return rule
+
+
+def random_client(rng):
+    """Return an Activity Stream Router client with random properties."""
+    return Client(
+        startpage_version=6,
+        name='Firefox',
+        version='{0}.0'.format(rng.randrange(55, 70)),
+        appbuildid='20190110041606',
+        build_target='default',
+        locale=rng.choice(LANGUAGE_VALUES),
+        channel=rng.choice(CHANNELS),
+        os_version=rng.choice(OS_VERSIONS),
+        distribution=rng.choice(DISTRIBUTIONS),
+        distribution_version='default',
+    )
+
+
+def random_fragment(message_id, size, rng):
+    """Return a serialized message with roughly size bytes of text."""
+    words = []
+    length = 0
+    while length < size:
+        words.append(rng.choice(WORDS))
+        length += len(words[-1]) + 1
+    return json.dumps({
+        'id': str(message_id),
+        'template': 'simple_snippet',
+        'content': {
+            'text': ' '.join(words),
+            'button_url': 'https://www.mozilla.org/?utm_content={0}'.format(message_id),
+        },
+    })
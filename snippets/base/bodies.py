@@ -0,0 +1,94 @@
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+
+from django_statsd.clients import statsd
+
+
+CACHE_KEY = 'bundle_body_{0}'
+
+
+class LRUBodyCache(object):
+    """
+    Bundle bodies kept in this process.
+
+    The least recently used bodies get evicted once all of them take more
+    than BUNDLE_BODY_CACHE_MAX_BYTES. Bodies larger than
+    BUNDLE_BODY_CACHE_MAX_ITEM_BYTES don't get kept at all.
+    """
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            body = self.entries.get(key)
+            if body is not None:
+                self.entries.move_to_end(key)
+            return body
+
+    def set(self, key, body):
+        if len(body) > settings.BUNDLE_BODY_CACHE_MAX_ITEM_BYTES:
+            return
+
+        with self.lock:
+            self._remove(key)
+            self.entries[key] = body
+            self.size += len(body)
+            while self.size > settings.BUNDLE_BODY_CACHE_MAX_BYTES:
+                self.size -= len(self.entries.popitem(last=False)[1])
+                statsd.incr('bundle.body.evicted')
+            statsd.gauge('bundle.body.local_bytes', self.size)
+
+    def delete(self, key):
+        with self.lock:
+            self._remove(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def _remove(self, key):
+        body = self.entries.pop(key, None)
+        if body is not None:
+            self.size -= len(body)
+
+
+_local_bodies = LRUBodyCache()
+
+
+def get_body(filename):
+    """
+    Return the content of the bundle variant saved as filename.
+
+    Bodies get looked up in this process, then the cache and only then read
+    from storage.
+    """
+    body = _local_bodies.get(filename)
+    if body is not None:
+        statsd.incr('bundle.body.local_hit')
+        return body
+
+    cache_key = CACHE_KEY.format(filename)
+    body = cache.get(cache_key)
+    if body is None:
+        statsd.incr('bundle.body.miss')
+        with default_storage.open(filename) as body_file:
+            body = body_file.read()
+        cache.set(cache_key, body, settings.BUNDLE_BODY_CACHE_TIMEOUT)
+    else:
+        statsd.incr('bundle.body.cache_hit')
+
+    _local_bodies.set(filename, body)
+    return body
+
+
+def discard(filename):
+    """Forget the body of the bundle variant saved as filename after it changed."""
+    cache.delete(CACHE_KEY.format(filename))
+    _local_bodies.delete(filename)
@@ -1,23 +1,44 @@
 import hashlib
 import json
+import mimetypes
+import tempfile
+import time
+import zlib
 from datetime import datetime
-from urllib.parse import urljoin, urlparse
+from urllib.parse import urljoin
 
-from django.apps import apps
 from django.conf import settings
 from django.core.cache import cache
-from django.core.files.base import ContentFile
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.base import File
 from django.core.files.storage import default_storage
 from django.template.loader import render_to_string
 from django.utils.functional import cached_property
 
 import brotli
+from django_statsd.clients import statsd
 
-from snippets.base import util
-from snippets.base.models import STATUS_CHOICES, ASRSnippet, Snippet, Template
+from snippets.base import bodies, manifest, util
+from snippets.base.locks import generation_slot
+from snippets.base.queues import QUEUED_CACHE_KEY, get_queue
+from snippets.base.targeting import asr_index
+from snippets.base.encoders import JSONSnippetEncoder
+from snippets.base.models import STATUS_CHOICES, ASRSnippet, JSONSnippet, Snippet
+from snippets.base.rendering import (TEMPLATES_NG_VERSIONS, get_rendered_json,
+                                     iter_rendered_fragments)
+from snippets.base.storage import public_url
 
 
 ONE_DAY = 60 * 60 * 24
+GENERATION_POLL_INTERVAL = 0.1
+# Bundles larger than this get spooled to disk while being generated.
+SPOOL_MAX_SIZE = 1024 * 1024
+# Filename suffix of the bundle variant stored in each encoding.
+ENCODING_SUFFIXES = {
+    'br': '.br',
+    'gzip': '.gz',
+    'identity': '',
+}
 
 SNIPPET_FETCH_TEMPLATE_HASH = hashlib.sha1(
     render_to_string(
@@ -47,21 +68,138 @@ SNIPPET_FETCH_TEMPLATE_AS_HASH = hashlib.sha1(
         }
     ).encode('utf-8')).hexdigest()
 
-# On application load combine all the version strings of all available
-# templates into one. To be used in ASRSnippetBundle.key method to calculate
-# the bundle key. The point is that this string should change when the Template
-# schema changes.
-TEMPLATES_NG_VERSIONS = '-'.join([
-    model.VERSION
-    for model in apps.get_models()
-    if issubclass(model, Template) and not model.__name__ == 'Template'
-])
+
+class IdentityCompressor(object):
+    def process(self, data):
+        return data
+
+    def finish(self):
+        return b''
+
+
+class GzipCompressor(object):
+    def __init__(self):
+        # Adding 16 to wbits writes a gzip header and trailer.
+        self.compressobj = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def process(self, data):
+        return self.compressobj.compress(data)
+
+    def finish(self):
+        return self.compressobj.flush()
+
+
+COMPRESSORS = {
+    'br': brotli.Compressor,
+    'gzip': GzipCompressor,
+    'identity': IdentityCompressor,
+}
+
+
+def get_encodings():
+    """
+    Return the encodings bundles get stored in.
+
+    That's the BUNDLE_ENCODINGS followed by identity, which always gets
+    stored for clients that accept none of them.
+    """
+    encodings = []
+    for encoding in settings.BUNDLE_ENCODINGS:
+        if encoding not in COMPRESSORS:
+            raise ImproperlyConfigured('Unknown bundle encoding: {0}'.format(encoding))
+        if encoding != 'identity' and encoding not in encodings:
+            encodings.append(encoding)
+    return encodings + ['identity']
+
+
+def write_bundle_content(chunks, encodings=('identity',), brotli_quality=None):
+    """
+    Write the str or bytes chunks into a file to save to storage for each
+    encoding.
+
+    Chunks get encoded and compressed one at a time, so that the complete
+    uncompressed bundle is never held in memory. Brotli compresses at
+    brotli_quality, BUNDLE_BROTLI_QUALITY by default. Returns a dict of the
+    files in the order of encodings.
+    """
+    writers = []
+    for encoding in encodings:
+        if encoding == 'br':
+            if brotli_quality is None:
+                brotli_quality = settings.BUNDLE_BROTLI_QUALITY
+            compressor = brotli.Compressor(quality=brotli_quality)
+        else:
+            compressor = COMPRESSORS[encoding]()
+        writers.append((encoding, compressor,
+                        tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)))
+
+    for chunk in chunks:
+        data = chunk.encode('utf-8') if isinstance(chunk, str) else chunk
+        for encoding, compressor, output in writers:
+            output.write(compressor.process(data))
+
+    content_files = {}
+    for encoding, compressor, output in writers:
+        output.write(compressor.finish())
+        output.seek(0)
+        content_file = File(output)
+        if encoding != 'identity':
+            content_file.content_encoding = encoding
+        content_files[encoding] = content_file
+    return content_files
+
+
+def recompress(key, filename):
+    """
+    Overwrite the brotli variant of the bundle with key saved as filename
+    with one compressed at BUNDLE_BROTLI_QUALITY.
+
+    CDNs and clients keep serving the variant it replaces until that
+    expires, after BUNDLE_BROTLI_INLINE_MAX_AGE seconds. Returns the number
+    of bytes saved.
+    """
+    br_filename = filename + ENCODING_SUFFIXES['br']
+    if not default_storage.exists(br_filename):
+        return 0
+
+    with generation_slot(), statsd.timer('bundle.recompress.time'):
+        old_size = default_storage.size(br_filename)
+        with default_storage.open(filename) as identity_file:
+            content_file = write_bundle_content(identity_file.chunks(), ['br'])['br']
+            content_file.content_type = mimetypes.guess_type(filename)[0]
+            # Never replace a variant with a bigger one.
+            if content_file.size >= old_size:
+                return 0
+            default_storage.save(br_filename, content_file)
+
+    bodies.discard(br_filename)
+    bytes_saved = old_size - content_file.size
+    manifest.record_recompressed(key, bytes_saved)
+    statsd.incr('bundle.recompress.bytes_saved', bytes_saved)
+    return bytes_saved
+
+
+def get_bundle(client, endpoint='snippets'):
+    """Return the bundle for client of the fetch_snippets or JSON endpoint."""
+    if endpoint == 'json':
+        return JSONSnippetBundle(client)
+    if client.startpage_version == 6:
+        return ASRSnippetBundle(client)
+    return SnippetBundle(client)
 
 
 class SnippetBundle(object):
     """
     Group of snippets to be sent to a particular client configuration.
     """
+    # Encoding of the bundle variant to redirect the client to.
+    encoding = 'identity'
+    # Endpoint the bundle gets served by, see get_bundle.
+    endpoint = 'snippets'
+    # Fields of the matched snippets the key and the expiry of the bundle
+    # depend on, see matched_versions.
+    version_fields = ('id', 'modified', 'template__modified', 'publish_start', 'publish_end')
+
     def __init__(self, client):
         self.client = client
 
@@ -70,13 +208,14 @@ class SnippetBundle(object):
         """A unique key for this bundle as a sha1 hexdigest."""
         # Key should consist of snippets that are in the bundle. This part
         # accounts for all the properties sent by the Client, since the
-        # self.snippets lists snippets are all filters and CMRs have been
+        # self.versions lists snippets are all filters and CMRs have been
         # applied.
         key_properties = [
-            '{id}-{date}-{templatedate}'.format(id=snippet.id,
-                                                date=snippet.modified.isoformat(),
-                                                templatedate=snippet.template.modified.isoformat())
-            for snippet in self.snippets]
+            '{id}-{date}-{templatedate}'.format(
+                id=version.id,
+                date=version.modified.isoformat(),
+                templatedate=version.template__modified.isoformat())
+            for version in self.versions]
 
         # Additional values used to calculate the key are the templates and the
         # variables used to render them besides snippets.
@@ -84,7 +223,7 @@ class SnippetBundle(object):
             str(self.client.startpage_version),
             self.client.locale,
             util.current_firefox_major_version(),
-            str(settings.BUNDLE_BROTLI_COMPRESS),
+            ','.join(get_encodings()),
         ])
         if self.client.startpage_version >= 5:
             key_properties.append(SNIPPET_FETCH_TEMPLATE_AS_HASH)
@@ -96,7 +235,7 @@ class SnippetBundle(object):
 
     @property
     def empty(self):
-        return len(self.snippets) == 0
+        return len(self.versions) == 0
 
     @property
     def cache_key(self):
@@ -107,13 +246,157 @@ class SnippetBundle(object):
         if cache.get(self.cache_key):
             return True
 
-        # Check if available on S3 already.
-        if default_storage.exists(self.filename):
+        # Check if saved to storage already.
+        if manifest.exists(self.key):
+            self.set_last_good()
             cache.set(self.cache_key, True, ONE_DAY)
             return True
 
         return False
 
+    @property
+    def class_key(self):
+        """
+        A key for all clients that get the same bundle, no matter which
+        snippets are currently published.
+        """
+        return hashlib.sha1(repr(tuple(self.client)).encode('utf-8')).hexdigest()
+
+    @property
+    def last_good_cache_key(self):
+        return 'bundle_last_good_' + self.class_key
+
+    def set_last_good(self):
+        """Remember this bundle as the last good bundle of its clients."""
+        cache.set(self.last_good_cache_key, {
+            'key': self.key,
+            'filename': self.filename,
+            'encodings': get_encodings(),
+        }, ONE_DAY)
+
+    @property
+    def queued_cache_key(self):
+        return QUEUED_CACHE_KEY.format(self.key)
+
+    @cached_property
+    def stale(self):
+        """
+        The last good bundle of this bundle's clients as a dict with its
+        `key`, `filename` and the `encoding` to serve it in, or None.
+
+        The last good bundle may be served while this bundle gets generated
+        in the background, for at most BUNDLE_MAX_STALENESS seconds after it
+        was first requested.
+        """
+        if get_queue() is None:
+            return None
+
+        last_good = cache.get(self.last_good_cache_key)
+        if last_good is None or last_good['key'] == self.key:
+            return None
+
+        queued_at = cache.get(self.queued_cache_key)
+        if queued_at is not None and time.time() - queued_at > settings.BUNDLE_MAX_STALENESS:
+            return None
+
+        encoding = 'identity'
+        if self.encoding in last_good.get('encodings', []):
+            encoding = self.encoding
+        return {'key': last_good['key'], 'filename': last_good['filename'], 'encoding': encoding}
+
+    @property
+    def stale_url(self):
+        """URL of the last good bundle of this bundle's clients, or None."""
+        if self.stale is None:
+            return None
+        return self.get_url(self.stale['filename'] + ENCODING_SUFFIXES[self.stale['encoding']])
+
+    def enqueue(self):
+        """Queue this bundle for generation, unless it's already queued."""
+        if not cache.add(self.queued_cache_key, time.time(),
+                         settings.BUNDLE_MAX_STALENESS + settings.BUNDLE_GENERATION_LOCK_TIMEOUT):
+            return
+
+        bundle_queue = get_queue()
+        bundle_queue.put({'key': self.key, 'client': list(self.client), 'endpoint': self.endpoint})
+        statsd.gauge('bundle.queue.depth', bundle_queue.depth())
+
+    @property
+    def lock_key(self):
+        return 'bundle_lock_' + self.key
+
+    def enqueue_recompress(self):
+        """Queue the brotli variant of this bundle for recompression."""
+        bundle_queue = get_queue()
+        bundle_queue.put({'key': self.key, 'filename': self.filename, 'recompress': True})
+        statsd.gauge('bundle.queue.depth', bundle_queue.depth())
+
+    def _generate_locked(self, inline):
+        """
+        Generate this bundle if its generation lock is free, holding the lock
+        while generating. Returns whether the lock was free.
+        """
+        if not cache.add(self.lock_key, True, settings.BUNDLE_GENERATION_LOCK_TIMEOUT):
+            return False
+
+        try:
+            self._generate_in_slot(inline)
+        finally:
+            cache.delete(self.lock_key)
+        return True
+
+    def _generate_in_slot(self, inline):
+        """
+        Generate this bundle in a generation slot of this node.
+
+        With inline, a request waits for the slot, so it only waits up to
+        BUNDLE_GENERATION_SLOT_WAIT seconds for one.
+        """
+        wait = settings.BUNDLE_GENERATION_SLOT_WAIT if inline else None
+        with generation_slot(wait):
+            self.generate(inline=inline)
+
+    def ensure_generated(self, inline=False):
+        """
+        Generate this bundle unless another process is already generating it.
+
+        The process that acquires the generation lock of the bundle generates
+        it. Others wait up to BUNDLE_GENERATION_LOCK_WAIT seconds for the
+        bundle to get cached. When the lock gets released or expires before
+        that, e.g. because generating failed, the first waiter to acquire it
+        takes over. See generate for inline.
+
+        Waiters giving up while the lock is still held only generate the
+        bundle themselves with inline, since requests can't be served
+        without it.
+
+        Raises NoGenerationSlot if all generation slots of this node stay
+        taken, see generation_slot. Returns True if this process generated
+        the bundle.
+        """
+        if self._generate_locked(inline):
+            return True
+
+        statsd.incr('bundle.generate.lock_wait')
+        with statsd.timer('bundle.generate.lock_wait_time'):
+            deadline = time.time() + settings.BUNDLE_GENERATION_LOCK_WAIT
+            while time.time() < deadline:
+                time.sleep(GENERATION_POLL_INTERVAL)
+                if cache.get(self.cache_key):
+                    statsd.incr('bundle.generate.saved')
+                    return False
+                if self._generate_locked(inline):
+                    statsd.incr('bundle.generate.lock_takeover')
+                    return True
+
+        statsd.incr('bundle.generate.lock_timeout')
+        if not inline:
+            # The lock holder is still generating the bundle.
+            return False
+
+        self._generate_in_slot(inline)
+        return True
+
     @property
     def expired(self):
         """
@@ -128,67 +411,196 @@ class SnippetBundle(object):
 
     @property
     def url(self):
-        bundle_url = default_storage.url(self.filename)
-        full_url = urljoin(settings.SITE_URL, bundle_url).split('?')[0]
-        cdn_url = getattr(settings, 'CDN_URL', None)
-        if cdn_url:
-            full_url = urljoin(cdn_url, urlparse(bundle_url).path)
+        return self.get_url(self.filename + ENCODING_SUFFIXES[self.encoding])
+
+    def get_url(self, filename):
+        return public_url(default_storage, filename)
+
+    @cached_property
+    def matched_snippets(self):
+        """Snippets matching the client, including unavailable ones."""
+        return Snippet.objects.filter(published=True).match_client(self.client)
+
+    @cached_property
+    def matched_versions(self):
+        """
+        The version_fields of the snippets matching the client, including
+        unavailable ones.
 
-        return full_url
+        Deciding whether the bundle is cached only needs these, so the full
+        snippets only get loaded to generate the bundle.
+        """
+        return list(self.matched_snippets.values_list(*self.version_fields, named=True))
+
+    @cached_property
+    def now(self):
+        """The time the availability of the snippets gets decided at."""
+        return datetime.utcnow()
+
+    @cached_property
+    def versions(self):
+        """The version_fields of the available snippets matching the client."""
+        return util.filter_by_available(self.matched_versions, self.now)
 
     @cached_property
     def snippets(self):
-        return (Snippet.objects
-                .filter(published=True)
-                .match_client(self.client)
+        return (self.matched_snippets
                 .select_related('template')
                 .prefetch_related('countries', 'exclude_from_search_providers')
-                .filter_by_available())
+                .filter_by_available(self.now))
 
-    def generate(self):
-        """Generate and save the code for this snippet bundle."""
+    @cached_property
+    def expires(self):
+        """
+        The next time a snippet matching the client becomes available or
+        unavailable, or None. Until then this bundle stays valid.
+        """
+        return util.next_transition(self.matched_versions, self.now)
+
+    @property
+    def max_age(self):
+        """Seconds the response for this bundle may be cached for."""
+        if self.expires is None:
+            return settings.SNIPPET_BUNDLE_TIMEOUT
+        return min(settings.SNIPPET_BUNDLE_TIMEOUT, util.seconds_until(self.expires))
+
+    def generate(self, inline=False):
+        """
+        Generate and save the code for this snippet bundle.
+
+        If inline, a client waits for the bundle, so it gets compressed fast
+        and recompressed in the background.
+
+        Returns the number of bytes saved.
+        """
         template = 'base/fetch_snippets.jinja'
         if self.client.startpage_version == 5:
             template = 'base/fetch_snippets_as.jinja'
         bundle_content = render_to_string(template, {
             'snippet_ids': [snippet.id for snippet in self.snippets],
-            'snippets_json': json.dumps([s.to_dict() for s in self.snippets]),
+            'snippets_json': '[{0}]'.format(
+                ', '.join(get_rendered_json(snippet) for snippet in self.snippets)),
             'client': self.client,
             'locale': self.client.locale,
             'settings': settings,
             'current_firefox_major_version': util.current_firefox_major_version(),
         })
 
-        if isinstance(bundle_content, str):
-            bundle_content = bundle_content.encode('utf-8')
+        size = self.save([bundle_content], inline=inline)
+        self.set_last_good()
+        cache.set(self.cache_key, True, ONE_DAY)
+        return size
 
-        if (settings.BUNDLE_BROTLI_COMPRESS and self.client.startpage_version >= 5):
-            content_file = ContentFile(brotli.compress(bundle_content))
-            content_file.content_encoding = 'br'
-        else:
-            content_file = ContentFile(bundle_content)
+    def save(self, chunks, inline=False):
+        """
+        Save the bundle content in chunks in all bundle encodings.
 
-        default_storage.save(self.filename, content_file)
-        cache.set(self.cache_key, True, ONE_DAY)
+        The uncompressed variant gets saved last, since the bundle counts as
+        cached once it exists. Returns the number of bytes saved.
+        """
+        encodings = get_encodings()
+        recompress_later = (inline and 'br' in encodings and get_queue() is not None and
+                            settings.BUNDLE_BROTLI_INLINE_QUALITY < settings.BUNDLE_BROTLI_QUALITY)
+        brotli_quality = settings.BUNDLE_BROTLI_INLINE_QUALITY if recompress_later else None
+
+        content_type = mimetypes.guess_type(self.filename)[0]
+        size = 0
+        content_files = write_bundle_content(chunks, encodings, brotli_quality=brotli_quality)
+        if recompress_later:
+            # Don't let CDNs cache the variant recompress replaces for long.
+            content_files['br'].cache_control = 'max-age={0}'.format(
+                settings.BUNDLE_BROTLI_INLINE_MAX_AGE)
+        for encoding, content_file in content_files.items():
+            content_file.content_type = content_type
+            default_storage.save(self.filename + ENCODING_SUFFIXES[encoding], content_file)
+            size += content_file.size
+
+        manifest.record(self.key, self.filename, size, encodings)
+        if recompress_later:
+            self.enqueue_recompress()
+        return size
 
 
 class ASRSnippetBundle(SnippetBundle):
+    version_fields = ('id', 'modified', 'publish_start', 'publish_end')
+
+    def __init__(self, client, index=None):
+        super().__init__(client)
+        # Targeting index to match the client against, see
+        # ASR_TARGETING_INDEX.
+        self.index = asr_index if index is None else index
+
+    @cached_property
+    def client_class(self):
+        """The ClientClass of the client or None if the index is disabled."""
+        if not settings.ASR_TARGETING_INDEX:
+            return None
+        return self.index.client_class(self.client)
+
+    @cached_property
+    def resolved(self):
+        """
+        The cached resolution of this bundle's client class as a dict with
+        `key`, `empty` and `expires` keys or None when not available.
+        """
+        if self.client_class is None:
+            return None
+        return self.index.get_resolution(self.client_class)
+
+    @property
+    def class_key(self):
+        if self.client_class is None:
+            return super().class_key
+
+        # Unlike the resolution of the client class, this key must not
+        # depend on the version of the index.
+        return hashlib.sha1(repr(self.client_class).encode('utf-8')).hexdigest()
+
+    def remember(self, empty=False):
+        """Cache the resolution of this bundle for the client class."""
+        if self.client_class is None:
+            return
+        self.index.set_resolution(self.client_class, self.key, empty, self.expires)
+
+    @property
+    def empty(self):
+        if self.resolved is not None:
+            return self.resolved['empty']
+
+        empty = len(self.versions) == 0
+        if empty:
+            self.remember(empty=True)
+        return empty
+
+    @property
+    def cached(self):
+        if self.resolved is not None:
+            return True
+
+        if super().cached:
+            self.remember()
+            return True
+
+        return False
 
     @cached_property
     def key(self):
         """A unique key for this bundle as a sha1 hexdigest."""
+        if self.resolved is not None:
+            return self.resolved['key']
+
         # Key should consist of snippets that are in the bundle. This part
         # accounts for all the properties sent by the Client, since the
-        # self.snippets lists snippets are all filters and CMRs have been
+        # self.versions lists snippets are all filters and CMRs have been
         # applied.
         #
         # Key must change when Snippet or related Template, Campaign or Target
         # get updated.
         key_properties = []
-        for snippet in self.snippets:
+        for version in self.versions:
             attributes = [
-                snippet.id,
-                snippet.modified.isoformat(),
+                version.id,
+                version.modified.isoformat(),
             ]
 
             key_properties.append('-'.join([str(x) for x in attributes]))
@@ -198,7 +610,7 @@ class ASRSnippetBundle(SnippetBundle):
         key_properties.extend([
             str(self.client.startpage_version),
             self.client.locale,
-            str(settings.BUNDLE_BROTLI_COMPRESS),
+            ','.join(get_encodings()),
             TEMPLATES_NG_VERSIONS,
         ])
 
@@ -210,33 +622,123 @@ class ASRSnippetBundle(SnippetBundle):
         return urljoin(settings.MEDIA_BUNDLES_ROOT, 'bundle_{0}.json'.format(self.key))
 
     @cached_property
-    def snippets(self):
+    def matched_snippets(self):
+        """Snippets matching the client, including unavailable ones."""
+        if settings.ASR_TARGETING_INDEX:
+            return self.index.match_client(self.client)
+
         return (ASRSnippet.objects
                 .filter(status=STATUS_CHOICES['Published'])
-                .select_related('campaign', 'template_relation')
-                .match_client(self.client)
-                .filter_by_available())
-
-    def generate(self):
-        """Generate and save the code for this snippet bundle."""
-        # Generate the new AS Router bundle format
-        data = [snippet.render() for snippet in self.snippets]
-        bundle_content = json.dumps({
-            'messages': data,
-            'metadata': {
-                'generated_at': datetime.utcnow().isoformat(),
-                'number_of_snippets': len(data),
-            }
+                .match_client(self.client))
+
+    @cached_property
+    def matched_versions(self):
+        if settings.ASR_TARGETING_INDEX:
+            # The index holds the snippets in memory already.
+            return self.matched_snippets
+
+        return super().matched_versions
+
+    @cached_property
+    def snippets(self):
+        if settings.ASR_TARGETING_INDEX:
+            return self.index.filter_by_available(self.matched_snippets, self.now)
+
+        # Load everything rendering the snippets needs, see
+        # iter_rendered_fragments for their subtemplates and icons.
+        return (self.matched_snippets
+                .select_related('campaign', 'template_relation', 'template')
+                .prefetch_related('targets')
+                .filter_by_available(self.now))
+
+    @cached_property
+    def expires(self):
+        if self.resolved is not None:
+            return self.resolved.get('expires')
+
+        return super().expires
+
+    def iter_content(self):
+        """
+        Yield the bundle in the AS Router format in chunks.
+
+        The pre-serialized snippets get spliced into the JSON document one at
+        a time instead of rendering and serializing them for every bundle.
+        """
+        yield '{"messages": ['
+        for idx, fragment in enumerate(iter_rendered_fragments(self.snippets)):
+            yield ', ' + fragment if idx else fragment
+
+        yield '], "metadata": '
+        yield json.dumps({
+            'generated_at': datetime.utcnow().isoformat(),
+            'number_of_snippets': len(self.snippets),
         })
+        yield '}'
+
+    def generate(self, inline=False):
+        """
+        Generate and save the code for this snippet bundle.
 
-        if isinstance(bundle_content, str):
-            bundle_content = bundle_content.encode('utf-8')
+        If inline, a client waits for the bundle, so it gets compressed fast
+        and recompressed in the background.
+
+        Returns the number of bytes saved.
+        """
+        size = self.save(self.iter_content(), inline=inline)
+        self.set_last_good()
+        cache.set(self.cache_key, True, ONE_DAY)
+        self.remember()
+        return size
 
-        if settings.BUNDLE_BROTLI_COMPRESS:
-            content_file = ContentFile(brotli.compress(bundle_content))
-            content_file.content_encoding = 'br'
-        else:
-            content_file = ContentFile(bundle_content)
 
-        default_storage.save(self.filename, content_file)
+class JSONSnippetBundle(SnippetBundle):
+    """Group of JSON snippets to be sent to a particular client configuration."""
+    endpoint = 'json'
+    version_fields = ('id', 'modified', 'publish_start', 'publish_end')
+
+    @cached_property
+    def key(self):
+        """A unique key for this bundle as a sha1 hexdigest."""
+        # The content of the bundle doesn't depend on the client, so clients
+        # that match the same snippets share the bundle. Snippets get
+        # modified when their countries change.
+        key_properties = ['json']
+        for version in self.versions:
+            attributes = [version.id, version.modified.isoformat()]
+            key_properties.append('-'.join([str(x) for x in attributes]))
+        key_properties.append(','.join(get_encodings()))
+
+        key_string = '_'.join(key_properties)
+        return hashlib.sha1(key_string.encode('utf-8')).hexdigest()
+
+    @property
+    def class_key(self):
+        key_string = 'json_' + repr(tuple(self.client))
+        return hashlib.sha1(key_string.encode('utf-8')).hexdigest()
+
+    @property
+    def filename(self):
+        return urljoin(settings.MEDIA_BUNDLES_ROOT, 'bundle_{0}.json'.format(self.key))
+
+    @cached_property
+    def matched_snippets(self):
+        """Snippets matching the client, including unavailable ones."""
+        return JSONSnippet.objects.filter(published=True).match_client(self.client)
+
+    @cached_property
+    def snippets(self):
+        return (self.matched_snippets
+                .prefetch_related('countries')
+                .filter_by_available(self.now))
+
+    def generate(self, inline=False):
+        """
+        Generate and save the code for this snippet bundle.
+
+        Returns the number of bytes saved.
+        """
+        size = self.save([json.dumps(self.snippets, cls=JSONSnippetEncoder)], inline=inline)
+        self.set_last_good()
         cache.set(self.cache_key, True, ONE_DAY)
+        return size
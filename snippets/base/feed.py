@@ -57,7 +57,8 @@ class SnippetsFeed(ICalFeed):
                     .filter(for_qa=False, status=models.STATUS_CHOICES['Published'])
                     .order_by('publish_start'))
         filtr = ASRSnippetFilter(self.request.GET, queryset=queryset)
-        return filtr.qs
+        # Channels and locales of every item get listed in its description.
+        return filtr.qs.prefetch_related('targets', 'locales')
 
     def item_title(self, item):
         return item.name
@@ -71,7 +72,7 @@ class SnippetsFeed(ICalFeed):
         Locales: {}'
         Preview Link: {}
         '''.format(', '.join(item.channels),
-                   ', '.join(item.locales.values_list('name', flat=True)),
+                   ', '.join(locale.name for locale in item.locales.all()),
                    item.get_preview_url()))
         return description
 
@@ -0,0 +1,158 @@
+"""
+Batched invalidation of ASRSnippets after changes to the objects they
+depend on.
+
+Changes get collected per thread during a transaction and applied together
+once it commits: one UPDATE of ASRSnippet.modified for all affected
+snippets, storing their renderings and one invalidation of the targeting
+index. Outside of transactions changes get applied right away, unless they
+happen within `deferred()`.
+"""
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.utils import timezone
+
+
+_local = threading.local()
+
+# Functions returning the ids of the ASRSnippets that depend on the objects
+# of a model with the given pks, by model. See register.
+_resolvers = {}
+
+
+class Batch(object):
+    """Changes of a transaction to be applied once it commits."""
+    def __init__(self):
+        # ASRSnippet ids to update modified of.
+        self.modified = set()
+        # pks of the changed objects, by model.
+        self.changed = defaultdict(set)
+        # pks of the snippets to render, by model.
+        self.rendered = defaultdict(set)
+        self.index = False
+        self.flushed = False
+
+    def __bool__(self):
+        return bool(self.modified or self.changed or self.rendered or self.index)
+
+    def flush(self):
+        from snippets.base import targeting
+        from snippets.base.models import ASRSnippet
+        from snippets.base.rendering import store_rendered
+
+        self.flushed = True
+
+        snippet_ids = set(self.modified)
+        for model, pks in self.changed.items():
+            snippet_ids.update(_resolvers[model](list(pks)))
+        if snippet_ids:
+            # Use a list of ids, MySQL can't update a table it selects from.
+            ASRSnippet.objects.filter(pk__in=list(snippet_ids)).update(modified=timezone.now())
+            self.rendered[ASRSnippet].update(snippet_ids)
+            self.index = True
+
+        for model, pks in self.rendered.items():
+            store_rendered(model, list(pks))
+
+        # Rebuild indexes only after the snippets got updated and rendered.
+        if self.index:
+            targeting.invalidate_index()
+
+
+def _is_scheduled(batch):
+    # Django discards the commit callbacks of transactions that get rolled
+    # back, together with any batch that is waiting for them.
+    connection = transaction.get_connection()
+    return any(func == batch.flush for savepoint_ids, func in connection.run_on_commit)
+
+
+def _get_batch():
+    batch = getattr(_local, 'batch', None)
+    if batch is None or batch.flushed or (not _get_depth() and not _is_scheduled(batch)):
+        batch = _local.batch = Batch()
+    return batch
+
+
+def _get_depth():
+    return getattr(_local, 'depth', 0)
+
+
+def _schedule(batch):
+    if batch and not _get_depth() and not _is_scheduled(batch):
+        transaction.on_commit(batch.flush)
+
+
+def snippets_changed(pks):
+    """Mark the ASRSnippets with pks as modified."""
+    batch = _get_batch()
+    batch.modified.update(pks)
+    _schedule(batch)
+
+
+def objects_changed(model, pks):
+    """Mark the ASRSnippets depending on the objects of model with pks as modified."""
+    batch = _get_batch()
+    batch.changed[model].update(pks)
+    _schedule(batch)
+
+
+def render(model, pks):
+    """Store the renderings of the snippets of model with pks."""
+    batch = _get_batch()
+    batch.rendered[model].update(pks)
+    _schedule(batch)
+
+
+def invalidate_index():
+    """Invalidate the ASRSnippet targeting index."""
+    batch = _get_batch()
+    batch.index = True
+    _schedule(batch)
+
+
+@contextmanager
+def deferred():
+    """
+    Collect all changes within the block and apply them together once it
+    exits, or once the transaction it exits in commits. Useful for bulk
+    operations outside of transactions.
+    """
+    batch = _get_batch()
+    _local.depth = _get_depth() + 1
+    try:
+        yield
+    finally:
+        _local.depth -= 1
+        _schedule(batch)
+
+
+def _object_saved(sender, instance, raw=False, **kwargs):
+    # Related objects of fixtures may not be loaded yet.
+    if not raw:
+        objects_changed(sender, [instance.pk])
+
+
+def register(model, resolver):
+    """
+    Mark the ASRSnippets that depend on model as modified whenever objects
+    of model get saved. resolver gets called with the pks of the saved
+    objects and returns the ids of the depending ASRSnippets.
+    """
+    _resolvers[model] = resolver
+    post_save.connect(_object_saved, sender=model,
+                      dispatch_uid='invalidation_{0}'.format(model._meta.label_lower))
+
+
+def _index_object_changed(sender, **kwargs):
+    invalidate_index()
+
+
+def register_index_dependency(model):
+    """Invalidate the targeting index whenever objects of model change."""
+    uid = 'invalidation_index_{0}'.format(model._meta.label_lower)
+    post_save.connect(_index_object_changed, sender=model, dispatch_uid=uid + '_save')
+    post_delete.connect(_index_object_changed, sender=model, dispatch_uid=uid + '_delete')
@@ -0,0 +1,64 @@
+import fcntl
+import os
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from django_statsd.clients import statsd
+
+
+SLOT_POLL_INTERVAL = 0.05
+
+
+class NoGenerationSlot(Exception):
+    """Raised when no generation slot frees up in time."""
+
+
+def _acquire_slot(slots_dir, slots):
+    for slot in range(slots):
+        path = os.path.join(slots_dir, 'bundle-generation-slot-{0}.lock'.format(slot))
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            continue
+        return fd
+    return None
+
+
+@contextmanager
+def generation_slot(wait=None):
+    """
+    Limit the number of bundles generated concurrently on this node.
+
+    All processes of a node share BUNDLE_GENERATION_CONCURRENCY slots, each
+    one a file lock in BUNDLE_GENERATION_SLOTS_DIR. Locks get released by
+    the OS if a process dies while holding one. Waits up to wait seconds,
+    BUNDLE_GENERATION_LOCK_TIMEOUT by default, for a slot to free up and
+    raises NoGenerationSlot if none does.
+    """
+    if wait is None:
+        wait = settings.BUNDLE_GENERATION_LOCK_TIMEOUT
+    os.makedirs(settings.BUNDLE_GENERATION_SLOTS_DIR, exist_ok=True)
+
+    deadline = time.time() + wait
+    fd = _acquire_slot(settings.BUNDLE_GENERATION_SLOTS_DIR,
+                       settings.BUNDLE_GENERATION_CONCURRENCY)
+    if fd is None:
+        statsd.incr('bundle.generate.slot_wait')
+        with statsd.timer('bundle.generate.slot_wait_time'):
+            while fd is None and time.time() < deadline:
+                time.sleep(SLOT_POLL_INTERVAL)
+                fd = _acquire_slot(settings.BUNDLE_GENERATION_SLOTS_DIR,
+                                   settings.BUNDLE_GENERATION_CONCURRENCY)
+        if fd is None:
+            statsd.incr('bundle.generate.slot_timeout')
+            raise NoGenerationSlot()
+
+    try:
+        yield
+    finally:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
@@ -0,0 +1,47 @@
+import random
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from snippets.base.benchmarks import random_fragment
+from snippets.base.bundles import COMPRESSORS, write_bundle_content
+
+
+class Command(BaseCommand):
+    args = '(no args)'
+    help = 'Benchmark compression time and size of bundles in each encoding'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=500,
+                            help='Number of messages in the bundle')
+        parser.add_argument('--message-size', type=int, default=4096,
+                            help='Approximate size of each message in bytes')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        fragments = [random_fragment(message_id, options['message_size'], rng)
+                     for message_id in range(options['messages'])]
+        chunks = ['{"messages": [', ', '.join(fragments), ']}']
+
+        variants = [('br (quality {0})'.format(quality), 'br', quality) for quality in
+                    sorted(set([settings.BUNDLE_BROTLI_INLINE_QUALITY,
+                                settings.BUNDLE_BROTLI_QUALITY]))]
+        variants.extend((encoding, encoding, None) for encoding in sorted(COMPRESSORS)
+                        if encoding != 'br')
+
+        results = []
+        for label, encoding, quality in variants:
+            start = time.perf_counter()
+            content_files = write_bundle_content(chunks, [encoding], brotli_quality=quality)
+            results.append((label, content_files[encoding].size, time.perf_counter() - start))
+
+        identity_size = dict((label, size) for label, size, _ in results)['identity']
+        self.stdout.write('Messages: {messages}\n'.format(messages=len(fragments)) + ''.join(
+            '{label}: {size} bytes, {ratio:.1f}%, {time:.2f} ms\n'.format(
+                label=label,
+                size=size,
+                ratio=size * 100 / identity_size,
+                time=duration * 1000)
+            for label, size, duration in results))
@@ -0,0 +1,163 @@
+import json
+import random
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from urllib.parse import urljoin
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from snippets.base.benchmarks import random_client, random_rule
+from snippets.base.bundles import ASRSnippetBundle, write_bundle_content
+from snippets.base.managers import LANGUAGE_VALUES
+from snippets.base.models import CHANNELS, Client, load_subtemplates
+from snippets.base.targeting import ASRSnippetIndex
+from snippets.base.tests import (ASRSnippetFactory, ClientMatchRuleFactory, IconFactory,
+                                 TargetFactory, UserFactory)
+
+
+class StageTimer(object):
+    """Collect the time and the number of queries of each pipeline stage."""
+    def __init__(self):
+        self.stages = OrderedDict()
+
+    @contextmanager
+    def stage(self, name):
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            yield
+            duration = time.perf_counter() - start
+
+        stage = self.stages.setdefault(name, {'calls': 0, 'queries': 0, 'total_ms': 0})
+        stage['calls'] += 1
+        stage['queries'] += len(queries)
+        stage['total_ms'] += duration * 1000
+
+    def results(self):
+        return OrderedDict(
+            (name, dict(stage, mean_ms=stage['total_ms'] / stage['calls']))
+            for name, stage in self.stages.items())
+
+
+class Command(BaseCommand):
+    args = '(no args)'
+    help = 'Benchmark each stage of the ASR bundle pipeline and print the results as JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--snippets', type=int, default=200,
+                            help='Number of published ASRSnippets')
+        parser.add_argument('--targets', type=int, default=20,
+                            help='Number of Targets the snippets get assigned to')
+        parser.add_argument('--rules', type=int, default=50,
+                            help='Number of ClientMatchRules the targets get assigned')
+        parser.add_argument('--locales', type=int, default=10,
+                            help='Number of locales the snippets get targeted to')
+        parser.add_argument('--clients', type=int, default=20,
+                            help='Number of clients to build bundles for')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def create_fixtures(self, rng, options):
+        """Create the snippets to benchmark, with their targets and rules."""
+        locales = rng.sample(sorted(LANGUAGE_VALUES), min(options['locales'],
+                                                          len(LANGUAGE_VALUES)))
+        rules = []
+        for i in range(options['rules']):
+            rule = random_rule(None, rng)
+            rules.append(ClientMatchRuleFactory(
+                is_exclusion=rule.is_exclusion,
+                **{field: getattr(rule, field) for field in Client._fields}))
+
+        creator = UserFactory()
+        targets = []
+        for i in range(options['targets']):
+            channels = rng.sample(CHANNELS, rng.randint(1, len(CHANNELS)))
+            targets.append(TargetFactory(
+                creator=creator,
+                client_match_rules=rng.sample(rules, min(len(rules), rng.randint(0, 3))),
+                **{'on_{0}'.format(channel): channel in channels for channel in CHANNELS}))
+
+        # All snippets share an icon, so only one image gets saved to storage.
+        icon = IconFactory(creator=creator)
+        for i in range(options['snippets']):
+            ASRSnippetFactory(
+                creator=creator,
+                locales=rng.sample(locales, rng.randint(1, min(3, len(locales)))),
+                targets=rng.sample(targets, min(len(targets), rng.randint(1, 2))),
+                template_relation__icon=icon)
+        return locales, icon
+
+    def run_pipeline(self, timer, client, index):
+        """Build the bundle of client one stage at a time."""
+        bundle = ASRSnippetBundle(client, index=index)
+        with timer.stage('match_client'):
+            bundle.matched_versions
+        with timer.stage('filter_by_available'):
+            bundle.versions
+        with timer.stage('key'):
+            bundle.key
+        with timer.stage('load'):
+            snippets = list(bundle.snippets)
+        with timer.stage('render'):
+            load_subtemplates([snippet.template_relation for snippet in snippets
+                               if hasattr(snippet, 'template_relation')])
+            rendered = [snippet.render() for snippet in snippets]
+        with timer.stage('serialize'):
+            chunks = ['{"messages": [',
+                      ', '.join(json.dumps(data) for data in rendered),
+                      '], "metadata": ',
+                      json.dumps({'number_of_snippets': len(rendered)}),
+                      '}']
+        with timer.stage('compress'):
+            content_file = write_bundle_content(chunks, ['br'])['br']
+
+        filename = urljoin(settings.MEDIA_BUNDLES_ROOT,
+                           'benchmark_{0}.json.br'.format(bundle.key))
+        with timer.stage('save'):
+            filename = default_storage.save(filename, content_file)
+        default_storage.delete(filename)
+        return len(snippets), content_file.size
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        timer = StageTimer()
+        bundles = []
+
+        # Fixtures get rolled back, so the benchmark leaves no data behind.
+        with transaction.atomic():
+            with timer.stage('create_fixtures'):
+                locales, icon = self.create_fixtures(rng, options)
+            try:
+                # The index of this process and the ones of other processes
+                # sharing the cache never see the fixtures, since their
+                # invalidation happens on commit, which never comes.
+                index = ASRSnippetIndex(fixed_version='benchmark-' + uuid.uuid4().hex)
+                if settings.ASR_TARGETING_INDEX:
+                    with timer.stage('build_index'):
+                        index.build()
+
+                for i in range(options['clients']):
+                    client = random_client(rng)._replace(startpage_version=6,
+                                                         locale=rng.choice(locales))
+                    bundles.append(self.run_pipeline(timer, client, index))
+            finally:
+                icon.image.delete(save=False)
+                transaction.set_rollback(True)
+
+        self.stdout.write(json.dumps(OrderedDict([
+            ('release', settings.RAVEN_CONFIG['release']),
+            ('options', OrderedDict(
+                (name, options[name])
+                for name in ['snippets', 'targets', 'rules', 'locales', 'clients', 'seed'])),
+            ('settings', OrderedDict([
+                ('ASR_TARGETING_INDEX', settings.ASR_TARGETING_INDEX),
+                ('BUNDLE_BROTLI_QUALITY', settings.BUNDLE_BROTLI_QUALITY),
+            ])),
+            ('mean_bundle_snippets', sum(n for n, _ in bundles) / max(len(bundles), 1)),
+            ('mean_bundle_bytes', sum(size for _, size in bundles) / max(len(bundles), 1)),
+            ('stages', timer.results()),
+        ]), indent=2) + '\n')
@@ -0,0 +1,92 @@
+import json
+import random
+import time
+import tracemalloc
+
+import brotli
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand, CommandError
+
+from snippets.base.benchmarks import random_fragment
+from snippets.base.bundles import write_bundle_content
+
+
+def serialize_in_memory(fragments, compress):
+    """Serialize the bundle as one string, the way bundles used to get generated."""
+    bundle_content = '{{"messages": [{messages}], "metadata": {metadata}}}'.format(
+        messages=', '.join(fragments),
+        metadata=json.dumps({'number_of_snippets': len(fragments)})).encode('utf-8')
+    if compress:
+        bundle_content = brotli.compress(bundle_content)
+    return ContentFile(bundle_content)
+
+
+def serialize_streaming(fragments, compress):
+    def chunks():
+        yield '{"messages": ['
+        for idx, fragment in enumerate(fragments):
+            yield ', ' + fragment if idx else fragment
+        yield '], "metadata": '
+        yield json.dumps({'number_of_snippets': len(fragments)})
+        yield '}'
+    encoding = 'br' if compress else 'identity'
+    return write_bundle_content(chunks(), [encoding])[encoding]
+
+
+def measure(function, *args):
+    """Return the result, the peak memory in bytes and the time of calling function."""
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        content_file = function(*args)
+        duration = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return content_file.read(), peak, duration
+
+
+class Command(BaseCommand):
+    args = '(no args)'
+    help = 'Benchmark peak memory of in-memory against streaming bundle serialization'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=500,
+                            help='Number of messages in the bundle')
+        parser.add_argument('--message-size', type=int, default=4096,
+                            help='Approximate size of each message in bytes')
+        parser.add_argument('--no-compress', action='store_false', dest='compress',
+                            help='Do not brotli compress the bundle')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        fragments = [random_fragment(message_id, options['message_size'], rng)
+                     for message_id in range(options['messages'])]
+
+        in_memory, in_memory_peak, in_memory_time = measure(
+            serialize_in_memory, fragments, options['compress'])
+        streaming, streaming_peak, streaming_time = measure(
+            serialize_streaming, fragments, options['compress'])
+
+        if options['compress']:
+            in_memory = brotli.decompress(in_memory)
+            streaming = brotli.decompress(streaming)
+        if in_memory != streaming:
+            raise CommandError('Streaming serialization produced a different bundle.')
+
+        self.stdout.write(
+            'Messages: {messages}\n'
+            'Bundle Size: {size} bytes\n'
+            'In Memory Peak: {in_memory_peak:.1f} KiB\n'
+            'In Memory Time: {in_memory_time:.2f} ms\n'
+            'Streaming Peak: {streaming_peak:.1f} KiB\n'
+            'Streaming Time: {streaming_time:.2f} ms\n'
+            'Peak Reduction: {reduction:.1f}x\n'.format(
+                messages=len(fragments),
+                size=len(streaming),
+                in_memory_peak=in_memory_peak / 1024,
+                in_memory_time=in_memory_time * 1000,
+                streaming_peak=streaming_peak / 1024,
+                streaming_time=streaming_time * 1000,
+                reduction=in_memory_peak / streaming_peak))
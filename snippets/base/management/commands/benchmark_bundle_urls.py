@@ -0,0 +1,52 @@
+import time
+from urllib.parse import urljoin, urlparse
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+
+from snippets.base.storage import public_url
+
+
+def storage_url(storage, name):
+    """Build the public URL of name the way it was built before public_url."""
+    bundle_url = storage.url(name)
+    full_url = urljoin(settings.SITE_URL, bundle_url).split('?')[0]
+    cdn_url = getattr(settings, 'CDN_URL', None)
+    if cdn_url:
+        full_url = urljoin(cdn_url, urlparse(bundle_url).path)
+    return full_url
+
+
+class Command(BaseCommand):
+    args = '(no args)'
+    help = 'Benchmark building bundle redirect URLs through the storage against public_url'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--urls', type=int, default=10000,
+                            help='Number of bundle URLs to build')
+
+    def handle(self, *args, **options):
+        filenames = [
+            urljoin(settings.MEDIA_BUNDLES_ROOT, 'bundle_{0:040x}.html.br'.format(number))
+            for number in range(options['urls'])
+        ]
+
+        start = time.perf_counter()
+        expected = [storage_url(default_storage, filename) for filename in filenames]
+        storage_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        results = [public_url(default_storage, filename) for filename in filenames]
+        public_time = time.perf_counter() - start
+
+        if results != expected:
+            raise CommandError('public_url built different URLs than the storage.')
+
+        self.stdout.write(
+            'URLs: {urls}\n'
+            'Storage Time: {storage_time:.2f} us per URL\n'
+            'Public URL Time: {public_time:.2f} us per URL\n'.format(
+                urls=len(filenames),
+                storage_time=storage_time * 10 ** 6 / max(len(filenames), 1),
+                public_time=public_time * 10 ** 6 / max(len(filenames), 1)))
@@ -0,0 +1,55 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from snippets.base.benchmarks import random_client, random_rule
+from snippets.base.rules import CompiledRuleSet
+
+
+class Command(BaseCommand):
+    args = '(no args)'
+    help = 'Benchmark ClientMatchRule evaluation against CompiledRuleSet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rules', type=int, default=1000,
+                            help='Number of ClientMatchRules to evaluate')
+        parser.add_argument('--clients', type=int, default=1000,
+                            help='Number of clients to evaluate the rules against')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        rules = [random_rule(rule_id, rng) for rule_id in range(1, options['rules'] + 1)]
+        clients = [random_client(rng) for i in range(options['clients'])]
+
+        start = time.perf_counter()
+        expected = []
+        for client in clients:
+            expected.append(set(rule.id for rule in rules if rule.matches(client)))
+        per_rule_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        compiled_rules = CompiledRuleSet(rules)
+        compile_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        results = [compiled_rules.evaluate(client)[0] for client in clients]
+        compiled_time = time.perf_counter() - start
+
+        if results != expected:
+            raise CommandError('CompiledRuleSet disagrees with ClientMatchRule.matches.')
+
+        self.stdout.write(
+            'Rules: {rules}\n'
+            'Clients: {clients}\n'
+            'Per Rule Evaluation: {per_rule:.2f} ms/client\n'
+            'Compilation: {compile:.2f} ms\n'
+            'Compiled Evaluation: {compiled:.2f} ms/client\n'
+            'Speedup: {speedup:.1f}x\n'.format(
+                rules=len(rules),
+                clients=len(clients),
+                per_rule=per_rule_time * 1000 / len(clients),
+                compile=compile_time * 1000,
+                compiled=compiled_time * 1000 / len(clients),
+                speedup=per_rule_time / compiled_time))
@@ -0,0 +1,54 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from snippets.base.models import STATUS_CHOICES, ASRSnippet, load_subtemplates
+
+
+class Command(BaseCommand):
+    args = '(no args)'
+    help = 'Benchmark queries of loading subtemplates one by one against in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--snippets', type=int, default=500,
+                            help='Maximum number of published ASRSnippets to load')
+
+    def get_templates(self, count):
+        snippets = (ASRSnippet.objects
+                    .filter(status=STATUS_CHOICES['Published'], template_relation__isnull=False)
+                    .select_related('template_relation')
+                    .order_by('id')[:count])
+        return [snippet.template_relation for snippet in snippets]
+
+    def handle(self, *args, **options):
+        templates = self.get_templates(options['snippets'])
+        with CaptureQueriesContext(connection) as one_by_one_queries:
+            start = time.perf_counter()
+            expected = [template.subtemplate for template in templates]
+            one_by_one_time = time.perf_counter() - start
+
+        templates = self.get_templates(options['snippets'])
+        with CaptureQueriesContext(connection) as batched_queries:
+            start = time.perf_counter()
+            load_subtemplates(templates)
+            results = [template.subtemplate for template in templates]
+            batched_time = time.perf_counter() - start
+
+        if [(type(t), t.pk) for t in results] != [(type(t), t.pk) for t in expected]:
+            raise CommandError('Batched loading produced different subtemplates.')
+
+        self.stdout.write(
+            'Snippets: {snippets}\n'
+            'Template Types: {types}\n'
+            'One By One Queries: {one_by_one_queries}\n'
+            'One By One Time: {one_by_one_time:.2f} ms\n'
+            'Batched Queries: {batched_queries}\n'
+            'Batched Time: {batched_time:.2f} ms\n'.format(
+                snippets=len(templates),
+                types=len(set(type(template) for template in results)),
+                one_by_one_queries=len(one_by_one_queries),
+                one_by_one_time=one_by_one_time * 1000,
+                batched_queries=len(batched_queries),
+                batched_time=batched_time * 1000))
@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from snippets.base.managers import LANGUAGE_VALUES
+from snippets.base.models import CHANNELS, Client
+from snippets.base.targeting import asr_index
+
+
+class Command(BaseCommand):
+    args = '(no args)'
+    help = 'Verify that the ASRSnippet targeting index agrees with the database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--firefox-version', default='64.0',
+                            help='Firefox version of the clients to check')
+
+    def handle(self, *args, **options):
+        asr_index.build()
+
+        channels = list(CHANNELS) + ['default', 'unknown']
+        locales = LANGUAGE_VALUES + ['xx']
+        checked = 0
+        errors = []
+        for channel in channels:
+            for locale in locales:
+                client = Client(6, 'Firefox', options['firefox_version'], 'default',
+                                'default', locale, channel, 'default', 'default', 'default')
+                missing, unexpected = asr_index.verify(client)
+                checked += 1
+                if missing or unexpected:
+                    errors.append(
+                        '{channel}/{locale}: missing {missing}, unexpected {unexpected}'.format(
+                            channel=channel, locale=locale,
+                            missing=sorted(missing), unexpected=sorted(unexpected)))
+
+        for error in errors:
+            self.stderr.write(error)
+
+        self.stdout.write(
+            'Clients Checked: {checked}\n'
+            'Inconsistent Clients: {errors}\n'.format(checked=checked, errors=len(errors)))
+
+        if errors:
+            raise CommandError('Targeting index is inconsistent with the database.')
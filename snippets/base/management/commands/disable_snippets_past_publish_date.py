@@ -3,6 +3,7 @@ from datetime import datetime
 from django.core.management.base import BaseCommand
 from django.db import transaction
 
+from snippets.base import invalidation
 from snippets.base.models import STATUS_CHOICES, ASRSnippet, Snippet
 
 
@@ -24,6 +25,8 @@ class Command(BaseCommand):
         snippets = ASRSnippet.objects.filter(status=STATUS_CHOICES['Published'],
                                              publish_end__lte=now)
         disabled = snippets.update(status=STATUS_CHOICES['Approved'])
+        # update() doesn't send post_save signals.
+        invalidation.invalidate_index()
         running = ASRSnippet.objects.filter(status=STATUS_CHOICES['Published']).count()
 
         self.stdout.write(
@@ -8,7 +8,7 @@ from django.core.management.base import BaseCommand
 from django.utils import timezone
 from django.core.files.base import ContentFile
 
-from snippets.base.models import ASRSnippet
+from snippets.base.models import ASRSnippet, load_subtemplates
 
 
 class Command(BaseCommand):
@@ -16,7 +16,12 @@ class Command(BaseCommand):
     help = 'Export snippets to CSV'
 
     def handle(self, *args, **options):
-        snippets = ASRSnippet.objects.filter(for_qa=False).order_by('id')
+        snippets = (ASRSnippet.objects
+                    .filter(for_qa=False)
+                    .select_related('campaign', 'category', 'template_relation')
+                    .order_by('id'))
+        load_subtemplates(snippet.template_relation for snippet in snippets
+                          if hasattr(snippet, 'template_relation'))
 
         csvfile = io.StringIO()
         csvwriter = csv.writer(csvfile, dialect=csv.excel, quoting=csv.QUOTE_ALL)
@@ -0,0 +1,163 @@
+import multiprocessing
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from product_details import product_details
+
+from snippets.base import util
+from snippets.base.bundles import get_bundle
+from snippets.base.locks import NoGenerationSlot
+from snippets.base.models import CHANNELS, BundleManifestEntry, Client, ClientMatchRule
+
+
+def generate_bundle(client):
+    """
+    Generate the bundle of client, like a queued bundle, and return the
+    number of bytes written.
+
+    Returns None if another process generated the bundle instead or no
+    generation slot freed up in time.
+    """
+    bundle = get_bundle(client)
+    try:
+        if not bundle.ensure_generated():
+            return None
+    except NoGenerationSlot:
+        return None
+    return (BundleManifestEntry.objects
+            .filter(key=bundle.key)
+            .values_list('size', flat=True)
+            .first())
+
+
+def get_rule_variants():
+    """
+    Return dicts of Client fields that satisfy each ClientMatchRule, and the
+    regex and exclusion rules that got skipped.
+
+    Only rules that match on plain strings can be satisfied this way. Clients
+    that pass regex and exclusion rules are covered by the base client
+    configurations, as far as their fields are enumerated.
+    """
+    variants = []
+    skipped = list(ClientMatchRule.objects.filter(is_exclusion=True))
+    for rule in ClientMatchRule.objects.filter(is_exclusion=False):
+        fields = {}
+        for field in Client._fields:
+            field_value = getattr(rule, field, None)
+            if field_value:
+                fields[field] = field_value
+
+        # Clients send the startpage version as a number, so string rules on
+        # it never match ASR clients.
+        fields.pop('startpage_version', None)
+        if any(value.startswith('/') for value in fields.values()):
+            skipped.append(rule)
+        elif fields:
+            variants.append(fields)
+    return variants, skipped
+
+
+def get_clients(versions, rule_variants):
+    """
+    Return a client for every reachable client configuration.
+
+    That's every channel, locale and startpage version combination for each
+    of versions. ASR clients additionally get a variant for each of
+    rule_variants, see get_rule_variants.
+    """
+    locales = list(product_details.languages.keys())
+
+    clients = []
+    seen = set()
+    for startpage_version in (4, 5, 6):
+        for version in versions:
+            for channel in CHANNELS:
+                for locale in locales:
+                    client = Client(startpage_version, 'Firefox', version, 'default', 'default',
+                                    locale, channel, 'default', 'default', 'default')
+                    variants = [client]
+                    if startpage_version == 6:
+                        variants.extend(client._replace(**fields) for fields in rule_variants)
+
+                    for variant in variants:
+                        if variant not in seen:
+                            seen.add(variant)
+                            clients.append(variant)
+    return clients
+
+
+class Command(BaseCommand):
+    args = '(no args)'
+    help = 'Generate the bundles of all client configurations that are not generated yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--firefox-versions', nargs='+',
+                            help='Firefox versions of the clients, defaults to the current one')
+        parser.add_argument('--processes', type=int,
+                            default=settings.BUNDLE_GENERATION_CONCURRENCY,
+                            help='Number of worker processes to generate bundles with, '
+                                 'defaults to BUNDLE_GENERATION_CONCURRENCY')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only report the bundles that would be generated')
+
+    def handle(self, *args, **options):
+        start = time.time()
+
+        versions = (options['firefox_versions'] or
+                    ['{0}.0'.format(util.current_firefox_major_version())])
+        rule_variants, skipped_rules = get_rule_variants()
+        clients = get_clients(versions, rule_variants)
+
+        keys = set()
+        empty = cached = 0
+        missing = []
+        for client in clients:
+            bundle = get_bundle(client)
+            if bundle.empty:
+                empty += 1
+                continue
+
+            if bundle.key in keys:
+                continue
+            keys.add(bundle.key)
+
+            if bundle.cached:
+                cached += 1
+            else:
+                missing.append(client)
+
+        sizes = []
+        if not options['dry_run']:
+            if options['processes'] > 1 and len(missing) > 1:
+                # Worker processes must not share the database connections
+                # of this process.
+                connections.close_all()
+                with multiprocessing.Pool(options['processes']) as pool:
+                    sizes = pool.map(generate_bundle, missing)
+            else:
+                sizes = [generate_bundle(client) for client in missing]
+            sizes = [size for size in sizes if size is not None]
+
+        self.stdout.write(
+            'Clients: {clients}\n'
+            'Skipped Client Match Rules: {skipped_rules}\n'
+            'Empty Clients: {empty}\n'
+            'Bundles: {bundles}\n'
+            'Cached Bundles: {cached}\n'
+            'Missing Bundles: {missing}\n'
+            'Generated Bundles: {generated}\n'
+            'Generated Bytes: {size}\n'
+            'Time: {time:.2f}s\n'.format(
+                clients=len(clients),
+                skipped_rules=len(skipped_rules),
+                empty=empty,
+                bundles=len(keys),
+                cached=cached,
+                missing=len(missing),
+                generated=len(sizes),
+                size=sum(sizes),
+                time=time.time() - start))
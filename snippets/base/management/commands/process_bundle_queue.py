@@ -0,0 +1,46 @@
+import logging
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from django_statsd.clients import statsd
+
+from snippets.base.queues import get_queue, process
+
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    args = '(no args)'
+    help = 'Generate the bundles queued for background generation'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-tasks', type=int, default=0,
+                            help='Exit after processing this many tasks, 0 for no limit')
+        parser.add_argument('--timeout', type=int, default=5,
+                            help='Seconds to wait for a task before checking the queue again')
+
+    def handle(self, *args, **options):
+        bundle_queue = get_queue()
+        if bundle_queue is None:
+            raise CommandError('BUNDLE_QUEUE is disabled.')
+
+        processed = 0
+        while not options['max_tasks'] or processed < options['max_tasks']:
+            statsd.gauge('bundle.queue.depth', bundle_queue.depth())
+            task = bundle_queue.get(timeout=options['timeout'])
+            if task is None:
+                if options['max_tasks']:
+                    break
+                continue
+
+            try:
+                process(task)
+            except Exception:
+                logger.exception('Failed to generate queued bundle.')
+            finally:
+                close_old_connections()
+            processed += 1
+
+        self.stdout.write('Processed Tasks: {processed}\n'.format(processed=processed))
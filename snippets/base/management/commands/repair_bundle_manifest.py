@@ -0,0 +1,73 @@
+import re
+from urllib.parse import urljoin
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from snippets.base import manifest
+from snippets.base.bundles import ENCODING_SUFFIXES
+from snippets.base.models import BundleManifestEntry
+
+
+BUNDLE_FILENAME_RE = re.compile(
+    r'^bundle_(?P<key>[0-9a-f]{40})\.(html|json)(?P<suffix>\.br|\.gz)?$')
+SUFFIX_ENCODINGS = dict((suffix, encoding) for encoding, suffix in ENCODING_SUFFIXES.items())
+
+
+def list_bundles():
+    """
+    Return a dict of the bundles saved to storage by key.
+
+    Only bundles with an uncompressed variant count as saved, since that gets
+    saved last.
+    """
+    bundles = {}
+    for filename in default_storage.listdir(settings.MEDIA_BUNDLES_ROOT)[1]:
+        match = BUNDLE_FILENAME_RE.match(filename)
+        if not match:
+            continue
+
+        path = urljoin(settings.MEDIA_BUNDLES_ROOT, filename)
+        bundle = bundles.setdefault(match.group('key'), {'size': 0, 'encodings': []})
+        bundle['size'] += default_storage.size(path)
+        bundle['encodings'].append(SUFFIX_ENCODINGS[match.group('suffix') or ''])
+        if match.group('suffix') is None:
+            bundle['filename'] = path
+            bundle['generated'] = default_storage.get_modified_time(path)
+
+    return dict((key, bundle) for key, bundle in bundles.items() if 'filename' in bundle)
+
+
+class Command(BaseCommand):
+    args = '(no args)'
+    help = 'Rebuild the bundle manifest from the bundles in storage'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only report the entries that would be added and removed')
+
+    def handle(self, *args, **options):
+        bundles = list_bundles()
+        recorded = set(BundleManifestEntry.objects.values_list('key', flat=True))
+        missing = [key for key in bundles if key not in recorded]
+        stale = [key for key in recorded if key not in bundles]
+
+        if not options['dry_run']:
+            BundleManifestEntry.objects.bulk_create([
+                BundleManifestEntry(key=key,
+                                    filename=bundles[key]['filename'],
+                                    size=bundles[key]['size'],
+                                    encodings=','.join(sorted(bundles[key]['encodings'])),
+                                    generated=bundles[key]['generated'])
+                for key in missing
+            ], batch_size=1000)
+            manifest.discard(stale)
+
+        self.stdout.write(
+            'Bundles in Storage: {bundles}\n'
+            'Added Entries: {added}\n'
+            'Removed Entries: {removed}\n'.format(
+                bundles=len(bundles),
+                added=len(missing),
+                removed=len(stale)))
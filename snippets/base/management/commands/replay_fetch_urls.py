@@ -0,0 +1,197 @@
+import math
+import os
+import random
+import re
+import subprocess
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote, urljoin, urlparse
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import Resolver404, resolve, reverse
+
+import requests
+
+from snippets.base.benchmarks import random_client
+from snippets.base.views import fetch_json_snippets, fetch_snippets
+
+
+# The request path of access log lines, e.g. `"GET /6/Firefox/... HTTP/1.1"`.
+ACCESS_LOG_PATH_RE = re.compile(r'"(?:GET|HEAD) (\S+) HTTP/[\d.]+"')
+# Outcomes of bundle requests, as counted by the bundle.* statsd counters.
+OUTCOMES = ('cached', 'generate', 'stale', 'empty', 'busy')
+SERVER_START_TIMEOUT = 30
+
+
+def is_fetch_path(path):
+    """Return whether path gets served by fetch_snippets or fetch_json_snippets."""
+    try:
+        match = resolve(unquote(urlparse(path).path))
+    except Resolver404:
+        return False
+    return match.func in (fetch_snippets, fetch_json_snippets)
+
+
+def read_paths(filename):
+    """
+    Return the fetch paths in filename, which is either an access log or
+    has one path per line.
+    """
+    paths = []
+    with open(filename) as log_file:
+        for line in log_file:
+            match = ACCESS_LOG_PATH_RE.search(line)
+            path = match.group(1) if match else line.strip()
+            if is_fetch_path(path):
+                paths.append(path)
+    return paths
+
+
+def synthetic_paths(count, rng):
+    """Return count fetch paths of random Activity Stream Router clients."""
+    return [reverse('base.fetch_snippets', kwargs=random_client(rng)._asdict())
+            for i in range(count)]
+
+
+def percentile(values, percent):
+    """Return the nearest-rank percentile of the sorted values."""
+    if not values:
+        return 0
+    rank = max(math.ceil(percent / 100 * len(values)) - 1, 0)
+    return values[rank]
+
+
+class Command(BaseCommand):
+    args = '(no args)'
+    help = ('Replay fetch URLs against a running server and report throughput, latency, '
+            'bundle outcomes and queries per request')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--urls-file',
+                            help='Access log or file with one fetch path per line. '
+                                 'Synthetic paths get generated without it.')
+        parser.add_argument('--synthetic', type=int, default=1000,
+                            help='Number of synthetic paths to generate')
+        parser.add_argument('--requests', type=int, default=None,
+                            help='Number of requests to send, cycling through the paths. '
+                                 'Defaults to one per path.')
+        parser.add_argument('--warmup', type=int, default=0,
+                            help='Number of requests to send before measuring. Leave at 0 '
+                                 'with --start-server to measure the cold start of workers.')
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+        parser.add_argument('--start-server', action='store_true',
+                            help='Start gunicorn with snippets/wsgi/config.py on the port '
+                                 'of --base-url for the replay')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def start_server(self, base_url):
+        """
+        Start gunicorn the way bin/run-prod.sh does, with the load replay
+        headers enabled, and wait until it serves requests.
+
+        The server inherits the environment, so DATABASE_URL=sqlite:///...
+        and the default locmem cache work for replaying on a laptop.
+        """
+        env = dict(os.environ, PORT=str(urlparse(base_url).port or 80),
+                   LOAD_REPLAY_HEADERS='True')
+        server = subprocess.Popen(
+            ['gunicorn', 'snippets.wsgi.app', '--config', 'snippets/wsgi/config.py',
+             '--access-logfile', os.devnull],
+            cwd=settings.ROOT, env=env)
+
+        deadline = time.time() + SERVER_START_TIMEOUT
+        while time.time() < deadline:
+            if server.poll() is not None:
+                raise CommandError('gunicorn exited with {0}.'.format(server.returncode))
+            try:
+                requests.get(urljoin(base_url, '/healthz/'), timeout=1)
+                return server
+            except requests.ConnectionError:
+                time.sleep(0.2)
+
+        server.terminate()
+        raise CommandError('gunicorn did not start within {0} seconds.'.format(
+            SERVER_START_TIMEOUT))
+
+    def replay(self, base_url, paths, concurrency):
+        """Request paths and return a dict of measurements for each request."""
+        local = threading.local()
+
+        def fetch(path):
+            if not hasattr(local, 'session'):
+                local.session = requests.Session()
+            start = time.perf_counter()
+            response = local.session.get(urljoin(base_url, path), allow_redirects=False,
+                                         headers={'Accept-Encoding': 'br, gzip'})
+            return {
+                'latency': time.perf_counter() - start,
+                'status': response.status_code,
+                'outcome': response.headers.get('X-Bundle-Outcome'),
+                'queries': response.headers.get('X-DB-Queries'),
+            }
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            return list(executor.map(fetch, paths))
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        if options['urls_file']:
+            paths = read_paths(options['urls_file'])
+        else:
+            paths = synthetic_paths(options['synthetic'], rng)
+        if not paths:
+            raise CommandError('No fetch URLs to replay.')
+
+        count = options['requests'] or len(paths)
+        warmup_paths = [paths[i % len(paths)] for i in range(options['warmup'])]
+        paths = [paths[i % len(paths)] for i in range(count)]
+
+        server = self.start_server(options['base_url']) if options['start_server'] else None
+        try:
+            self.replay(options['base_url'], warmup_paths, options['concurrency'])
+            start = time.perf_counter()
+            results = self.replay(options['base_url'], paths, options['concurrency'])
+            duration = time.perf_counter() - start
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait()
+
+        latencies = sorted(result['latency'] * 1000 for result in results)
+        # The first requests of each worker pay for its cold start.
+        first_latency = max(result['latency'] * 1000
+                            for result in results[:options['concurrency']])
+        statuses = Counter(result['status'] for result in results)
+        outcomes = Counter(result['outcome'] for result in results)
+        queries = [int(result['queries']) for result in results
+                   if result['queries'] is not None]
+        if not queries:
+            self.stderr.write('No query counts reported, is LOAD_REPLAY_HEADERS enabled '
+                              'on the server?')
+
+        self.stdout.write(
+            'Requests: {requests}\n'
+            'Throughput: {throughput:.1f} req/s\n'
+            'Latency p50: {p50:.2f} ms\n'
+            'Latency p95: {p95:.2f} ms\n'
+            'Latency p99: {p99:.2f} ms\n'
+            'First Requests Latency: {first_latency:.2f} ms max\n'
+            'Statuses: {statuses}\n'
+            '{outcomes}'
+            'Queries per Request: {queries_mean:.2f} mean, {queries_max} max\n'.format(
+                requests=len(results),
+                throughput=len(results) / duration,
+                p50=percentile(latencies, 50),
+                p95=percentile(latencies, 95),
+                p99=percentile(latencies, 99),
+                first_latency=first_latency,
+                statuses=', '.join('{0}: {1}'.format(status, number)
+                                   for status, number in sorted(statuses.items())),
+                outcomes=''.join('Bundle {0}: {1}\n'.format(outcome, outcomes[outcome])
+                                 for outcome in OUTCOMES),
+                queries_mean=sum(queries) / max(len(queries), 1),
+                queries_max=max(queries, default=0)))
@@ -0,0 +1,63 @@
+import difflib
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from snippets.base.models import STATUS_CHOICES, ASRSnippet, Snippet
+from snippets.base.rendering import (get_render_key, load_for_rendering, render_to_json,
+                                     store_renderings)
+
+
+def diff_renderings(stored, rendered):
+    """Return the lines of a diff between two renderings."""
+    def lines(rendering):
+        return json.dumps(json.loads(rendering), indent=2, sort_keys=True).splitlines()
+    return difflib.unified_diff(lines(stored), lines(rendered), 'stored', 'rendered', lineterm='')
+
+
+class Command(BaseCommand):
+    args = '(no args)'
+    help = 'Re-render published snippets and compare them with their stored renderings'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--update', action='store_true',
+                            help='Store the renderings of stale and mismatched snippets')
+
+    def handle(self, *args, **options):
+        querysets = [
+            Snippet.objects.filter(published=True),
+            ASRSnippet.objects.filter(status=STATUS_CHOICES['Published']),
+        ]
+        checked = 0
+        stale = []
+        mismatched = []
+        for queryset in querysets:
+            for snippet in load_for_rendering(queryset):
+                checked += 1
+                if not snippet.rendered or snippet.rendered_key != get_render_key(snippet):
+                    stale.append(snippet)
+                    continue
+
+                rendered = render_to_json(snippet)
+                if rendered != snippet.rendered:
+                    mismatched.append(snippet)
+                    self.stderr.write('{model} {id}:'.format(model=type(snippet).__name__,
+                                                             id=snippet.id))
+                    for line in diff_renderings(snippet.rendered, rendered):
+                        self.stderr.write(line)
+
+        if options['update']:
+            store_renderings(stale + mismatched)
+
+        self.stdout.write(
+            'Snippets Checked: {checked}\n'
+            'Stale Renderings: {stale}\n'
+            'Mismatched Renderings: {mismatched}\n'
+            'Updated Renderings: {updated}\n'.format(
+                checked=checked,
+                stale=len(stale),
+                mismatched=len(mismatched),
+                updated=len(stale) + len(mismatched) if options['update'] else 0))
+
+        if mismatched and not options['update']:
+            raise CommandError('Stored renderings differ from the snippets.')
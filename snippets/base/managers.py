@@ -1,16 +1,70 @@
-from datetime import datetime
-
 from django.db.models import Manager
 from django.db.models.query import QuerySet
 
 from product_details import product_details
 
-from snippets.base.util import first
+from snippets.base.rules import CompiledRuleSet
+from snippets.base.util import filter_by_available, first
 
 
 LANGUAGE_VALUES = [key.lower() for key in product_details.languages.keys()]
 
 
+def get_client_channel(client):
+    """Return the channel in CHANNELS that matches the client's channel.
+
+    Retrieves the first channel that starts with the client's channel to allow
+    things like "release-cck-mozilla14" to match "release". Clients on the
+    "default" channel are treated as nightly.
+    """
+    from snippets.base.models import CHANNELS
+
+    if client.channel == 'default':
+        return 'nightly'
+    return first(CHANNELS, client.channel.startswith)
+
+
+def get_client_locales(client):
+    """Return the values in LANGUAGE_VALUES that match the client's locale."""
+    return list(filter(client.locale.lower().startswith, LANGUAGE_VALUES))
+
+
+def get_passing_snippet_ids(snippets, rules_lookup, client):
+    """Return the ids of snippets that pass all of their ClientMatchRules.
+
+    Fetches the candidate snippets together with their rules in a single
+    query, with one row per snippet and rule, and evaluates the rules in
+    python. The candidates get selected in a subquery so that the rules
+    join isn't restricted by the filters of snippets.
+
+    `rules_lookup` is the lookup path from the snippet model to its
+    ClientMatchRules, e.g. `client_match_rules`.
+    """
+    from snippets.base.models import Client, ClientMatchRule
+
+    rule_fields = ('id', 'is_exclusion') + Client._fields
+    rows = (snippets.model.objects
+            .filter(id__in=snippets.values('id'))
+            .order_by()
+            .values_list('id', *['{0}__{1}'.format(rules_lookup, field)
+                                 for field in rule_fields]))
+
+    rules = {}
+    snippet_rules = {}
+    for row in rows:
+        snippet_id, rule_id = row[0], row[1]
+        rule_ids = snippet_rules.setdefault(snippet_id, set())
+        if rule_id is None:
+            continue
+        if rule_id not in rules:
+            rules[rule_id] = ClientMatchRule(**dict(zip(rule_fields, row[1:])))
+        rule_ids.add(rule_id)
+
+    passed_rules, failed_rules = CompiledRuleSet(rules.values()).evaluate(client)
+    return [snippet_id for snippet_id, rule_ids in snippet_rules.items()
+            if not rule_ids & failed_rules]
+
+
 class ClientMatchRuleQuerySet(QuerySet):
     def evaluate(self, client):
         passed_rules, failed_rules = [], []
@@ -28,32 +82,18 @@ class ClientMatchRuleManager(Manager):
 
 
 class SnippetQuerySet(QuerySet):
-    def filter_by_available(self):
+    def filter_by_available(self, now=None):
         """Datetime filtering of snippets.
 
         Filter by date in python to avoid caching based on the passing
-        of time.
+        of time. See snippets.base.util.filter_by_available.
         """
-        now = datetime.utcnow()
-        matching_snippets = [
-            snippet for snippet in self if
-            (not snippet.publish_start or snippet.publish_start <= now) and
-            (not snippet.publish_end or snippet.publish_end >= now)
-        ]
-        return matching_snippets
+        return filter_by_available(self, now)
 
     def match_client(self, client):
-        from snippets.base.models import CHANNELS, JSONSnippet, ClientMatchRule
-
         filters = {}
 
-        # Retrieve the first channel that starts with the client's channel.
-        # Allows things like "release-cck-mozilla14" to match "release".
-        if client.channel == 'default':
-            client_channel = 'nightly'
-        else:
-            client_channel = first(CHANNELS, client.channel.startswith)
-
+        client_channel = get_client_channel(client)
         if client_channel:
             filters.update(**{'on_{0}'.format(client_channel): True})
 
@@ -63,7 +103,7 @@ class SnippetQuerySet(QuerySet):
                 **{startpage_field: True})
 
         # Only filter by locale if they pass a valid locale.
-        locales = list(filter(client.locale.lower().startswith, LANGUAGE_VALUES))
+        locales = get_client_locales(client)
         if locales:
             filters.update(locales__code__in=locales)
         else:
@@ -71,19 +111,10 @@ class SnippetQuerySet(QuerySet):
             # locales specified.
             filters.update(locales__isnull=True)
 
-        snippets = self.filter(**filters).distinct()
-        if issubclass(self.model, JSONSnippet):
-            filtering = {'jsonsnippet__in': snippets}
-        else:
-            filtering = {'snippet__in': snippets}
-
         # Filter based on ClientMatchRules
-        passed_rules, failed_rules = (ClientMatchRule.objects
-                                      .filter(**filtering)
-                                      .distinct()
-                                      .evaluate(client))
-
-        return snippets.exclude(client_match_rules__in=failed_rules)
+        snippet_ids = get_passing_snippet_ids(self.filter(**filters),
+                                              'client_match_rules', client)
+        return self.filter(id__in=snippet_ids)
 
 
 class SnippetManager(Manager):
@@ -95,54 +126,36 @@ class SnippetManager(Manager):
 
 
 class ASRSnippetQuerySet(QuerySet):
-    def filter_by_available(self):
+    def filter_by_available(self, now=None):
         """Datetime filtering of snippets.
 
         Filter by date in python to avoid caching based on the passing
-        of time.
+        of time. See snippets.base.util.filter_by_available.
         """
-        now = datetime.utcnow()
-        matching_snippets = [
-            snippet for snippet in self if
-            (not snippet.publish_start or snippet.publish_start <= now) and
-            (not snippet.publish_end or snippet.publish_end >= now)
-        ]
-        return matching_snippets
+        return filter_by_available(self, now)
 
     def match_client(self, client):
-        from snippets.base.models import CHANNELS, ClientMatchRule, Target
-
-        snippet_filters = {}
-        target_filters = {}
+        filters = {}
 
-        # Retrieve the first channel that starts with the client's channel.
-        # Allows things like "release-cck-mozilla14" to match "release".
-        if client.channel == 'default':
-            client_channel = 'nightly'
-        else:
-            client_channel = first(CHANNELS, client.channel.startswith)
+        client_channel = get_client_channel(client)
         if client_channel:
-            target_filters.update(**{'on_{0}'.format(client_channel): True})
-        targets = Target.objects.filter(**target_filters).distinct()
+            filters.update(**{'targets__on_{0}'.format(client_channel): True})
+        else:
+            filters.update(targets__isnull=False)
 
         # Only filter by locale if they pass a valid locale.
-        locales = list(filter(client.locale.lower().startswith, LANGUAGE_VALUES))
+        locales = get_client_locales(client)
         if locales:
-            snippet_filters.update(locales__code__in=locales)
+            filters.update(locales__code__in=locales)
         else:
             # If the locale is invalid, only match snippets with no
             # locales specified.
-            snippet_filters.update(locales__isnull=True)
-
-        snippets = self.filter(**snippet_filters).filter(targets__in=targets)
+            filters.update(locales__isnull=True)
 
         # Filter based on ClientMatchRules
-        passed_rules, failed_rules = (ClientMatchRule.objects
-                                      .filter(target__asrsnippet__in=snippets)
-                                      .distinct()
-                                      .evaluate(client))
-
-        return snippets.exclude(targets__client_match_rules__in=failed_rules)
+        snippet_ids = get_passing_snippet_ids(self.filter(**filters),
+                                              'targets__client_match_rules', client)
+        return self.filter(id__in=snippet_ids)
 
 
 class ASRSnippetManager(Manager):
@@ -0,0 +1,128 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F
+from django.utils import timezone
+
+from snippets.base.models import BundleManifestEntry
+
+
+logger = logging.getLogger(__name__)
+
+ONE_DAY = 60 * 60 * 24
+CACHE_KEY = 'bundle_manifest_{0}'
+
+
+class LocalKeys(object):
+    """
+    Keys of the bundles this process knows to be saved to storage.
+
+    Bundles never change once saved, so keys only go stale when bundles get
+    removed from storage by another process, see `./manage.py
+    repair_bundle_manifest`. Keys get forgotten BUNDLE_MANIFEST_LOCAL_TIMEOUT
+    seconds after they got added, and the least recently used ones once
+    there are more than BUNDLE_MANIFEST_LOCAL_MAX_KEYS.
+    """
+    def __init__(self):
+        # Times the keys expire at, by key.
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self.lock:
+            expires = self.entries.get(key)
+            if expires is None:
+                return False
+            if expires < time.time():
+                del self.entries[key]
+                return False
+            self.entries.move_to_end(key)
+            return True
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, key):
+        self.update([key])
+
+    def update(self, keys):
+        expires = time.time() + settings.BUNDLE_MANIFEST_LOCAL_TIMEOUT
+        with self.lock:
+            for key in keys:
+                self.entries[key] = expires
+                self.entries.move_to_end(key)
+            while len(self.entries) > settings.BUNDLE_MANIFEST_LOCAL_MAX_KEYS:
+                self.entries.popitem(last=False)
+
+    def difference_update(self, keys):
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+_keys = LocalKeys()
+
+
+def warm():
+    """Load the keys of the bundles generated during the last day."""
+    since = timezone.now() - timedelta(seconds=ONE_DAY)
+    try:
+        _keys.update(BundleManifestEntry.objects
+                     .filter(generated__gte=since)
+                     .values_list('key', flat=True))
+    except Exception:
+        # Keys get looked up in the cache and the database on demand anyway.
+        logger.exception('Failed to load the bundle manifest.')
+
+
+def exists(key):
+    """
+    Return whether the bundle with key is saved to storage.
+
+    The bundle gets looked up in this process, the cache and the database,
+    in that order, but never in storage.
+    """
+    if key in _keys:
+        return True
+
+    cache_key = CACHE_KEY.format(key)
+    if not cache.get(cache_key):
+        if not BundleManifestEntry.objects.filter(key=key).exists():
+            return False
+        cache.set(cache_key, True, ONE_DAY)
+
+    _keys.add(key)
+    return True
+
+
+def record(key, filename, size, encodings):
+    """Add the bundle with key that got saved to storage to the manifest."""
+    BundleManifestEntry.objects.update_or_create(key=key, defaults={
+        'filename': filename,
+        'size': size,
+        'encodings': ','.join(encodings),
+        'generated': timezone.now(),
+    })
+    cache.set(CACHE_KEY.format(key), True, ONE_DAY)
+    _keys.add(key)
+
+
+def record_recompressed(key, bytes_saved):
+    """Update the size of the bundle with key after recompressing it."""
+    BundleManifestEntry.objects.filter(key=key).update(size=F('size') - bytes_saved)
+
+
+def discard(keys):
+    """Remove the bundles with keys, which are not in storage, from the manifest."""
+    BundleManifestEntry.objects.filter(key__in=keys).delete()
+    cache.delete_many([CACHE_KEY.format(key) for key in keys])
+    _keys.difference_update(keys)
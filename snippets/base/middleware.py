@@ -1,6 +1,7 @@
 from django.conf import settings
 from django.core.exceptions import MiddlewareNotUsed
 from django.core.validators import validate_ipv4_address, ValidationError
+from django.db import connection
 from django.http.request import split_domain_port
 from django.urls import Resolver404, resolve
 
@@ -36,6 +37,37 @@ class FetchSnippetsMiddleware(object):
         return self.get_response(request)
 
 
+class LoadReplayMiddleware(object):
+    """
+    Add the number of database queries of the request and, for fetch
+    requests, how the bundle got served to the response headers.
+
+    Used by `./manage.py replay_fetch_urls` and only enabled with
+    LOAD_REPLAY_HEADERS. Must come before FetchSnippetsMiddleware.
+    """
+    def __init__(self, get_response):
+        if not settings.LOAD_REPLAY_HEADERS:
+            raise MiddlewareNotUsed
+
+        self.get_response = get_response
+
+    def __call__(self, request):
+        queries = []
+
+        def count_query(execute, sql, params, many, context):
+            queries.append(sql)
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(count_query):
+            response = self.get_response(request)
+
+        response['X-DB-Queries'] = str(len(queries))
+        outcome = getattr(request, 'bundle_outcome', None)
+        if outcome:
+            response['X-Bundle-Outcome'] = outcome
+        return response
+
+
 class HostnameMiddleware(object):
     def __init__(self, get_response):
         if not settings.ENABLE_HOSTNAME_MIDDLEWARE:
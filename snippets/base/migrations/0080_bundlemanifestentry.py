@@ -0,0 +1,28 @@
+# Generated by Django 2.1.7 on 2019-04-02 12:00
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0079_simpletemplate_button_background_color'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BundleManifestEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=40, unique=True)),
+                ('filename', models.CharField(max_length=255)),
+                ('size', models.PositiveIntegerField(default=0, help_text='Bytes saved, summed over all encodings.')),
+                ('encodings', models.CharField(help_text='Comma separated.', max_length=255)),
+                ('generated', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name_plural': 'bundle manifest entries',
+            },
+        ),
+    ]
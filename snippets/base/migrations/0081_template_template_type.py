@@ -0,0 +1,42 @@
+# Generated by Django 2.1.7 on 2019-04-09 12:00
+
+from django.db import migrations, models
+
+
+TEMPLATE_TYPES = [
+    'simpletemplate',
+    'fundraisingtemplate',
+    'fxasignuptemplate',
+    'newslettertemplate',
+    'sendtodevicetemplate',
+]
+
+
+def set_template_type(apps, schema_editor):
+    Template = apps.get_model('base', 'Template')
+
+    for template_type in TEMPLATE_TYPES:
+        Subtemplate = apps.get_model('base', template_type)
+        (Template.objects
+         .filter(id__in=Subtemplate.objects.values('template_ptr_id'))
+         .update(template_type=template_type))
+
+
+def noop(apps, schema_editor):
+    pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0080_bundlemanifestentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='template',
+            name='template_type',
+            field=models.CharField(blank=True, editable=False, max_length=50),
+        ),
+        migrations.RunPython(set_template_type, noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 2.1.7 on 2019-04-12 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0081_template_template_type'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='asrsnippet',
+            name='rendered',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='asrsnippet',
+            name='rendered_key',
+            field=models.CharField(blank=True, editable=False, max_length=40),
+        ),
+        migrations.AddField(
+            model_name='snippet',
+            name='rendered',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='snippet',
+            name='rendered_key',
+            field=models.CharField(blank=True, editable=False, max_length=40),
+        ),
+    ]
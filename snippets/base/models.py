@@ -4,17 +4,17 @@ import json
 import os
 import re
 import uuid
-from collections import namedtuple
+from collections import defaultdict, namedtuple
 from datetime import datetime
 from functools import partial
-from urllib.parse import urljoin, urlparse
+from urllib.parse import urljoin
 
 from django.conf import settings
 from django.core import validators as django_validators
 from django.urls import reverse
 from django.db import models
 from django.db.models.manager import Manager
-from django.db.models.signals import post_save
+from django.db.models.signals import m2m_changed, post_save
 from django.dispatch import receiver
 from django.template import engines
 from django.utils import timezone
@@ -28,6 +28,8 @@ from jinja2.utils import LRUCache
 from snippets.base import util
 from snippets.base.fields import RegexField
 from snippets.base import managers
+from snippets.base import invalidation
+from snippets.base.storage import public_url
 from snippets.base.validators import validate_xml_template
 
 
@@ -97,23 +99,25 @@ class SnippetTemplate(models.Model):
     def __str__(self):
         return self.name
 
-    def render(self, ctx):
-        ctx.setdefault('snippet_id', 0)
-
+    def get_compiled(self):
+        """Return the compiled code of the template from template_cache."""
         # Check if template is in cache, and cache it if it's not.
         cache_key = hashlib.sha1(self.code.encode('utf-8')).hexdigest()
         template = template_cache.get(cache_key)
         if not template:
             template = JINJA_ENV.from_string(self.code)
             template_cache[cache_key] = template
-        return template.render(ctx)
+        return template
+
+    def render(self, ctx):
+        ctx.setdefault('snippet_id', 0)
+        return self.get_compiled().render(ctx)
 
     def get_rich_text_variables(self):
-        variables = (self.variable_set
-                     .filter(type__in=[SnippetTemplateVariable.RICH_TEXT,
-                                       SnippetTemplateVariable.BODY])
-                     .values_list('name', flat=True))
-        return variables
+        # Filter in Python, so that prefetched variables get used.
+        return [variable.name for variable in self.variable_set.all()
+                if variable.type in [SnippetTemplateVariable.RICH_TEXT,
+                                     SnippetTemplateVariable.BODY]]
 
 
 class SnippetTemplateVariable(models.Model):
@@ -285,6 +289,11 @@ class Snippet(SnippetBaseModel):
     created = models.DateTimeField(auto_now_add=True)
     modified = models.DateTimeField(auto_now=True)
 
+    # The snippet as rendered into bundles, stored whenever it changes. See
+    # snippets.base.rendering.store_rendered.
+    rendered = models.TextField(blank=True, editable=False)
+    rendered_key = models.CharField(max_length=40, blank=True, editable=False)
+
     client_options = django_mysql.models.DynamicField(
         default=None,
         spec={
@@ -496,12 +505,7 @@ class UploadedFile(models.Model):
 
     @property
     def url(self):
-        full_url = urljoin(settings.SITE_URL, self.file.url).split('?')[0]
-        cdn_url = getattr(settings, 'CDN_URL', None)
-        if cdn_url:
-            full_url = urljoin(cdn_url, urlparse(self.file.url).path)
-
-        return full_url
+        return public_url(self.file.storage, self.file.name)
 
     @property
     def snippets(self):
@@ -647,34 +651,28 @@ class Icon(models.Model):
 
     @property
     def url(self):
-        full_url = urljoin(settings.SITE_URL, self.image.url).split('?')[0]
-        cdn_url = getattr(settings, 'CDN_URL', None)
-        if cdn_url:
-            full_url = urljoin(cdn_url, urlparse(self.image.url).path)
-
-        return full_url
+        return public_url(self.image.storage, self.image.name)
 
     @property
     def snippets(self):
-        """Returns a Queryset of ASRSnippets using this icon. Needs this fancy code
-        b/c icons have multiple relations with multiple Templates.
+        """Returns a Queryset of ASRSnippets using this icon. See
+        get_icon_snippet_ids.
 
         """
-        all_snippets = []
-        for relation_name, relation in self._meta.fields_map.items():
-            if issubclass(relation.related_model, Template):
-                related_snippets = (getattr(self, relation_name)
-                                    .values_list('snippet__id', flat=True))
-
-                if related_snippets:
-                    all_snippets.extend(related_snippets)
-
-        return ASRSnippet.objects.filter(pk__in=all_snippets)
+        return ASRSnippet.objects.filter(pk__in=list(get_icon_snippet_ids([self.pk])))
 
 
 class Template(models.Model):
     snippet = models.OneToOneField('ASRSnippet', related_name='template_relation',
                                    on_delete=models.CASCADE)
+    # Model name of the subclass, so that subtemplates can be loaded without
+    # trying all subclasses one by one. See load_subtemplates.
+    template_type = models.CharField(max_length=50, blank=True, editable=False)
+
+    def save(self, *args, **kwargs):
+        if type(self) is not Template:
+            self.template_type = self._meta.model_name
+        super().save(*args, **kwargs)
 
     @property
     def subtemplate(self):
@@ -682,6 +680,9 @@ class Template(models.Model):
             # We 're already in the subclass
             return self
 
+        if self.template_type:
+            return getattr(self, self.template_type)
+
         for field in self._meta.fields_map.values():
             if issubclass(field.related_model, Template):
                 try:
@@ -729,6 +730,28 @@ class Template(models.Model):
         return url
 
 
+def load_subtemplates(templates):
+    """
+    Load the subtemplates of templates, together with their icons, with one
+    query per template type.
+
+    Getting the subtemplate of any of the templates or the icons of a
+    subtemplate afterwards doesn't query the database.
+    """
+    by_type = defaultdict(dict)
+    for template in templates:
+        if type(template) is Template and template.template_type:
+            by_type[template.template_type][template.pk] = template
+
+    for template_type, parents in by_type.items():
+        relation = Template._meta.fields_map[template_type]
+        model = relation.related_model
+        icon_fields = [field.name for field in model._meta.concrete_fields if field.many_to_one]
+        subtemplates = model.objects.filter(pk__in=list(parents)).select_related(*icon_fields)
+        for subtemplate in subtemplates:
+            relation.set_cached_value(parents[subtemplate.pk], subtemplate)
+
+
 class SimpleTemplate(Template):
     VERSION = '1.0.0'
 
@@ -1435,6 +1458,11 @@ class ASRSnippet(django_mysql.models.Model):
         verbose_name='For QA',
     )
 
+    # The snippet as rendered into bundles, stored whenever it changes. See
+    # snippets.base.rendering.store_rendered.
+    rendered = models.TextField(blank=True, editable=False)
+    rendered_key = models.CharField(max_length=40, blank=True, editable=False)
+
     objects = managers.ASRSnippetManager()
 
     class Meta:
@@ -1498,8 +1526,10 @@ class ASRSnippet(django_mysql.models.Model):
             if self.campaign:
                 rendered_snippet['campaign'] = self.campaign.slug
 
+            # Sort in python, so that prefetched targets get used.
+            targets = sorted(self.targets.all(), key=lambda target: target.id)
             rendered_snippet['targeting'] = ' && '.join(
-                [target.jexl_expr for target in self.targets.all().order_by('id')]
+                [target.jexl_expr for target in targets]
             )
 
         return rendered_snippet
@@ -1581,31 +1611,105 @@ class ASRSnippet(django_mysql.models.Model):
         return export
 
 
-# We could connect the signal to specific senders using `sender` argument but
-# we would have to connect each template class separately which will create
-# another thing to do when we add more templates and that can be potentially
-# forgotten. Instead we're collecting all signals and we do instance type
-# checking.
-@receiver(post_save, dispatch_uid='update_asrsnippet_modified')
-def update_asrsnippet_modified_date(sender, instance, **kwargs):
-    now = timezone.now()
-    snippets = None
-
-    if isinstance(instance, Template):
-        snippets = [instance.snippet.pk]
-
-    elif isinstance(instance, Icon):
-        # Convert the value_list Queryset to a list, required for the upcoming
-        # update() query to work.
-        snippets = [id for id in instance.snippets.values_list('pk', flat=True)]
-
-    elif isinstance(instance, Campaign) or isinstance(instance, Target):
-        # Convert the value_list Queryset to a list, required for the upcoming
-        # update() query to work.
-        snippets = [id for id in instance.asrsnippet_set.values_list('pk', flat=True)]
-
-    if snippets:
-        ASRSnippet.objects.filter(pk__in=snippets).update(modified=now)
+def get_icon_snippet_ids(pks):
+    """Return the ids of the ASRSnippets using the icons with pks."""
+    lookups = models.Q()
+    for relation in Icon._meta.related_objects:
+        if issubclass(relation.related_model, Template):
+            lookup = '{0}__{1}__in'.format(relation.related_model._meta.model_name,
+                                           relation.field.name)
+            lookups |= models.Q(**{lookup: pks})
+    return Template.objects.filter(lookups).values_list('snippet_id', flat=True).distinct()
+
+
+invalidation.register(Icon, get_icon_snippet_ids)
+invalidation.register(Campaign, lambda pks: (ASRSnippet.objects
+                                             .filter(campaign__in=pks)
+                                             .values_list('pk', flat=True)))
+invalidation.register(Target, lambda pks: (ASRSnippet.objects
+                                           .filter(targets__in=pks)
+                                           .values_list('pk', flat=True)
+                                           .distinct()))
+
+for model in [ASRSnippet, Target, ClientMatchRule, Campaign, Icon, TargetedLocale]:
+    invalidation.register_index_dependency(model)
+
+
+def update_asrsnippet_modified_date(sender, instance, raw=False, **kwargs):
+    if not raw:
+        invalidation.snippets_changed([instance.snippet_id])
+
+
+# Subclasses of Template send their own signals, so connect to each of them.
+for model in [Template] + Template.__subclasses__():
+    post_save.connect(update_asrsnippet_modified_date, sender=model,
+                      dispatch_uid='update_asrsnippet_modified_{0}'.format(model._meta.model_name))
+    invalidation.register_index_dependency(model)
+
+
+@receiver(post_save, sender=Snippet, dispatch_uid='store_rendered_snippet_on_save')
+@receiver(post_save, sender=ASRSnippet, dispatch_uid='store_rendered_asrsnippet_on_save')
+def store_rendered_on_save(sender, instance, raw=False, **kwargs):
+    # Related objects of fixtures may not be loaded yet.
+    if not raw:
+        invalidation.render(sender, [instance.pk])
+
+
+@receiver(post_save, sender=SnippetTemplate,
+          dispatch_uid='store_rendered_snippets_on_template_save')
+def store_rendered_on_template_save(sender, instance, **kwargs):
+    invalidation.render(Snippet, instance.snippet_set.values_list('pk', flat=True))
+    # ASRSnippets render with their SnippetTemplate only without a Template.
+    invalidation.snippets_changed(instance.asrsnippet_set
+                                  .filter(template_relation=None)
+                                  .values_list('pk', flat=True))
+
+
+@receiver(m2m_changed, sender=Snippet.countries.through,
+          dispatch_uid='store_rendered_on_countries_change')
+@receiver(m2m_changed, sender=Snippet.exclude_from_search_providers.through,
+          dispatch_uid='store_rendered_on_search_providers_change')
+@receiver(m2m_changed, sender=ASRSnippet.targets.through,
+          dispatch_uid='store_rendered_on_targets_change')
+def store_rendered_on_m2m_change(sender, instance, action, reverse, model, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    if not reverse:
+        invalidation.render(type(instance), [instance.pk])
+    elif pk_set:
+        invalidation.render(model, pk_set)
+
+
+@receiver(m2m_changed, sender=JSONSnippet.countries.through,
+          dispatch_uid='update_jsonsnippet_modified_on_countries_change')
+def update_jsonsnippet_modified_on_countries_change(sender, instance, action, reverse, pk_set,
+                                                    **kwargs):
+    # JSON bundle keys depend on the countries of the snippets only through
+    # their modification.
+    if not reverse:
+        pks = [instance.pk] if action in ('post_add', 'post_remove', 'post_clear') else []
+    elif action in ('post_add', 'post_remove'):
+        pks = pk_set
+    elif action == 'pre_clear':
+        # The snippets losing the country are only known before clearing.
+        pks = instance.jsonsnippet_set.values_list('pk', flat=True)
+    else:
+        pks = []
+
+    if pks:
+        JSONSnippet.objects.filter(pk__in=list(pks)).update(modified=timezone.now())
+
+
+@receiver(m2m_changed, sender=ASRSnippet.locales.through,
+          dispatch_uid='invalidate_targeting_index_on_locales_change')
+@receiver(m2m_changed, sender=ASRSnippet.targets.through,
+          dispatch_uid='invalidate_targeting_index_on_targets_change')
+@receiver(m2m_changed, sender=Target.client_match_rules.through,
+          dispatch_uid='invalidate_targeting_index_on_rules_change')
+def invalidate_targeting_index_on_m2m_change(sender, instance, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        invalidation.invalidate_index()
 
 
 class Addon(models.Model):
@@ -1621,3 +1725,19 @@ class Addon(models.Model):
 
     def __str__(self):
         return self.name
+
+
+class BundleManifestEntry(models.Model):
+    """A bundle saved to storage. See snippets.base.manifest."""
+    key = models.CharField(max_length=40, unique=True)
+    filename = models.CharField(max_length=255)
+    size = models.PositiveIntegerField(default=0,
+                                       help_text='Bytes saved, summed over all encodings.')
+    encodings = models.CharField(max_length=255, help_text='Comma separated.')
+    generated = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        verbose_name_plural = 'bundle manifest entries'
+
+    def __str__(self):
+        return self.filename
@@ -0,0 +1,113 @@
+import json
+import logging
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections
+
+from django_statsd.clients import statsd
+
+
+logger = logging.getLogger(__name__)
+
+QUEUED_CACHE_KEY = 'bundle_queued_{0}'
+
+
+def process(task):
+    """
+    Generate the bundle of a queued task, unless it's already generated.
+
+    Tasks are dicts with the `key` of the bundle when it got queued, the
+    `client` to generate it for and the `endpoint` serving it. Tasks with
+    `recompress` set recompress the brotli variant of the bundle saved as
+    `filename` instead.
+    """
+    from snippets.base.bundles import get_bundle, recompress
+    from snippets.base.models import Client
+
+    if task.get('recompress'):
+        recompress(task['key'], task['filename'])
+        return
+
+    bundle = get_bundle(Client(*task['client']), task.get('endpoint', 'snippets'))
+    if not bundle.empty and not bundle.cached:
+        bundle.ensure_generated()
+
+    queued_cache_key = QUEUED_CACHE_KEY.format(task['key'])
+    queued_at = cache.get(queued_cache_key)
+    if queued_at is not None:
+        statsd.timing('bundle.generate.lag', int((time.time() - queued_at) * 1000))
+    cache.delete(queued_cache_key)
+
+
+class LocalQueue(object):
+    """Bundle generation queue processed by a thread of this process."""
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def put(self, task):
+        self.queue.put(task)
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+
+    def get(self, timeout=None):
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def depth(self):
+        return self.queue.qsize()
+
+    def run(self):
+        while True:
+            task = self.get()
+            try:
+                process(task)
+            except Exception:
+                logger.exception('Failed to generate queued bundle.')
+            finally:
+                close_old_connections()
+
+
+class RedisQueue(object):
+    """
+    Bundle generation queue stored in Redis and processed by
+    `./manage.py process_bundle_queue`.
+    """
+    key = 'bundle_queue'
+
+    def __init__(self):
+        from django_redis import get_redis_connection
+        self.redis = get_redis_connection('default')
+
+    def put(self, task):
+        self.redis.lpush(self.key, json.dumps(task))
+
+    def get(self, timeout=None):
+        item = self.redis.brpop(self.key, timeout=int(timeout or 0))
+        if item is None:
+            return None
+        return json.loads(item[1])
+
+    def depth(self):
+        return self.redis.llen(self.key)
+
+
+_local_queue = LocalQueue()
+
+
+def get_queue():
+    """Return the queue configured in BUNDLE_QUEUE or None if disabled."""
+    if settings.BUNDLE_QUEUE == 'local':
+        return _local_queue
+    elif settings.BUNDLE_QUEUE == 'redis':
+        return RedisQueue()
+    return None
@@ -0,0 +1,163 @@
+import hashlib
+import json
+import logging
+
+from django.apps import apps
+from django.core.cache import cache
+from django.db.models import prefetch_related_objects
+
+from django_statsd.clients import statsd
+
+from snippets.base.models import ASRSnippet, Template, load_subtemplates
+
+
+logger = logging.getLogger(__name__)
+
+ONE_DAY = 60 * 60 * 24
+FRAGMENTS_BATCH_SIZE = 50
+
+# On application load combine all the version strings of all available
+# templates into one. To be used in ASRSnippetBundle.key method to calculate
+# the bundle key. The point is that this string should change when the Template
+# schema changes.
+TEMPLATES_NG_VERSIONS = '-'.join([
+    model.VERSION
+    for model in apps.get_models()
+    if issubclass(model, Template) and not model.__name__ == 'Template'
+])
+
+
+def get_render_key(snippet):
+    """
+    Key that changes whenever the rendering of snippet does.
+
+    ASRSnippet.modified gets updated when the snippet or its Template,
+    Campaign, Targets or Icons change. Snippets, and ASRSnippets without a
+    Template, depend on the modification of their SnippetTemplate too.
+    """
+    if isinstance(snippet, ASRSnippet) and hasattr(snippet, 'template_relation'):
+        key_string = '{0}_{1}'.format(snippet.modified.isoformat(), TEMPLATES_NG_VERSIONS)
+    else:
+        key_string = '{0}_{1}'.format(snippet.modified.isoformat(),
+                                      snippet.template.modified.isoformat())
+    return hashlib.sha1(key_string.encode('utf-8')).hexdigest()
+
+
+def get_fragment_cache_key(snippet):
+    """Cache key of the rendered snippet."""
+    return 'asrsnippet_fragment_{0}_{1}'.format(snippet.id, get_render_key(snippet))
+
+
+def render_to_json(snippet):
+    """Render snippet for bundles, serialized as a JSON string."""
+    if isinstance(snippet, ASRSnippet):
+        return json.dumps(snippet.render())
+    return json.dumps(snippet.to_dict())
+
+
+def get_stored_rendering(snippet):
+    """Return the rendering stored with snippet if still current, or None."""
+    if snippet.rendered and snippet.rendered_key == get_render_key(snippet):
+        return snippet.rendered
+    return None
+
+
+def get_rendered_json(snippet):
+    """Return the stored rendering of snippet or render it."""
+    rendered = get_stored_rendering(snippet)
+    if rendered is None:
+        statsd.incr('snippet.rendered.miss')
+        rendered = render_to_json(snippet)
+    return rendered
+
+
+def load_templates(snippets):
+    """
+    Load the subtemplates of the ASRSnippets, and the SnippetTemplates with
+    their variables of those without one, in a fixed number of queries.
+    """
+    load_subtemplates([snippet.template_relation for snippet in snippets
+                       if hasattr(snippet, 'template_relation')])
+    prefetch_related_objects([snippet for snippet in snippets
+                              if not hasattr(snippet, 'template_relation')],
+                             'template__variable_set')
+
+
+def load_for_rendering(snippets):
+    """Return the snippets in the queryset with everything rendering needs loaded."""
+    if snippets.model is ASRSnippet:
+        snippets = list(snippets
+                        .select_related('campaign', 'template_relation', 'template')
+                        .prefetch_related('targets'))
+        load_templates(snippets)
+        return snippets
+
+    return list(snippets
+                .select_related('template')
+                .prefetch_related('countries', 'exclude_from_search_providers'))
+
+
+def store_renderings(snippets):
+    """Render snippets and store the renderings with them."""
+    for snippet in snippets:
+        try:
+            rendered = render_to_json(snippet)
+        except Exception:
+            # Bundles render the snippet themselves without a rendering.
+            logger.exception('Failed to render %s %s.', type(snippet).__name__, snippet.pk)
+            continue
+        (type(snippet).objects
+         .filter(pk=snippet.pk)
+         .update(rendered=rendered, rendered_key=get_render_key(snippet)))
+        statsd.incr('snippet.rendered.stored')
+
+
+def store_rendered(model, pks):
+    """Render the snippets of model with pks and store the renderings."""
+    store_renderings(load_for_rendering(model.objects.filter(pk__in=pks)))
+
+
+def iter_rendered_fragments(snippets, batch_size=FRAGMENTS_BATCH_SIZE):
+    """
+    Yield the rendered ASRSnippets serialized as JSON strings.
+
+    Snippets get rendered when saved and the rendering gets stored with
+    them, see store_rendered. Snippets without a current rendering get
+    rendered once per modification and cached, so they can be spliced into
+    all the bundles they appear in. Fragments get fetched from the cache in
+    batches of batch_size to bound memory usage. The templates of all
+    snippets without a current rendering get loaded up front, so that the
+    number of queries doesn't depend on the number of snippets.
+    """
+    stored_renderings = [get_stored_rendering(snippet) for snippet in snippets]
+    load_templates([snippet for snippet, rendered in zip(snippets, stored_renderings)
+                    if rendered is None])
+
+    for start in range(0, len(snippets), batch_size):
+        batch = snippets[start:start + batch_size]
+        stored_fragments = stored_renderings[start:start + batch_size]
+        cache_keys = [get_fragment_cache_key(snippet) if fragment is None else None
+                      for snippet, fragment in zip(batch, stored_fragments)]
+        cached_fragments = cache.get_many([key for key in cache_keys if key is not None])
+
+        missing_fragments = {}
+        for snippet, fragment, cache_key in zip(batch, stored_fragments, cache_keys):
+            if fragment is None:
+                fragment = cached_fragments.get(cache_key)
+            if fragment is None:
+                fragment = json.dumps(snippet.render())
+                missing_fragments[cache_key] = fragment
+            yield fragment
+
+        if missing_fragments:
+            cache.set_many(missing_fragments, ONE_DAY)
+
+        stored = len(batch) - stored_fragments.count(None)
+        statsd.incr('bundle.fragments.stored', stored)
+        statsd.incr('bundle.fragments.hit', len(batch) - stored - len(missing_fragments))
+        statsd.incr('bundle.fragments.miss', len(missing_fragments))
+
+
+def get_rendered_fragments(snippets):
+    """Return the rendered ASRSnippets serialized as JSON strings."""
+    return list(iter_rendered_fragments(snippets))
@@ -0,0 +1,108 @@
+import re
+from collections import defaultdict
+
+
+# Patterns that may contain backreferences, conditionals or inline flags
+# cannot be safely combined with other patterns into a single alternation.
+UNMERGEABLE_PATTERN_RE = re.compile(r'\\[1-9]|\(\?P=|\(\?\(|\(\?[aiLmsux]')
+
+
+class CompiledRuleSet(object):
+    """
+    A set of ClientMatchRules compiled into a structure that evaluates a
+    client against all rules at once.
+
+    String fields get grouped into hash lookups per Client field and regex
+    fields get compiled once, deduplicated and merged into a single pattern
+    per Client field, which is used as a fast path to reject all regex rules
+    of a field at once.
+
+    Evaluation produces the same outcome as calling ClientMatchRule.matches
+    for each rule.
+    """
+    def __init__(self, rules):
+        from snippets.base.models import Client
+
+        self.rules = {}
+        self.exclusions = set()
+        # field -> {value: set(rule ids)}
+        self.values = defaultdict(lambda: defaultdict(set))
+        # field -> set(rule ids)
+        self.value_rules = defaultdict(set)
+        # field -> [(compiled pattern, set(rule ids))]
+        self.patterns = {}
+        # field -> set(rule ids)
+        self.pattern_rules = defaultdict(set)
+        # field -> compiled alternation of all patterns of field or None
+        self.merged_patterns = {}
+
+        patterns = defaultdict(lambda: defaultdict(set))
+        for rule in rules:
+            self.rules[rule.id] = rule
+            if rule.is_exclusion:
+                self.exclusions.add(rule.id)
+
+            for field in Client._fields:
+                field_value = getattr(rule, field, None)
+                if not field_value:
+                    continue
+
+                if field_value.startswith('/'):  # Match field as a regex.
+                    patterns[field][field_value[1:-1]].add(rule.id)
+                    self.pattern_rules[field].add(rule.id)
+                else:  # Match field as a string.
+                    self.values[field][field_value].add(rule.id)
+                    self.value_rules[field].add(rule.id)
+
+        for field, field_patterns in patterns.items():
+            self.patterns[field] = [
+                (re.compile(pattern), rule_ids) for pattern, rule_ids in field_patterns.items()
+            ]
+            self.merged_patterns[field] = self._merge(list(field_patterns.keys()))
+
+    def _merge(self, patterns):
+        if len(patterns) < 2:
+            return None
+
+        if any(UNMERGEABLE_PATTERN_RE.search(pattern) for pattern in patterns):
+            return None
+
+        try:
+            return re.compile('|'.join('(?:{0})'.format(pattern) for pattern in patterns))
+        except re.error:
+            return None
+
+    def __len__(self):
+        return len(self.rules)
+
+    def evaluate(self, client):
+        """
+        Evaluate all rules against client in one pass.
+
+        Returns a tuple of two sets: the ids of the passed rules and the ids
+        of the failed rules.
+        """
+        unmatched = set()
+
+        for field, rule_ids in self.value_rules.items():
+            client_field_value = getattr(client, field)
+            matched = self.values[field].get(client_field_value)
+            unmatched.update(rule_ids - matched if matched else rule_ids)
+
+        for field, rule_ids in self.pattern_rules.items():
+            client_field_value = getattr(client, field)
+
+            # Fast path: If the merged pattern doesn't match, no pattern will.
+            merged_pattern = self.merged_patterns[field]
+            if merged_pattern is not None and merged_pattern.match(client_field_value) is None:
+                unmatched.update(rule_ids)
+                continue
+
+            for pattern, pattern_rule_ids in self.patterns[field]:
+                if pattern.match(client_field_value) is None:
+                    unmatched.update(pattern_rule_ids)
+
+        # Exclusion rules match clients that do not match their rule.
+        failed = (unmatched - self.exclusions) | (self.exclusions - unmatched)
+        passed = set(self.rules.keys()) - failed
+        return passed, failed
@@ -1,9 +1,12 @@
 import mimetypes
 from datetime import datetime
+from urllib.parse import urljoin, urlparse
 
 from django.conf import settings
 from django.core.files.storage import FileSystemStorage
+from django.core.signals import setting_changed
 from django.utils.deconstruct import deconstructible
+from django.utils.encoding import filepath_to_uri
 
 from boto.utils import ISO8601
 from storages.backends.s3boto import S3BotoStorage
@@ -25,6 +28,65 @@ class OverwriteStorage(FileSystemStorage):
         return name
 
 
+# Public URL prefixes by storage, see public_url.
+_url_prefixes = {}
+URL_PROBE_NAME = 'url-probe'
+URL_SETTINGS = ('CDN_URL', 'DEFAULT_FILE_STORAGE', 'MEDIA_URL', 'SITE_URL')
+
+
+def get_url_prefix(storage):
+    """
+    Return the public URL that the names of files saved to storage get
+    appended to, or None if storage doesn't build its URLs that way.
+
+    The prefix gets computed from the URL of a probe file, without its query
+    string, and honors SITE_URL and CDN_URL.
+    """
+    storage_url = storage.url(URL_PROBE_NAME)
+    if not isinstance(storage_url, str):
+        return None
+
+    storage_url = storage_url.split('?')[0]
+    if not storage_url.endswith(URL_PROBE_NAME):
+        return None
+
+    full_url = urljoin(settings.SITE_URL, storage_url)
+    cdn_url = getattr(settings, 'CDN_URL', None)
+    if cdn_url:
+        full_url = urljoin(cdn_url, urlparse(storage_url).path)
+    return full_url[:-len(URL_PROBE_NAME)]
+
+
+def public_url(storage, name):
+    """
+    Return the unsigned public URL of the file saved to storage as name.
+
+    Unlike storage.url() this doesn't sign the URL or talk to the storage
+    backend, apart from computing the URL prefix of storage once.
+    """
+    try:
+        prefix = _url_prefixes[storage]
+    except KeyError:
+        prefix = _url_prefixes[storage] = get_url_prefix(storage)
+
+    if prefix is None:
+        storage_url = storage.url(name)
+        full_url = urljoin(settings.SITE_URL, storage_url).split('?')[0]
+        cdn_url = getattr(settings, 'CDN_URL', None)
+        if cdn_url:
+            full_url = urljoin(cdn_url, urlparse(storage_url).path)
+        return full_url
+    return prefix + filepath_to_uri(name).lstrip('/')
+
+
+def _clear_url_prefixes(setting, **kwargs):
+    if setting in URL_SETTINGS:
+        _url_prefixes.clear()
+
+
+setting_changed.connect(_clear_url_prefixes)
+
+
 @deconstructible
 class S3Storage(S3BotoStorage):
     cache_control_headers = getattr(settings, 'AWS_CACHE_CONTROL_HEADERS', {})
@@ -38,6 +100,7 @@ class S3Storage(S3BotoStorage):
         content_type = content_type or _type or self.key_class.DefaultContentType
         encoding = getattr(content, 'content_encoding', None)
         encoding = encoding or _encoding
+        cache_control = getattr(content, 'cache_control', None)
 
         # setting the content_type in the key object is not enough.
         headers.update({'Content-Type': content_type})
@@ -45,8 +108,13 @@ class S3Storage(S3BotoStorage):
         for filename_start, value in self.cache_control_headers.items():
             if name.startswith(filename_start):
                 headers['Cache-Control'] = value
+        # Content that gets replaced under the same name sets its own.
+        if cache_control:
+            headers['Cache-Control'] = cache_control
 
-        if self.gzip and content_type in self.gzip_content_types:
+        # Content that is already encoded, like bundle variants, must not get
+        # compressed again.
+        if not encoding and self.gzip and content_type in self.gzip_content_types:
             content = self._compress_content(content)
             headers.update({'Content-Encoding': 'gzip'})
         elif encoding:
@@ -63,5 +131,7 @@ class S3Storage(S3BotoStorage):
             key.last_modified = datetime.utcnow().strftime(ISO8601)
 
         key.set_metadata('Content-Type', content_type)
+        if encoding:
+            key.set_metadata('Content-Encoding', encoding)
         self._save_content(key, content, headers=headers)
         return cleaned_name
@@ -0,0 +1,318 @@
+import hashlib
+import logging
+import threading
+import uuid
+from collections import defaultdict, namedtuple
+from datetime import datetime
+
+from django.conf import settings
+from django.core.cache import cache
+
+from snippets.base import util
+from snippets.base.managers import get_client_channel, get_client_locales
+from snippets.base.rules import CompiledRuleSet
+
+
+logger = logging.getLogger(__name__)
+
+INDEX_VERSION_CACHE_KEY = 'asr_targeting_index_version'
+
+# Canonical representation of a Client. Two clients that map to the same
+# ClientClass get matched against the same snippets, no matter what the rest
+# of their properties, like appbuildid or os_version, are.
+ClientClass = namedtuple('ClientClass', (
+    'startpage_version',
+    'channel',
+    'locales',
+    'passed_rules',
+))
+
+# Everything an ASRSnippetIndex knows. Builds create a new state and swap it
+# in as a whole, so requests never see parts of two different builds.
+IndexState = namedtuple('IndexState', (
+    'version',
+    'built_at',
+    'snippets',
+    'by_channel',
+    'by_locale',
+    'without_locales',
+    'with_targets',
+    'rules',
+    'compiled_rules',
+    'snippet_rules',
+))
+
+
+def invalidate_index():
+    """Signal all workers that their targeting index is out of date.
+
+    The version lives in the shared cache so that a save in one process
+    triggers a rebuild in every process on their next request.
+    """
+    cache.set(INDEX_VERSION_CACHE_KEY, uuid.uuid4().hex, None)
+
+
+def get_index_version():
+    version = cache.get(INDEX_VERSION_CACHE_KEY)
+    if version is None:
+        version = uuid.uuid4().hex
+        if not cache.add(INDEX_VERSION_CACHE_KEY, version, None):
+            version = cache.get(INDEX_VERSION_CACHE_KEY, version)
+    return version
+
+
+class ASRSnippetIndex(object):
+    """
+    In-process index of published ASRSnippets keyed by channel, locale and
+    target.
+
+    Matching a client against the index produces the same snippets as
+
+        ASRSnippet.objects
+                  .filter(status=STATUS_CHOICES['Published'])
+                  .match_client(client)
+                  .filter_by_available()
+
+    without running any SQL queries. The index is rebuilt when the version
+    stored in the cache changes, i.e. when a relevant model gets saved, or
+    when it gets older than ASR_TARGETING_INDEX_TIMEOUT seconds.
+
+    An index with a fixed version ignores the version in the cache, and its
+    bundle resolutions don't mix with the ones of the shared index.
+    """
+    def __init__(self, fixed_version=None):
+        self.fixed_version = fixed_version
+        self.state = IndexState(
+            version=None,
+            built_at=None,
+            snippets={},
+            by_channel={},
+            by_locale={},
+            without_locales=frozenset(),
+            with_targets=frozenset(),
+            rules={},
+            compiled_rules=None,
+            snippet_rules={},
+        )
+        # Held while building, so concurrent requests finding the index
+        # stale wait for a single rebuild.
+        self._build_lock = threading.RLock()
+
+    @property
+    def version(self):
+        return self.state.version
+
+    def current_version(self):
+        """Return the version the index should be built at."""
+        if self.fixed_version is not None:
+            return self.fixed_version
+        return get_index_version()
+
+    @property
+    def stale(self):
+        return self._is_stale(self.state)
+
+    def _is_stale(self, state):
+        if state.built_at is None:
+            return True
+
+        age = (datetime.utcnow() - state.built_at).total_seconds()
+        if age > settings.ASR_TARGETING_INDEX_TIMEOUT:
+            return True
+
+        return state.version != self.current_version()
+
+    def build(self):
+        """Build the index from the database and return its new state."""
+        with self._build_lock:
+            state = self._build_state()
+            self.state = state
+        logger.info('Built ASRSnippet targeting index with %d snippets.', len(state.snippets))
+        return state
+
+    def _build_state(self):
+        from snippets.base.models import CHANNELS, STATUS_CHOICES, ASRSnippet
+
+        version = self.current_version()
+        snippets = (ASRSnippet.objects
+                    .filter(status=STATUS_CHOICES['Published'])
+                    .select_related('campaign', 'template_relation', 'template')
+                    .prefetch_related('locales', 'targets__client_match_rules'))
+
+        index = {
+            'snippets': {},
+            'by_channel': defaultdict(set),
+            'by_locale': defaultdict(set),
+            'without_locales': set(),
+            'with_targets': set(),
+            'rules': {},
+            'snippet_rules': defaultdict(set),
+        }
+        for snippet in snippets:
+            index['snippets'][snippet.id] = snippet
+
+            locales = [locale.code.lower() for locale in snippet.locales.all()]
+            if not locales:
+                index['without_locales'].add(snippet.id)
+            for code in locales:
+                index['by_locale'][code].add(snippet.id)
+
+            for target in snippet.targets.all():
+                index['with_targets'].add(snippet.id)
+                for channel in CHANNELS:
+                    if getattr(target, 'on_{0}'.format(channel), False):
+                        index['by_channel'][channel].add(snippet.id)
+
+                for rule in target.client_match_rules.all():
+                    index['rules'][rule.id] = rule
+                    index['snippet_rules'][snippet.id].add(rule.id)
+
+        return IndexState(
+            version=version,
+            built_at=datetime.utcnow(),
+            snippets=index['snippets'],
+            by_channel={channel: frozenset(ids) for channel, ids in index['by_channel'].items()},
+            by_locale={code: frozenset(ids) for code, ids in index['by_locale'].items()},
+            without_locales=frozenset(index['without_locales']),
+            with_targets=frozenset(index['with_targets']),
+            rules=index['rules'],
+            compiled_rules=CompiledRuleSet(index['rules'].values()),
+            snippet_rules={snippet_id: frozenset(ids)
+                           for snippet_id, ids in index['snippet_rules'].items()},
+        )
+
+    def ensure_current(self):
+        """Return the state of the index, rebuilding it first if stale."""
+        state = self.state
+        if self._is_stale(state):
+            with self._build_lock:
+                # Another thread may have rebuilt the index while this one
+                # waited for the lock.
+                state = self.state
+                if self._is_stale(state):
+                    state = self.build()
+        return state
+
+    def warm(self):
+        """Build the index ahead of the first request, if possible."""
+        try:
+            self.build()
+        except Exception:
+            # The index gets lazily built on the first request anyway.
+            logger.exception('Failed to build ASRSnippet targeting index.')
+
+    def client_class(self, client):
+        """Return the ClientClass of client.
+
+        The class consists of the startpage version, the resolved channel,
+        the matched locales and the ids of the active ClientMatchRules that
+        client passes.
+        """
+        state = self.ensure_current()
+
+        passed_rules, failed_rules = state.compiled_rules.evaluate(client)
+        return ClientClass(
+            startpage_version=client.startpage_version,
+            channel=get_client_channel(client),
+            locales=tuple(get_client_locales(client)),
+            passed_rules=tuple(sorted(passed_rules)),
+        )
+
+    def _resolution_cache_key(self, client_class):
+        # Include the index version to invalidate the cached resolutions
+        # every time snippets get published or modified.
+        key_string = '{0}_{1}'.format(repr(client_class), self.version)
+        return 'bundle_class_' + hashlib.sha1(key_string.encode('utf-8')).hexdigest()
+
+    def get_resolution(self, client_class):
+        """
+        Return the cached bundle resolution of client_class as a dict with
+        `key`, `empty` and `expires` keys or None if not available.
+        """
+        return cache.get(self._resolution_cache_key(client_class))
+
+    def set_resolution(self, client_class, key, empty, expires=None):
+        """
+        Cache the bundle resolution of client_class.
+
+        The resolution is valid until `expires`, the next time a matching
+        snippet becomes available or unavailable, but at most for
+        BUNDLE_CLIENT_CLASS_TIMEOUT seconds.
+        """
+        timeout = settings.BUNDLE_CLIENT_CLASS_TIMEOUT
+        if expires is not None:
+            timeout = min(timeout, util.seconds_until(expires))
+        if timeout <= 0:
+            return
+
+        cache.set(self._resolution_cache_key(client_class),
+                  {'key': key, 'empty': empty, 'expires': expires},
+                  timeout)
+
+    def candidates(self, client, state=None):
+        """Return the ids of snippets that match client's channel and locale."""
+        if state is None:
+            state = self.state
+
+        client_channel = get_client_channel(client)
+        if client_channel:
+            snippet_ids = set(state.by_channel.get(client_channel, ()))
+        else:
+            snippet_ids = set(state.with_targets)
+
+        # Only filter by locale if they pass a valid locale.
+        locales = get_client_locales(client)
+        if locales:
+            localized_ids = set()
+            for locale in locales:
+                localized_ids.update(state.by_locale.get(locale, ()))
+        else:
+            # If the locale is invalid, only match snippets with no
+            # locales specified.
+            localized_ids = state.without_locales
+
+        return snippet_ids & localized_ids
+
+    def match_client(self, client):
+        """Return the snippets matching client, including unavailable ones."""
+        state = self.ensure_current()
+
+        snippet_ids = self.candidates(client, state)
+
+        # Filter based on ClientMatchRules
+        passed_rules, failed_rules = state.compiled_rules.evaluate(client)
+        snippet_ids = [
+            snippet_id for snippet_id in snippet_ids
+            if not state.snippet_rules.get(snippet_id, frozenset()) & failed_rules
+        ]
+
+        snippets = [state.snippets[snippet_id] for snippet_id in snippet_ids]
+        snippets.sort(key=lambda snippet: (snippet.modified, snippet.id), reverse=True)
+        return snippets
+
+    def filter_by_available(self, snippets, now=None):
+        return util.filter_by_available(snippets, now)
+
+    def get_snippets(self, client):
+        return self.filter_by_available(self.match_client(client))
+
+    def verify(self, client):
+        """Compare the index against the database for client.
+
+        Returns a tuple of two sets of snippet ids: the ones the database
+        matches but the index doesn't and the ones the index matches but the
+        database doesn't. Both are empty when the index is consistent.
+        """
+        from snippets.base.models import STATUS_CHOICES, ASRSnippet
+
+        expected = set(
+            snippet.id for snippet in (ASRSnippet.objects
+                                       .filter(status=STATUS_CHOICES['Published'])
+                                       .match_client(client)
+                                       .filter_by_available())
+        )
+        indexed = set(snippet.id for snippet in self.get_snippets(client))
+        return expected - indexed, indexed - expected
+
+
+asr_index = ASRSnippetIndex()
@@ -1,12 +1,50 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.core.signals import setting_changed
 from django.test import TransactionTestCase
 
 import factory
+from cachalot.settings import cachalot_settings
 
-from snippets.base import models
+from snippets.base import bodies, manifest, models
+
+
+# Tests of state kept in the cache override CACHES with this, since CI runs
+# them with CACHE_URL=dummy://.
+LOCMEM_CACHES = dict(settings.CACHES, default={
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    'LOCATION': 'snippets-tests',
+})
+
+
+def _clear_overridden_cache(setting, enter, **kwargs):
+    # Local memory caches keep their contents between instances, so tests
+    # overriding CACHES start out empty like the others.
+    if setting == 'CACHES' and enter:
+        cache.clear()
+
+
+setting_changed.connect(_clear_overridden_cache)
+
+
+def _reload_cachalot_settings(setting, **kwargs):
+    # django-cachalot only reads its settings on startup, so tests
+    # overriding them would keep caching queries otherwise.
+    if setting.startswith('CACHALOT_'):
+        cachalot_settings.reload()
+
+
+setting_changed.connect(_reload_cachalot_settings)
 
 
 class TestCase(TransactionTestCase):
-    pass
+    def _pre_setup(self):
+        super()._pre_setup()
+        # Bundle state like generated and last good bundles lives in the
+        # cache and must not leak between tests.
+        cache.clear()
+        manifest._keys.clear()
+        bodies._local_bodies.clear()
 
 
 class SnippetTemplateFactory(factory.django.DjangoModelFactory):
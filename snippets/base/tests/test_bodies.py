@@ -0,0 +1,70 @@
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.test.utils import override_settings
+
+from unittest.mock import patch
+
+from snippets.base import bodies
+from snippets.base.tests import LOCMEM_CACHES, TestCase
+
+
+@override_settings(BUNDLE_BODY_CACHE_MAX_BYTES=10, BUNDLE_BODY_CACHE_MAX_ITEM_BYTES=5)
+class LRUBodyCacheTests(TestCase):
+    def test_eviction(self):
+        lru = bodies.LRUBodyCache()
+        lru.set('a', b'aaaa')
+        lru.set('b', b'bbbb')
+        # Make b the least recently used.
+        self.assertEqual(lru.get('a'), b'aaaa')
+        lru.set('c', b'cccc')
+
+        self.assertIsNone(lru.get('b'))
+        self.assertEqual(lru.get('a'), b'aaaa')
+        self.assertEqual(lru.get('c'), b'cccc')
+        self.assertEqual(lru.size, 8)
+
+    def test_replace(self):
+        lru = bodies.LRUBodyCache()
+        lru.set('a', b'aaaa')
+        lru.set('a', b'aa')
+        self.assertEqual(lru.get('a'), b'aa')
+        self.assertEqual(lru.size, 2)
+
+    def test_item_too_large(self):
+        lru = bodies.LRUBodyCache()
+        lru.set('a', b'aaaaaa')
+        self.assertIsNone(lru.get('a'))
+        self.assertEqual(lru.size, 0)
+
+    def test_delete(self):
+        lru = bodies.LRUBodyCache()
+        lru.set('a', b'aaaa')
+        lru.delete('a')
+        lru.delete('b')
+        self.assertIsNone(lru.get('a'))
+        self.assertEqual(lru.size, 0)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class GetBodyTests(TestCase):
+    def test_base(self):
+        with patch('snippets.base.bodies.default_storage') as default_storage:
+            default_storage.open.return_value = ContentFile(b'body')
+            self.assertEqual(bodies.get_body('bundle_foo.json'), b'body')
+            self.assertEqual(bodies.get_body('bundle_foo.json'), b'body')
+        default_storage.open.assert_called_once_with('bundle_foo.json')
+        self.assertEqual(cache.get(bodies.CACHE_KEY.format('bundle_foo.json')), b'body')
+
+    def test_cache(self):
+        cache.set(bodies.CACHE_KEY.format('bundle_foo.json'), b'body')
+        with patch('snippets.base.bodies.default_storage') as default_storage:
+            self.assertEqual(bodies.get_body('bundle_foo.json'), b'body')
+        self.assertFalse(default_storage.open.called)
+        self.assertEqual(bodies._local_bodies.get('bundle_foo.json'), b'body')
+
+    def test_discard(self):
+        cache.set(bodies.CACHE_KEY.format('bundle_foo.json'), b'body')
+        bodies.get_body('bundle_foo.json')
+        bodies.discard('bundle_foo.json')
+        self.assertIsNone(cache.get(bodies.CACHE_KEY.format('bundle_foo.json')))
+        self.assertIsNone(bodies._local_bodies.get('bundle_foo.json'))
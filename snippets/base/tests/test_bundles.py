@@ -1,14 +1,28 @@
+import gzip
 import json
 
 from django.conf import settings
+from django.core.cache import cache as django_cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.base import ContentFile
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.test.utils import override_settings
 
 import brotli
 from unittest.mock import ANY, DEFAULT, Mock, patch
 
-from snippets.base.bundles import ONE_DAY, ASRSnippetBundle, SnippetBundle
-from snippets.base.models import Client
-from snippets.base.tests import ASRSnippetFactory, SnippetFactory, TestCase
+from snippets.base.bundles import (ONE_DAY, ASRSnippetBundle, JSONSnippetBundle, SnippetBundle,
+                                   get_bundle, get_encodings, recompress, write_bundle_content)
+from snippets.base.locks import NoGenerationSlot
+from snippets.base.models import ASRSnippet, Client, Template
+from snippets.base.tests import (LOCMEM_CACHES, ASRSnippetFactory, JSONSnippetFactory,
+                                 SnippetFactory, TestCase)
+
+
+def _matched(*snippets):
+    """Return the snippets as a queryset, the way bundles match them."""
+    return type(snippets[0]).objects.filter(id__in=[snippet.id for snippet in snippets])
 
 
 class SnippetBundleTests(TestCase):
@@ -28,9 +42,9 @@ class SnippetBundleTests(TestCase):
         """
         client = self._client()
         bundle1 = SnippetBundle(client)
-        bundle1.snippets = [self.snippet1, self.snippet2]
+        bundle1.matched_snippets = _matched(self.snippet1, self.snippet2)
         bundle2 = SnippetBundle(client)
-        bundle2.snippets = [self.snippet2]
+        bundle2.matched_snippets = _matched(self.snippet2)
 
         self.assertNotEqual(bundle1.key, bundle2.key)
 
@@ -70,52 +84,52 @@ class SnippetBundleTests(TestCase):
         client1 = self._client(locale='en-US', startpage_version=4)
         client2 = self._client(locale='en-US', startpage_version=4)
         bundle1 = SnippetBundle(client1)
-        bundle1.snippets = [self.snippet1, self.snippet2]
+        bundle1.matched_snippets = _matched(self.snippet1, self.snippet2)
         bundle2 = SnippetBundle(client2)
-        bundle2.snippets = [self.snippet1, self.snippet2]
+        bundle2.matched_snippets = _matched(self.snippet1, self.snippet2)
 
         self.assertEqual(bundle1.key, bundle2.key)
 
     def test_key_snippet_modified(self):
         client1 = self._client(locale='en-US', startpage_version=4)
         bundle = SnippetBundle(client1)
-        bundle.snippets = [self.snippet1]
+        bundle.matched_snippets = _matched(self.snippet1)
         key_1 = bundle.key
 
         # save snippet, touch modified
         self.snippet1.save()
         bundle = SnippetBundle(client1)
-        bundle.snippets = [self.snippet1]
+        bundle.matched_snippets = _matched(self.snippet1)
         key_2 = bundle.key
         self.assertNotEqual(key_1, key_2)
 
     def test_key_template_modified(self):
         client1 = self._client(locale='en-US', startpage_version=4)
         bundle = SnippetBundle(client1)
-        bundle.snippets = [self.snippet1]
+        bundle.matched_snippets = _matched(self.snippet1)
         key_1 = bundle.key
 
         # save template, touch modified
         self.snippet1.template.save()
         bundle = SnippetBundle(client1)
-        bundle.snippets = [self.snippet1]
+        bundle.matched_snippets = _matched(self.snippet1)
         key_2 = bundle.key
         self.assertNotEqual(key_1, key_2)
 
     def test_key_current_firefox_version(self):
         client1 = self._client(locale='en-US', startpage_version=4)
         bundle = SnippetBundle(client1)
-        bundle.snippets = [self.snippet1]
+        bundle.matched_snippets = _matched(self.snippet1)
         key_1 = bundle.key
 
         with patch('snippets.base.util.current_firefox_major_version') as cfmv:
             cfmv.return_value = 'xx'
             bundle = SnippetBundle(client1)
-            bundle.snippets = [self.snippet1]
+            bundle.matched_snippets = _matched(self.snippet1)
             key_2 = bundle.key
         self.assertNotEqual(key_1, key_2)
 
-    @override_settings(BUNDLE_BROTLI_COMPRESS=True)
+    @override_settings(BUNDLE_ENCODINGS=[])
     def test_generate(self):
         """
         bundle.generate should render the snippets, save them to the
@@ -129,11 +143,10 @@ class SnippetBundleTests(TestCase):
             with patch('snippets.base.bundles.render_to_string') as render_to_string:
                 with patch('snippets.base.bundles.default_storage') as default_storage:
                     with self.settings(SNIPPET_BUNDLE_TIMEOUT=10):
-                        with patch('snippets.base.bundles.brotli', wraps=brotli) as brotli_mock:
-                            with patch('snippets.base.util.current_firefox_major_version') as cfmv:
-                                cfmv.return_value = '45'
-                                render_to_string.return_value = 'rendered snippet'
-                                bundle.generate()
+                        with patch('snippets.base.util.current_firefox_major_version') as cfmv:
+                            cfmv.return_value = '45'
+                            render_to_string.return_value = 'rendered snippet'
+                            bundle.generate()
 
         render_to_string.assert_called_with('base/fetch_snippets.jinja', {
             'snippet_ids': [s.id for s in [self.snippet1, self.snippet2]],
@@ -146,14 +159,11 @@ class SnippetBundleTests(TestCase):
         default_storage.save.assert_called_with(bundle.filename, ANY)
         cache.set.assert_called_with(bundle.cache_key, True, ONE_DAY)
 
-        # Brotli must not be used in non-AS requests.
-        self.assertFalse(brotli_mock.called)
-
         # Check content of saved file.
         content_file = default_storage.save.call_args[0][1]
         self.assertEqual(content_file.read(), b'rendered snippet')
 
-    @override_settings(BUNDLE_BROTLI_COMPRESS=False)
+    @override_settings(BUNDLE_ENCODINGS=[])
     def test_generate_activity_stream(self):
         """
         bundle.generate should render the snippets, save them to the
@@ -188,35 +198,81 @@ class SnippetBundleTests(TestCase):
         content_file = default_storage.save.call_args[0][1]
         self.assertEqual(content_file.read(), b'rendered snippet')
 
-    @override_settings(BUNDLE_BROTLI_COMPRESS=True)
-    def test_generate_brotli(self):
+    @override_settings(BUNDLE_ENCODINGS=['br', 'gzip'])
+    def test_generate_encodings(self):
         """
-        bundle.generate should render the snippets, save them to the
-        filesystem, and mark the bundle as not-expired in the cache for
-        activity stream!
+        bundle.generate should save a variant of the bundle in each
+        encoding, the uncompressed one last.
         """
         def _test(client):
-            bundle = SnippetBundle(self._client(locale='fr', startpage_version=5))
-            bundle.storage = Mock()
+            bundle = SnippetBundle(client)
             bundle.snippets = [self.snippet1, self.snippet2]
 
             with patch('snippets.base.bundles.cache') as cache:
                 with patch('snippets.base.bundles.render_to_string') as render_to_string:
                     with patch('snippets.base.bundles.default_storage') as default_storage:
-                        with patch('snippets.base.bundles.brotli', wraps=brotli) as brotli_mock:
-                            render_to_string.return_value = 'rendered snippet'
-                            bundle.generate()
+                        render_to_string.return_value = 'rendered snippet'
+                        size = bundle.generate()
 
-            brotli_mock.compress.assert_called_with(b'rendered snippet')
-            default_storage.save.assert_called_with(bundle.filename, ANY)
             cache.set.assert_called_with(bundle.cache_key, True, ONE_DAY)
-
-            # Check content of saved file.
-            content_file = default_storage.save.call_args[0][1]
-            self.assertEqual(content_file.content_encoding, 'br')
-            self.assertEqual(content_file.read(), b'\x8b\x07\x80rendered snippet\x03')
+            self.assertEqual([call[0][0] for call in default_storage.save.call_args_list],
+                             [bundle.filename + '.br', bundle.filename + '.gz', bundle.filename])
+
+            # Check content of saved files.
+            content_files = [call[0][1] for call in default_storage.save.call_args_list]
+            self.assertEqual(size, sum(content_file.size for content_file in content_files))
+            br_file, gzip_file, identity_file = content_files
+            self.assertEqual(br_file.content_encoding, 'br')
+            self.assertEqual(br_file.content_type, 'text/html')
+            self.assertEqual(br_file.read(), b'\x8b\x07\x80rendered snippet\x03')
+            self.assertEqual(gzip_file.content_encoding, 'gzip')
+            self.assertEqual(gzip.decompress(gzip_file.read()), b'rendered snippet')
+            self.assertFalse(hasattr(identity_file, 'content_encoding'))
+            self.assertEqual(identity_file.read(), b'rendered snippet')
+        _test(self._client(locale='fr', startpage_version=4))
         _test(self._client(locale='fr', startpage_version=5))
-        _test(self._client(locale='fr', startpage_version=6))
+
+    @override_settings(BUNDLE_ENCODINGS=['br'], BUNDLE_BROTLI_INLINE_QUALITY=1,
+                       BUNDLE_BROTLI_QUALITY=11, BUNDLE_BROTLI_INLINE_MAX_AGE=600)
+    def test_generate_inline(self):
+        """
+        Bundles generated while a client waits get compressed fast and
+        queued for recompression.
+        """
+        bundle = SnippetBundle(self._client(locale='fr', startpage_version=5))
+        bundle.snippets = [self.snippet1]
+
+        with patch.multiple('snippets.base.bundles', brotli=DEFAULT, cache=DEFAULT,
+                            default_storage=DEFAULT, get_queue=DEFAULT) as mocks:
+            mocks['brotli'].Compressor.return_value.process.return_value = b''
+            mocks['brotli'].Compressor.return_value.finish.return_value = b''
+            mocks['get_queue'].return_value.depth.return_value = 1
+            bundle.generate(inline=True)
+
+        mocks['brotli'].Compressor.assert_called_with(quality=1)
+        mocks['get_queue'].return_value.put.assert_called_with(
+            {'key': bundle.key, 'filename': bundle.filename, 'recompress': True})
+        # The brotli variant gets replaced once recompressed.
+        saved = dict(call[0] for call in mocks['default_storage'].save.call_args_list)
+        self.assertEqual(saved[bundle.filename + '.br'].cache_control, 'max-age=600')
+        self.assertFalse(hasattr(saved[bundle.filename], 'cache_control'))
+
+    @override_settings(BUNDLE_ENCODINGS=['br'], BUNDLE_BROTLI_INLINE_QUALITY=1,
+                       BUNDLE_BROTLI_QUALITY=11, BUNDLE_QUEUE='')
+    def test_generate_inline_no_queue(self):
+        """Without a queue to recompress with, compress at full quality."""
+        bundle = SnippetBundle(self._client(locale='fr', startpage_version=5))
+        bundle.snippets = [self.snippet1]
+
+        with patch.multiple('snippets.base.bundles', brotli=DEFAULT, cache=DEFAULT,
+                            default_storage=DEFAULT) as mocks:
+            mocks['brotli'].Compressor.return_value.process.return_value = b''
+            mocks['brotli'].Compressor.return_value.finish.return_value = b''
+            bundle.generate(inline=True)
+
+        mocks['brotli'].Compressor.assert_called_with(quality=11)
+        saved = dict(call[0] for call in mocks['default_storage'].save.call_args_list)
+        self.assertFalse(hasattr(saved[bundle.filename + '.br'], 'cache_control'))
 
     def test_cached_local(self):
         bundle = SnippetBundle(self._client(locale='fr', startpage_version=5))
@@ -228,26 +284,189 @@ class SnippetBundleTests(TestCase):
         bundle = SnippetBundle(self._client(locale='fr', startpage_version=5))
         with patch('snippets.base.bundles.cache') as cache:
             cache.get.return_value = False
-            with patch('snippets.base.bundles.default_storage') as default_storage:
-                default_storage.exists.return_value = True
+            with patch('snippets.base.bundles.manifest') as manifest:
+                manifest.exists.return_value = True
                 self.assertTrue(bundle.cached)
                 cache.set.assert_called_with(bundle.cache_key, True, ONE_DAY)
+        manifest.exists.assert_called_with(bundle.key)
 
     def test_not_cached(self):
         bundle = SnippetBundle(self._client(locale='fr', startpage_version=5))
         with patch('snippets.base.bundles.cache') as cache:
             cache.get.return_value = False
             with patch('snippets.base.bundles.default_storage') as default_storage:
-                default_storage.exists.return_value = False
                 self.assertFalse(bundle.cached)
+        # Storage doesn't get checked.
+        self.assertFalse(default_storage.exists.called)
 
     def test_empty(self):
         bundle = SnippetBundle(self._client(locale='fr', startpage_version=5))
         self.assertTrue(bundle.empty)
 
-        bundle.snippets = [self.snippet1, self.snippet2]
+        bundle = SnippetBundle(self._client(locale='fr', startpage_version=5))
+        bundle.matched_snippets = _matched(self.snippet1, self.snippet2)
         self.assertFalse(bundle.empty)
 
+    def test_key_not_loading_snippets(self):
+        """
+        The key, emptiness and expiry of a bundle only need the versions of
+        its snippets, not the snippets themselves.
+        """
+        bundle = SnippetBundle(self._client(locale='en-US', startpage_version=4))
+        bundle.matched_snippets = _matched(self.snippet1, self.snippet2)
+        with self.assertNumQueries(1):
+            bundle.key, bundle.empty, bundle.expires
+        self.assertNotIn('snippets', bundle.__dict__)
+
+    @override_settings(BUNDLE_QUEUE='local', CACHES=LOCMEM_CACHES)
+    def test_stale_url(self):
+        client = self._client(locale='fr', startpage_version=5)
+        bundle = SnippetBundle(client)
+        bundle.matched_snippets = _matched(self.snippet1)
+        self.assertIsNone(bundle.stale_url)
+
+        with patch('snippets.base.bundles.default_storage'):
+            bundle.generate()
+
+        # A bundle with the same snippets doesn't need the last good bundle.
+        same_bundle = SnippetBundle(client)
+        same_bundle.matched_snippets = _matched(self.snippet1)
+        self.assertIsNone(same_bundle.stale_url)
+
+        new_bundle = SnippetBundle(client)
+        new_bundle.matched_snippets = _matched(self.snippet1, self.snippet2)
+        self.assertEqual(new_bundle.stale_url, bundle.url)
+
+        # Don't serve the last good bundle for longer than BUNDLE_MAX_STALENESS.
+        django_cache.set(new_bundle.queued_cache_key, 0)
+        del new_bundle.stale
+        self.assertIsNone(new_bundle.stale_url)
+
+    @override_settings(BUNDLE_ENCODINGS=['br'], BUNDLE_QUEUE='local', CACHES=LOCMEM_CACHES)
+    def test_stale_url_encoding(self):
+        client = self._client(locale='fr', startpage_version=5)
+        django_cache.set(SnippetBundle(client).last_good_cache_key,
+                         {'key': 'foo', 'filename': 'bundle_foo.html', 'encodings': ['br']})
+        bundle = SnippetBundle(client)
+        bundle.encoding = 'br'
+        bundle.snippets = [self.snippet1]
+        with patch.object(bundle, 'get_url') as get_url:
+            self.assertEqual(bundle.stale_url, get_url.return_value)
+        get_url.assert_called_with('bundle_foo.html.br')
+
+        # Last good bundles without a variant in the encoding get served
+        # uncompressed.
+        bundle = SnippetBundle(client)
+        bundle.encoding = 'gzip'
+        bundle.snippets = [self.snippet1]
+        with patch.object(bundle, 'get_url') as get_url:
+            bundle.stale_url
+        get_url.assert_called_with('bundle_foo.html')
+
+    def test_url_encoding(self):
+        bundle = SnippetBundle(self._client(locale='fr', startpage_version=5))
+        bundle.snippets = [self.snippet1]
+        bundle.encoding = 'gzip'
+        self.assertTrue(bundle.url.endswith(bundle.filename + '.gz'))
+
+    @override_settings(BUNDLE_QUEUE='')
+    def test_stale_url_disabled(self):
+        client = self._client(locale='fr', startpage_version=5)
+        django_cache.set(SnippetBundle(client).last_good_cache_key,
+                         {'key': 'foo', 'filename': 'bundle_foo.html'})
+        self.assertIsNone(SnippetBundle(client).stale_url)
+
+    @override_settings(CACHES=LOCMEM_CACHES)
+    def test_enqueue(self):
+        bundle = SnippetBundle(self._client(locale='fr', startpage_version=5))
+        bundle.snippets = [self.snippet1]
+        with patch('snippets.base.bundles.get_queue') as get_queue:
+            get_queue.return_value.depth.return_value = 1
+            bundle.enqueue()
+            bundle.enqueue()
+        get_queue.return_value.put.assert_called_once_with(
+            {'key': bundle.key, 'client': list(bundle.client), 'endpoint': 'snippets'})
+
+    def test_ensure_generated(self):
+        bundle = SnippetBundle(self._client(locale='fr', startpage_version=5))
+        with patch.object(bundle, 'generate') as generate:
+            self.assertTrue(bundle.ensure_generated())
+        self.assertTrue(generate.called)
+        # The lock gets released.
+        self.assertIsNone(django_cache.get(bundle.lock_key))
+
+    @override_settings(BUNDLE_GENERATION_LOCK_WAIT=5, CACHES=LOCMEM_CACHES)
+    def test_ensure_generated_locked(self):
+        """
+        When another process generates the bundle, wait for it instead of
+        generating the bundle again.
+        """
+        bundle = SnippetBundle(self._client(locale='fr', startpage_version=5))
+        django_cache.add(bundle.lock_key, True)
+
+        def _sleep(seconds):
+            django_cache.set(bundle.cache_key, True)
+
+        with patch('snippets.base.bundles.time.sleep', side_effect=_sleep) as sleep:
+            with patch.object(bundle, 'generate') as generate:
+                self.assertFalse(bundle.ensure_generated())
+        self.assertEqual(sleep.call_count, 1)
+        self.assertFalse(generate.called)
+
+    @override_settings(BUNDLE_GENERATION_LOCK_WAIT=5, CACHES=LOCMEM_CACHES)
+    def test_ensure_generated_lock_takeover(self):
+        """
+        When the lock gets released without the bundle getting generated,
+        acquire it and generate the bundle.
+        """
+        bundle = SnippetBundle(self._client(locale='fr', startpage_version=5))
+        django_cache.add(bundle.lock_key, True)
+
+        def _sleep(seconds):
+            django_cache.delete(bundle.lock_key)
+
+        with patch('snippets.base.bundles.time.sleep', side_effect=_sleep) as sleep:
+            with patch.object(bundle, 'generate') as generate:
+                self.assertTrue(bundle.ensure_generated())
+        self.assertEqual(sleep.call_count, 1)
+        self.assertEqual(generate.call_count, 1)
+        self.assertIsNone(django_cache.get(bundle.lock_key))
+
+    @override_settings(BUNDLE_GENERATION_LOCK_WAIT=0.2, CACHES=LOCMEM_CACHES)
+    def test_ensure_generated_lock_timeout(self):
+        """
+        When the bundle doesn't get generated while waiting for the lock,
+        generate it only if a request needs it.
+        """
+        bundle = SnippetBundle(self._client(locale='fr', startpage_version=5))
+        django_cache.add(bundle.lock_key, True)
+
+        with patch.object(bundle, 'generate') as generate:
+            self.assertFalse(bundle.ensure_generated())
+        self.assertFalse(generate.called)
+
+        with patch.object(bundle, 'generate') as generate:
+            self.assertTrue(bundle.ensure_generated(inline=True))
+        generate.assert_called_once_with(inline=True)
+        # The lock stays with its holder.
+        self.assertTrue(django_cache.get(bundle.lock_key))
+
+    @override_settings(BUNDLE_GENERATION_SLOT_WAIT=0.5, CACHES=LOCMEM_CACHES)
+    def test_ensure_generated_no_slot(self):
+        """
+        When no generation slot frees up for a request, release the lock
+        without generating the bundle.
+        """
+        bundle = SnippetBundle(self._client(locale='fr', startpage_version=5))
+        with patch('snippets.base.bundles.generation_slot',
+                   side_effect=NoGenerationSlot) as generation_slot:
+            with patch.object(bundle, 'generate') as generate:
+                with self.assertRaises(NoGenerationSlot):
+                    bundle.ensure_generated(inline=True)
+        generation_slot.assert_called_once_with(0.5)
+        self.assertFalse(generate.called)
+        self.assertIsNone(django_cache.get(bundle.lock_key))
+
 
 class ASRSnippetBundleTests(TestCase):
     def setUp(self):
@@ -266,9 +485,9 @@ class ASRSnippetBundleTests(TestCase):
         """
         client = self._client()
         bundle1 = ASRSnippetBundle(client)
-        bundle1.snippets = [self.snippet1, self.snippet2]
+        bundle1.matched_snippets = _matched(self.snippet1, self.snippet2)
         bundle2 = ASRSnippetBundle(client)
-        bundle2.snippets = [self.snippet2]
+        bundle2.matched_snippets = _matched(self.snippet2)
 
         self.assertNotEqual(bundle1.key, bundle2.key)
 
@@ -308,26 +527,34 @@ class ASRSnippetBundleTests(TestCase):
         client1 = self._client(locale='en-US', startpage_version=4)
         client2 = self._client(locale='en-US', startpage_version=4)
         bundle1 = ASRSnippetBundle(client1)
-        bundle1.snippets = [self.snippet1, self.snippet2]
+        bundle1.matched_snippets = _matched(self.snippet1, self.snippet2)
         bundle2 = ASRSnippetBundle(client2)
-        bundle2.snippets = [self.snippet1, self.snippet2]
+        bundle2.matched_snippets = _matched(self.snippet1, self.snippet2)
 
         self.assertEqual(bundle1.key, bundle2.key)
 
     def test_key_snippet_modified(self):
         client1 = self._client(locale='en-US', startpage_version=4)
         bundle = ASRSnippetBundle(client1)
-        bundle.snippets = [self.snippet1]
+        bundle.matched_snippets = _matched(self.snippet1)
         key_1 = bundle.key
 
         # save snippet, touch modified
         self.snippet1.save()
         bundle = ASRSnippetBundle(client1)
-        bundle.snippets = [self.snippet1]
+        bundle.matched_snippets = _matched(self.snippet1)
         key_2 = bundle.key
         self.assertNotEqual(key_1, key_2)
 
-    @override_settings(BUNDLE_BROTLI_COMPRESS=False)
+    @override_settings(ASR_TARGETING_INDEX=False)
+    def test_key_not_loading_snippets(self):
+        bundle = ASRSnippetBundle(self._client(locale='en-US', startpage_version=6))
+        bundle.matched_snippets = _matched(self.snippet1, self.snippet2)
+        with self.assertNumQueries(1):
+            bundle.key, bundle.empty, bundle.expires
+        self.assertNotIn('snippets', bundle.__dict__)
+
+    @override_settings(BUNDLE_ENCODINGS=[])
     def test_generate(self):
         """
         bundle.generate should render the snippets, save them to the
@@ -358,3 +585,269 @@ class ASRSnippetBundleTests(TestCase):
         content_json = json.load(content_file)
         self.assertEqual(content_json['messages'], ['snippet1', 'snippet2'])
         self.assertEqual(content_json['metadata']['generated_at'], 'now')
+
+    @override_settings(BUNDLE_ENCODINGS=['br'])
+    def test_generate_brotli(self):
+        bundle = ASRSnippetBundle(self._client(locale='fr', startpage_version=6))
+        bundle.snippets = [self.snippet1, self.snippet2]
+        self.snippet1.render = Mock(return_value={'id': 1})
+        self.snippet2.render = Mock(return_value={'id': 2})
+
+        with patch.multiple('snippets.base.bundles',
+                            cache=DEFAULT, default_storage=DEFAULT) as mocks:
+            bundle.generate()
+
+        filename, content_file = mocks['default_storage'].save.call_args_list[0][0]
+        self.assertEqual(filename, bundle.filename + '.br')
+        self.assertEqual(content_file.content_encoding, 'br')
+        self.assertEqual(content_file.content_type, 'application/json')
+        content_json = json.loads(brotli.decompress(content_file.read()).decode('utf-8'))
+        self.assertEqual(content_json['messages'], [{'id': 1}, {'id': 2}])
+        self.assertEqual(content_json['metadata']['number_of_snippets'], 2)
+
+    @override_settings(ASR_TARGETING_INDEX=True)
+    def test_snippets_from_index(self):
+        client = self._client(locale='en-US', startpage_version=6, channel='release')
+        with patch('snippets.base.bundles.asr_index') as asr_index:
+            asr_index.match_client.return_value = [self.snippet1, self.snippet2]
+            asr_index.filter_by_available.return_value = [self.snippet1]
+            bundle = ASRSnippetBundle(client)
+            self.assertEqual(bundle.snippets, [self.snippet1])
+        asr_index.match_client.assert_called_with(client)
+        asr_index.filter_by_available.assert_called_with([self.snippet1, self.snippet2],
+                                                         bundle.now)
+
+    @override_settings(ASR_TARGETING_INDEX=False)
+    def test_snippets_from_database(self):
+        client = self._client(locale='en-US', startpage_version=6, channel='release')
+        with patch('snippets.base.bundles.asr_index') as asr_index:
+            bundle = ASRSnippetBundle(client)
+            self.assertEqual(set(bundle.snippets), set([self.snippet1, self.snippet2]))
+        self.assertFalse(asr_index.match_client.called)
+
+    @override_settings(ASR_TARGETING_INDEX=False)
+    def test_render_queries(self):
+        """
+        Rendering the bundle takes the same number of queries, no matter how
+        many snippets it has, even without stored renderings.
+        """
+        ASRSnippetFactory.create_batch(3)
+        ASRSnippet.objects.update(rendered='')
+        client = self._client(locale='en-US', startpage_version=6, channel='release')
+        bundle = ASRSnippetBundle(client)
+        # Matching, snippets with their campaigns and templates and targets.
+        with self.assertNumQueries(3):
+            self.assertEqual(len(bundle.snippets), 5)
+        # Subtemplates with their icons.
+        with self.assertNumQueries(1):
+            content = json.loads(''.join(bundle.iter_content()))
+        self.assertEqual(content['messages'][0], bundle.snippets[0].render())
+
+    @override_settings(ASR_TARGETING_INDEX=False)
+    def test_render_queries_legacy_templates(self):
+        """
+        Rendering snippets still on a SnippetTemplate takes no queries per
+        snippet either.
+        """
+        ASRSnippetFactory.create_batch(3)
+        Template.objects.all().delete()
+        ASRSnippet.objects.update(rendered='', data='{}')
+        client = self._client(locale='en-US', startpage_version=6, channel='release')
+        bundle = ASRSnippetBundle(client)
+        with self.assertNumQueries(3):
+            self.assertEqual(len(bundle.snippets), 5)
+        # Variables of the SnippetTemplates.
+        with self.assertNumQueries(1):
+            content = json.loads(''.join(bundle.iter_content()))
+        self.assertEqual(content['messages'][0], bundle.snippets[0].render())
+
+    @override_settings(ASR_TARGETING_INDEX=False)
+    def test_stored_renderings(self):
+        client = self._client(locale='en-US', startpage_version=6, channel='release')
+        bundle = ASRSnippetBundle(client)
+        bundle.snippets
+        with self.assertNumQueries(0):
+            with patch.object(ASRSnippet, 'render') as render:
+                content = json.loads(''.join(bundle.iter_content()))
+        self.assertFalse(render.called)
+        self.assertEqual(content['messages'],
+                         [json.loads(snippet.rendered) for snippet in bundle.snippets])
+
+    @override_settings(ASR_TARGETING_INDEX=True, CACHES=LOCMEM_CACHES)
+    def test_client_class_resolution(self):
+        """
+        Clients of the same ClientClass must resolve to the same bundle
+        without matching snippets again.
+        """
+        client1 = self._client(locale='en-US', startpage_version=6, channel='release',
+                               appbuildid='20190110041606')
+        client2 = self._client(locale='en-US', startpage_version=6, channel='release',
+                               appbuildid='20190210041606')
+
+        bundle1 = ASRSnippetBundle(client1)
+        with patch('snippets.base.bundles.default_storage'):
+            bundle1.generate()
+
+        bundle2 = ASRSnippetBundle(client2)
+        with patch('snippets.base.targeting.ASRSnippetIndex.match_client') as match_client:
+            with self.assertNumQueries(0):
+                self.assertFalse(bundle2.empty)
+                self.assertTrue(bundle2.cached)
+                self.assertEqual(bundle2.key, bundle1.key)
+        self.assertFalse(match_client.called)
+
+    @override_settings(ASR_TARGETING_INDEX=True, CACHES=LOCMEM_CACHES)
+    def test_client_class_resolution_empty(self):
+        client1 = self._client(locale='xx', startpage_version=6, channel='release',
+                               appbuildid='20190110041606')
+        client2 = self._client(locale='xx', startpage_version=6, channel='release',
+                               appbuildid='20190210041606')
+        self.assertTrue(ASRSnippetBundle(client1).empty)
+
+        bundle2 = ASRSnippetBundle(client2)
+        with patch('snippets.base.targeting.ASRSnippetIndex.match_client') as match_client:
+            self.assertTrue(bundle2.empty)
+        self.assertFalse(match_client.called)
+
+
+class JSONSnippetBundleTests(TestCase):
+    def setUp(self):
+        self.client = Client(4, 'Fennec', '23.0a1', '20130510041606', 'Darwin_Universal-gcc3',
+                             'en-US', 'release', 'Darwin 10.8.0', 'default', 'default_version')
+        self.snippet1 = JSONSnippetFactory.create(countries=['us', 'gr'])
+        self.snippet2 = JSONSnippetFactory.create()
+
+    def test_key_shared_by_clients(self):
+        """Clients matching the same snippets get the same bundle."""
+        key = JSONSnippetBundle(self.client).key
+        self.assertEqual(
+            JSONSnippetBundle(self.client._replace(appbuildid='20190110041606')).key, key)
+        self.assertNotEqual(JSONSnippetBundle(self.client._replace(channel='beta')).key, key)
+        self.assertNotEqual(SnippetBundle(self.client).class_key,
+                            JSONSnippetBundle(self.client).class_key)
+
+    def test_key_countries(self):
+        key = JSONSnippetBundle(self.client).key
+        self.snippet1.countries.remove(self.snippet1.countries.first())
+        self.assertNotEqual(JSONSnippetBundle(self.client).key, key)
+
+        key = JSONSnippetBundle(self.client).key
+        self.snippet1.countries.first().jsonsnippet_set.clear()
+        self.assertNotEqual(JSONSnippetBundle(self.client).key, key)
+
+    def test_key_queries(self):
+        """The key only depends on matching the snippets."""
+        bundle = JSONSnippetBundle(self.client)
+        bundle.matched_versions
+        with self.assertNumQueries(0):
+            bundle.key
+
+    @override_settings(BUNDLE_ENCODINGS=[])
+    def test_generate(self):
+        bundle = JSONSnippetBundle(self.client)
+        # Matching, availability and countries of all snippets.
+        with self.assertNumQueries(3):
+            bundle.snippets
+        bundle.key
+        with patch('snippets.base.bundles.default_storage') as default_storage:
+            with CaptureQueriesContext(connection) as queries:
+                bundle.generate()
+        # Only the manifest gets queried, the countries are prefetched.
+        for query in queries.captured_queries:
+            self.assertNotIn('base_targetedcountry', query['sql'])
+            self.assertNotIn('base_jsonsnippet', query['sql'])
+
+        filename, content_file = default_storage.save.call_args[0]
+        self.assertEqual(filename, bundle.filename)
+        data = json.loads(content_file.read().decode('utf-8'))
+        self.assertEqual(set(snippet['id'] for snippet in data),
+                         set([self.snippet1.id, self.snippet2.id]))
+        countries = [snippet.get('countries') for snippet in data if snippet.get('countries')]
+        self.assertEqual([sorted(country_list) for country_list in countries], [['GR', 'US']])
+        self.assertTrue(JSONSnippetBundle(self.client).cached)
+
+    def test_get_bundle(self):
+        self.assertIsInstance(get_bundle(self.client, 'json'), JSONSnippetBundle)
+
+
+class WriteBundleContentTests(TestCase):
+    def test_identity(self):
+        content_files = write_bundle_content(['{"a": ', '"b"', '}'])
+        self.assertEqual(list(content_files), ['identity'])
+        self.assertFalse(hasattr(content_files['identity'], 'content_encoding'))
+        self.assertEqual(content_files['identity'].read(), b'{"a": "b"}')
+
+    def test_unicode(self):
+        content_file = write_bundle_content(['f', '\u00f6', 'o'])['identity']
+        self.assertEqual(content_file.read().decode('utf-8'), 'f\u00f6o')
+
+    def test_encodings(self):
+        chunks = ['{"messages": [', ', '.join(['"snippet"'] * 1000), ']}']
+        content = ''.join(chunks).encode('utf-8')
+        content_files = write_bundle_content(chunks, ['br', 'gzip', 'identity'])
+        self.assertEqual(list(content_files), ['br', 'gzip', 'identity'])
+
+        self.assertEqual(content_files['br'].content_encoding, 'br')
+        self.assertEqual(content_files['br'].size, len(content_files['br'].read()))
+        content_files['br'].seek(0)
+        self.assertEqual(brotli.decompress(content_files['br'].read()), content)
+
+        self.assertEqual(content_files['gzip'].content_encoding, 'gzip')
+        self.assertEqual(gzip.decompress(content_files['gzip'].read()), content)
+
+        self.assertEqual(content_files['identity'].read(), content)
+
+    def test_spooled_to_disk(self):
+        chunks = ['x' * 1024] * 2048
+        with patch('snippets.base.bundles.SPOOL_MAX_SIZE', 1024):
+            content_file = write_bundle_content(chunks)['identity']
+        self.assertEqual(content_file.size, 2 * 1024 * 1024)
+
+
+class RecompressTests(TestCase):
+    content = b'{"messages": []}' * 100
+
+    def test_base(self):
+        with patch('snippets.base.bundles.default_storage') as default_storage:
+            default_storage.exists.return_value = True
+            default_storage.size.return_value = 1000
+            default_storage.open.return_value = ContentFile(self.content)
+            with patch('snippets.base.bundles.statsd') as statsd:
+                saved = recompress('foo', 'bundle_foo.json')
+
+        filename, content_file = default_storage.save.call_args[0]
+        self.assertEqual(filename, 'bundle_foo.json.br')
+        self.assertEqual(content_file.content_type, 'application/json')
+        self.assertFalse(hasattr(content_file, 'cache_control'))
+        self.assertEqual(brotli.decompress(content_file.read()), self.content)
+        self.assertEqual(saved, 1000 - content_file.size)
+        statsd.incr.assert_called_with('bundle.recompress.bytes_saved', saved)
+
+    def test_not_smaller(self):
+        with patch('snippets.base.bundles.default_storage') as default_storage:
+            default_storage.exists.return_value = True
+            default_storage.size.return_value = 10
+            default_storage.open.return_value = ContentFile(self.content)
+            self.assertEqual(recompress('foo', 'bundle_foo.json'), 0)
+        self.assertFalse(default_storage.save.called)
+
+    def test_missing(self):
+        with patch('snippets.base.bundles.default_storage') as default_storage:
+            default_storage.exists.return_value = False
+            self.assertEqual(recompress('foo', 'bundle_foo.json'), 0)
+        self.assertFalse(default_storage.save.called)
+
+
+class GetEncodingsTests(TestCase):
+    @override_settings(BUNDLE_ENCODINGS=['gzip', 'identity', 'br'])
+    def test_identity_last(self):
+        self.assertEqual(get_encodings(), ['gzip', 'br', 'identity'])
+
+    @override_settings(BUNDLE_ENCODINGS=[])
+    def test_empty(self):
+        self.assertEqual(get_encodings(), ['identity'])
+
+    @override_settings(BUNDLE_ENCODINGS=['deflate'])
+    def test_unknown(self):
+        with self.assertRaises(ImproperlyConfigured):
+            get_encodings()
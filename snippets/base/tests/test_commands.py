@@ -1,11 +1,21 @@
+import json
+import tempfile
 from datetime import datetime, timedelta
+from urllib.parse import urlparse
 
-from unittest.mock import Mock
+from unittest.mock import Mock, patch
 
+from django.core.cache import cache
 from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test.utils import override_settings
 
-from snippets.base.models import STATUS_CHOICES
-from snippets.base.tests import ASRSnippetFactory, SnippetFactory, TestCase
+from snippets.base import manifest
+from snippets.base.bundles import ASRSnippetBundle
+from snippets.base.models import STATUS_CHOICES, ASRSnippet, BundleManifestEntry, Client
+from snippets.base.targeting import get_index_version
+from snippets.base.tests import (LOCMEM_CACHES, ASRSnippetFactory, ClientMatchRuleFactory,
+                                 SnippetFactory, TargetFactory, TestCase)
 
 
 class DisableSnippetsPastPublishDateTests(TestCase):
@@ -44,3 +54,296 @@ class DisableSnippetsPastPublishDateTests(TestCase):
         self.assertEqual(asrsnippet_that_has_ended.status, STATUS_CHOICES['Approved'])
         self.assertEqual(asrsnippet_without_end_date.status, STATUS_CHOICES['Published'])
         self.assertEqual(asrsnippet_ending_in_the_future.status, STATUS_CHOICES['Published'])
+
+
+class CheckTargetingIndexTests(TestCase):
+    def test_base(self):
+        ASRSnippetFactory.create_batch(2)
+        stdout = Mock()
+        call_command('check_targeting_index', stdout=stdout)
+        self.assertIn('Inconsistent Clients: 0', stdout.write.call_args[0][0])
+
+    def test_inconsistent(self):
+        ASRSnippetFactory.create()
+        with patch('snippets.base.targeting.ASRSnippetIndex.get_snippets') as get_snippets:
+            get_snippets.return_value = []
+            with self.assertRaises(CommandError):
+                call_command('check_targeting_index', stdout=Mock(), stderr=Mock())
+
+
+class BenchmarkClientMatchRulesTests(TestCase):
+    def test_base(self):
+        stdout = Mock()
+        call_command('benchmark_client_match_rules', rules=50, clients=10, stdout=stdout)
+        self.assertIn('Rules: 50', stdout.write.call_args[0][0])
+
+
+class BenchmarkBundleSerializationTests(TestCase):
+    def test_base(self):
+        stdout = Mock()
+        call_command('benchmark_bundle_serialization', messages=20, message_size=100,
+                     stdout=stdout)
+        self.assertIn('Messages: 20', stdout.write.call_args[0][0])
+
+
+class BenchmarkBundleEncodingsTests(TestCase):
+    def test_base(self):
+        stdout = Mock()
+        call_command('benchmark_bundle_encodings', messages=20, message_size=100, stdout=stdout)
+        output = stdout.write.call_args[0][0]
+        for label in ['br (quality 11)', 'gzip', 'identity']:
+            self.assertIn('{0}: '.format(label), output)
+
+
+class BenchmarkSubtemplateLoadingTests(TestCase):
+    def test_base(self):
+        ASRSnippetFactory.create_batch(3)
+        stdout = Mock()
+        call_command('benchmark_subtemplate_loading', snippets=10, stdout=stdout)
+        output = stdout.write.call_args[0][0]
+        self.assertIn('Snippets: 3\n', output)
+        self.assertIn('One By One Queries: 3\n', output)
+        self.assertIn('Batched Queries: 1\n', output)
+
+
+class BenchmarkBundleURLsTests(TestCase):
+    def test_base(self):
+        stdout = Mock()
+        call_command('benchmark_bundle_urls', urls=10, stdout=stdout)
+        output = stdout.write.call_args[0][0]
+        self.assertIn('URLs: 10\n', output)
+        self.assertIn('Storage Time: ', output)
+        self.assertIn('Public URL Time: ', output)
+
+    def test_different_urls(self):
+        with patch('snippets.base.management.commands.benchmark_bundle_urls.public_url',
+                   return_value='/foo'):
+            with self.assertRaises(CommandError):
+                call_command('benchmark_bundle_urls', urls=10, stdout=Mock())
+
+
+class BenchmarkBundlePipelineTests(TestCase):
+    def test_base(self):
+        stdout = Mock()
+        call_command('benchmark_bundle_pipeline', snippets=5, targets=2, rules=3, locales=2,
+                     clients=3, stdout=stdout)
+        results = json.loads(stdout.write.call_args[0][0])
+        self.assertEqual(results['options']['snippets'], 5)
+        for stage in ['match_client', 'filter_by_available', 'key', 'render', 'serialize',
+                      'compress', 'save']:
+            self.assertEqual(results['stages'][stage]['calls'], 3)
+        # The fixtures get rolled back.
+        self.assertFalse(ASRSnippet.objects.exists())
+
+    @override_settings(ASR_TARGETING_INDEX=True, CACHES=LOCMEM_CACHES)
+    def test_private_index(self):
+        """The shared targeting index doesn't get invalidated."""
+        version = get_index_version()
+        stdout = Mock()
+        call_command('benchmark_bundle_pipeline', snippets=5, targets=2, rules=3, locales=2,
+                     clients=3, stdout=stdout)
+        results = json.loads(stdout.write.call_args[0][0])
+        self.assertEqual(results['stages']['build_index']['calls'], 1)
+        self.assertEqual(get_index_version(), version)
+
+
+class ReplayFetchURLsTests(TestCase):
+    def _call_command(self, **kwargs):
+        response = Mock(status_code=302,
+                        headers={'X-Bundle-Outcome': 'cached', 'X-DB-Queries': '2'})
+        stdout = Mock()
+        with patch('snippets.base.management.commands.replay_fetch_urls.requests') as requests:
+            requests.Session.return_value.get.return_value = response
+            call_command('replay_fetch_urls', concurrency=2, stdout=stdout, **kwargs)
+        return stdout.write.call_args[0][0], requests.Session.return_value
+
+    def test_synthetic(self):
+        output, session = self._call_command(synthetic=5, requests=10)
+        self.assertIn('Requests: 10\n', output)
+        self.assertIn('Statuses: 302: 10\n', output)
+        self.assertIn('First Requests Latency: ', output)
+        self.assertIn('Bundle cached: 10\n', output)
+        self.assertIn('Bundle generate: 0\n', output)
+        self.assertIn('Queries per Request: 2.00 mean, 2 max\n', output)
+        url = session.get.call_args[0][0]
+        self.assertTrue(url.startswith('http://127.0.0.1:8000/6/'))
+
+    def test_urls_file(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.log') as urls_file:
+            urls_file.write(
+                '10.0.0.1 - - [16/Oct/2026:10:00:00 +0000] "GET /6/Firefox/64.0/20190110041606/'
+                'default/en-US/release/Darwin%2017.7.0/default/default/ HTTP/1.1" 302 0\n'
+                '/json/4/Fennec/64.0/20190110041606/default/en-US/release/Linux/default/'
+                'default/\n'
+                '10.0.0.1 - - [16/Oct/2026:10:00:00 +0000] "GET /healthz/ HTTP/1.1" 200 2\n')
+            urls_file.flush()
+            output, session = self._call_command(urls_file=urls_file.name)
+        self.assertIn('Requests: 2\n', output)
+        self.assertEqual(sorted(urlparse(call[0][0]).path.split('/')[1]
+                                for call in session.get.call_args_list), ['6', 'json'])
+
+    def test_no_urls(self):
+        with tempfile.NamedTemporaryFile('w') as urls_file:
+            with self.assertRaises(CommandError):
+                call_command('replay_fetch_urls', urls_file=urls_file.name, stdout=Mock())
+
+
+class VerifyRenderedSnippetsTests(TestCase):
+    def test_base(self):
+        SnippetFactory.create(published=True)
+        ASRSnippetFactory.create_batch(2)
+        stdout = Mock()
+        call_command('verify_rendered_snippets', stdout=stdout)
+        output = stdout.write.call_args[0][0]
+        self.assertIn('Snippets Checked: 3\n', output)
+        self.assertIn('Stale Renderings: 0\n', output)
+        self.assertIn('Mismatched Renderings: 0\n', output)
+
+    def test_mismatched(self):
+        snippet = ASRSnippetFactory.create()
+        ASRSnippet.objects.update(rendered='{"id": "old"}')
+        stderr = Mock()
+        with self.assertRaises(CommandError):
+            call_command('verify_rendered_snippets', stdout=Mock(), stderr=stderr)
+        self.assertIn('+  "id": "{0}",\n'.format(snippet.id),
+                      [call[0][0] for call in stderr.write.call_args_list])
+
+    def test_update(self):
+        snippet = ASRSnippetFactory.create()
+        ASRSnippet.objects.update(rendered='')
+        stdout = Mock()
+        call_command('verify_rendered_snippets', update=True, stdout=stdout)
+        output = stdout.write.call_args[0][0]
+        self.assertIn('Stale Renderings: 1\n', output)
+        self.assertIn('Updated Renderings: 1\n', output)
+        snippet.refresh_from_db()
+        self.assertEqual(json.loads(snippet.rendered), snippet.render())
+
+
+@patch('snippets.base.management.commands.pregenerate_bundles.product_details',
+       Mock(languages={'en-US': {}, 'fr': {}}))
+class PregenerateBundlesTests(TestCase):
+    def _call_command(self, **kwargs):
+        stdout = Mock()
+        with patch('snippets.base.bundles.default_storage') as default_storage:
+            default_storage.exists.return_value = False
+            call_command('pregenerate_bundles', processes=1, firefox_versions=['64.0'],
+                         stdout=stdout, **kwargs)
+        return stdout.write.call_args[0][0], default_storage
+
+    def test_base(self):
+        ASRSnippetFactory.create(locales=['en-us'])
+        SnippetFactory.create(locales=['en-us'], on_startpage_4=True)
+
+        output, default_storage = self._call_command()
+        # One ASR bundle and one legacy bundle for each of startpage 4 and 5,
+        # all for en-US.
+        self.assertIn('Bundles: 3', output)
+        self.assertIn('Generated Bundles: 3', output)
+        # Each one saved in br, gzip and identity encodings.
+        self.assertEqual(default_storage.save.call_count, 9)
+
+    def test_rule_variants(self):
+        rule = ClientMatchRuleFactory(distribution='acer')
+        snippet = ASRSnippetFactory.create(locales=['en-us'],
+                                           targets=[TargetFactory(client_match_rules=[rule])])
+        ASRSnippetFactory.create(locales=['en-us'])
+
+        output, default_storage = self._call_command()
+        self.assertIn('Bundles: 2', output)
+
+        # The bundle of clients passing the rule includes snippet.
+        client = Client(6, 'Firefox', '64.0', 'default', 'default', 'en-US', 'release',
+                        'default', 'acer', 'default')
+        bundle = ASRSnippetBundle(client)
+        self.assertIn(snippet, bundle.snippets)
+        filenames = [call[0][0] for call in default_storage.save.call_args_list]
+        self.assertIn(bundle.filename, filenames)
+        self.assertIn('Skipped Client Match Rules: 0', output)
+
+    def test_skipped_rules(self):
+        ClientMatchRuleFactory(distribution='/ac.r/')
+        ClientMatchRuleFactory(distribution='acer', is_exclusion=True)
+        ClientMatchRuleFactory(distribution='acer')
+        output, default_storage = self._call_command(dry_run=True)
+        self.assertIn('Skipped Client Match Rules: 2', output)
+
+    @override_settings(BUNDLE_GENERATION_LOCK_WAIT=0, CACHES=LOCMEM_CACHES)
+    def test_locked(self):
+        """Skip bundles another process is generating."""
+        ASRSnippetFactory.create(locales=['en-us'])
+        client = Client(6, 'Firefox', '64.0', 'default', 'default', 'en-US', 'release',
+                        'default', 'default', 'default')
+        cache.add(ASRSnippetBundle(client).lock_key, True)
+
+        output, default_storage = self._call_command()
+        self.assertIn('Missing Bundles: 1', output)
+        self.assertIn('Generated Bundles: 0', output)
+        self.assertFalse(default_storage.save.called)
+
+    def test_dry_run(self):
+        ASRSnippetFactory.create(locales=['en-us'])
+        output, default_storage = self._call_command(dry_run=True)
+        self.assertIn('Missing Bundles: 1', output)
+        self.assertIn('Generated Bundles: 0', output)
+        self.assertFalse(default_storage.save.called)
+
+
+class RepairBundleManifestTests(TestCase):
+    key = '0' * 40
+
+    def _call_command(self, **kwargs):
+        stdout = Mock()
+        filenames = [
+            'bundle_{0}.json'.format(self.key),
+            'bundle_{0}.json.br'.format(self.key),
+            # Not completely saved yet.
+            'bundle_{0}.html.gz'.format('1' * 40),
+            'README',
+        ]
+        with patch('snippets.base.management.commands.repair_bundle_manifest.default_storage'
+                   ) as default_storage:
+            default_storage.listdir.return_value = ([], filenames)
+            default_storage.size.return_value = 10
+            default_storage.get_modified_time.return_value = datetime(2019, 1, 1)
+            call_command('repair_bundle_manifest', stdout=stdout, **kwargs)
+        return stdout.write.call_args[0][0]
+
+    def test_base(self):
+        manifest.record('2' * 40, 'bundles/bundle_{0}.json'.format('2' * 40), 10, ['identity'])
+
+        output = self._call_command()
+        self.assertIn('Bundles in Storage: 1', output)
+        self.assertIn('Added Entries: 1', output)
+        self.assertIn('Removed Entries: 1', output)
+
+        entry = BundleManifestEntry.objects.get()
+        self.assertEqual(entry.key, self.key)
+        self.assertEqual(entry.filename, 'bundles/bundle_{0}.json'.format(self.key))
+        self.assertEqual(entry.size, 20)
+        self.assertEqual(entry.encodings, 'br,identity')
+        self.assertEqual(entry.generated, datetime(2019, 1, 1))
+        self.assertFalse(manifest.exists('2' * 40))
+
+    def test_dry_run(self):
+        output = self._call_command(dry_run=True)
+        self.assertIn('Added Entries: 1', output)
+        self.assertFalse(BundleManifestEntry.objects.exists())
+
+
+class ProcessBundleQueueTests(TestCase):
+    def test_base(self):
+        task = {'key': 'foo', 'client': []}
+        stdout = Mock()
+        with patch('snippets.base.management.commands.process_bundle_queue.get_queue') as get_queue:
+            get_queue.return_value.get.side_effect = [task, task, None]
+            get_queue.return_value.depth.return_value = 0
+            with patch('snippets.base.management.commands.process_bundle_queue.process') as process:
+                call_command('process_bundle_queue', max_tasks=5, stdout=stdout)
+        self.assertEqual(process.call_count, 2)
+        self.assertIn('Processed Tasks: 2', stdout.write.call_args[0][0])
+
+    @override_settings(BUNDLE_QUEUE='')
+    def test_disabled(self):
+        with self.assertRaises(CommandError):
+            call_command('process_bundle_queue', max_tasks=1, stdout=Mock())
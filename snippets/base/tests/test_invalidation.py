@@ -0,0 +1,90 @@
+from unittest.mock import patch
+
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from snippets.base import invalidation
+from snippets.base.models import ASRSnippet, SearchProvider, get_icon_snippet_ids
+from snippets.base.tests import ASRSnippetFactory, IconFactory, TestCase
+
+
+def _modified_updates(queries):
+    """Return the queries updating ASRSnippet.modified."""
+    return [query['sql'] for query in queries.captured_queries
+            if query['sql'].startswith('UPDATE') and 'base_asrsnippet' in query['sql'] and
+            'rendered' not in query['sql']]
+
+
+class InvalidationTests(TestCase):
+    def setUp(self):
+        self.snippet1, self.snippet2 = ASRSnippetFactory.create_batch(2)
+
+    def _modified(self):
+        return dict(ASRSnippet.objects.values_list('pk', 'modified'))
+
+    def test_transaction(self):
+        """Changes in a transaction update the snippets once it commits."""
+        modified = self._modified()
+        with CaptureQueriesContext(connection) as queries:
+            with transaction.atomic():
+                self.snippet1.campaign.save()
+                self.snippet2.campaign.save()
+                self.snippet1.targets.first().save()
+                self.assertEqual(self._modified(), modified)
+
+        self.assertEqual(len(_modified_updates(queries)), 1)
+        new_modified = self._modified()
+        for pk in modified:
+            self.assertGreater(new_modified[pk], modified[pk])
+
+    def test_rollback(self):
+        """Changes of rolled back transactions get discarded."""
+        modified = self._modified()
+        try:
+            with transaction.atomic():
+                self.snippet1.campaign.save()
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertEqual(self._modified(), modified)
+
+        self.snippet2.campaign.save()
+        new_modified = self._modified()
+        self.assertEqual(new_modified[self.snippet1.pk], modified[self.snippet1.pk])
+        self.assertGreater(new_modified[self.snippet2.pk], modified[self.snippet2.pk])
+
+    def test_deferred(self):
+        modified = self._modified()
+        with CaptureQueriesContext(connection) as queries:
+            with invalidation.deferred():
+                self.snippet1.campaign.save()
+                self.snippet2.campaign.save()
+                self.assertEqual(self._modified(), modified)
+
+        self.assertEqual(len(_modified_updates(queries)), 1)
+        self.assertNotEqual(self._modified(), modified)
+
+    def test_template(self):
+        modified = self._modified()
+        self.snippet1.template_ng.save()
+        new_modified = self._modified()
+        self.assertGreater(new_modified[self.snippet1.pk], modified[self.snippet1.pk])
+        self.assertEqual(new_modified[self.snippet2.pk], modified[self.snippet2.pk])
+
+    def test_unrelated_model(self):
+        with patch('snippets.base.invalidation._get_batch') as get_batch:
+            SearchProvider.objects.create(name='foo', identifier='foo')
+        self.assertFalse(get_batch.called)
+
+    def test_icon_snippet_ids(self):
+        icon = IconFactory.create()
+        template = self.snippet1.template_ng
+        template.title_icon = icon
+        template.save()
+        self.snippet2.template_ng.icon = icon
+        self.snippet2.template_ng.save()
+
+        with self.assertNumQueries(1):
+            snippet_ids = set(get_icon_snippet_ids([icon.pk]))
+        self.assertEqual(snippet_ids, set([self.snippet1.pk, self.snippet2.pk]))
+        self.assertEqual(set(icon.snippets), set([self.snippet1, self.snippet2]))
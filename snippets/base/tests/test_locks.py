@@ -0,0 +1,66 @@
+import fcntl
+import os
+import shutil
+import tempfile
+
+from django.test.utils import override_settings
+
+from unittest.mock import patch
+
+from snippets.base.locks import NoGenerationSlot, generation_slot
+from snippets.base.tests import TestCase
+
+
+class GenerationSlotTests(TestCase):
+    def setUp(self):
+        self.slots_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.slots_dir)
+
+    def _hold_slot(self, slot):
+        path = os.path.join(self.slots_dir, 'bundle-generation-slot-{0}.lock'.format(slot))
+        fd = os.open(path, os.O_RDWR | os.O_CREAT)
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        self.addCleanup(os.close, fd)
+
+    def test_base(self):
+        with self.settings(BUNDLE_GENERATION_SLOTS_DIR=self.slots_dir,
+                           BUNDLE_GENERATION_CONCURRENCY=1):
+            with generation_slot():
+                pass
+            # The slot got released.
+            with generation_slot():
+                pass
+
+    def test_free_slot(self):
+        self._hold_slot(0)
+        with self.settings(BUNDLE_GENERATION_SLOTS_DIR=self.slots_dir,
+                           BUNDLE_GENERATION_CONCURRENCY=2):
+            with patch('snippets.base.locks.statsd') as statsd:
+                with generation_slot():
+                    pass
+        self.assertFalse(statsd.incr.called)
+
+    @override_settings(BUNDLE_GENERATION_LOCK_TIMEOUT=0.1)
+    def test_slot_timeout(self):
+        """When no slot frees up in time, don't proceed."""
+        self._hold_slot(0)
+        with self.settings(BUNDLE_GENERATION_SLOTS_DIR=self.slots_dir,
+                           BUNDLE_GENERATION_CONCURRENCY=1):
+            with patch('snippets.base.locks.statsd') as statsd:
+                with self.assertRaises(NoGenerationSlot):
+                    with generation_slot():
+                        self.fail('Generated without a slot.')
+        statsd.incr.assert_any_call('bundle.generate.slot_wait')
+        statsd.incr.assert_any_call('bundle.generate.slot_timeout')
+
+    @override_settings(BUNDLE_GENERATION_LOCK_TIMEOUT=60)
+    def test_slot_wait(self):
+        """Wait only up to wait seconds for a slot, if given."""
+        self._hold_slot(0)
+        with self.settings(BUNDLE_GENERATION_SLOTS_DIR=self.slots_dir,
+                           BUNDLE_GENERATION_CONCURRENCY=1):
+            with patch('snippets.base.locks.time.sleep') as sleep:
+                with self.assertRaises(NoGenerationSlot):
+                    with generation_slot(wait=0):
+                        pass
+        self.assertFalse(sleep.called)
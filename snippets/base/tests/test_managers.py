@@ -46,9 +46,7 @@ class SnippetQuerySetTests(TestCase):
         # Snippet that ended.
         SnippetFactory.create(publish_end=datetime(2012, 5, 1, 0, 0))
 
-        with patch('snippets.base.managers.datetime') as datetime_mock:
-            datetime_mock.utcnow.return_value = datetime(2012, 6, 1, 0, 0)
-            matching_snippets = self.manager.all().filter_by_available()
+        matching_snippets = self.manager.all().filter_by_available(datetime(2012, 6, 1, 0, 0))
 
         self.assertEqual(set([snippet_match_1, snippet_match_2]), set(matching_snippets))
 
@@ -204,6 +202,19 @@ class SnippetManagerTests(TestCase):
         self.assertEqual(set([nightly_snippet]), set(nightly_snippets))
         self.assertEqual(set([nightly_snippet]), set(default_snippets))
 
+    def test_match_client_num_queries(self):
+        rule_pass = ClientMatchRuleFactory(channel='nightly')
+        rule_fail = ClientMatchRuleFactory(channel='release')
+        snippets = SnippetFactory.create_batch(25, on_nightly=True,
+                                               client_match_rules=[rule_pass])
+        SnippetFactory.create_batch(25, on_nightly=True,
+                                    client_match_rules=[rule_pass, rule_fail])
+
+        client = self._build_client(channel='nightly')
+        with self.assertNumQueries(2):
+            matched_snippets = list(Snippet.objects.match_client(client))
+        self.assertEqual(set(matched_snippets), set(snippets))
+
 
 class ASRSnippetManagerTests(TestCase):
     def _build_client(self, **client_attrs):
@@ -390,3 +401,32 @@ class ASRSnippetManagerTests(TestCase):
         # are the same snippets. Just `nightly_snippet` in this case.
         self.assertEqual(set([nightly_snippet]), set(nightly_snippets))
         self.assertEqual(set([nightly_snippet]), set(default_snippets))
+
+    def test_match_client_num_queries(self):
+        rule_pass = ClientMatchRuleFactory(channel='nightly')
+        rule_fail = ClientMatchRuleFactory(channel='release')
+        snippets = [
+            ASRSnippetFactory.create(
+                targets=[TargetFactory(on_nightly=True, client_match_rules=[rule_pass]),
+                         TargetFactory(on_nightly=True)])
+            for i in range(25)
+        ]
+        for i in range(25):
+            ASRSnippetFactory.create(
+                targets=[TargetFactory(on_nightly=True, client_match_rules=[rule_pass]),
+                         TargetFactory(on_beta=True, client_match_rules=[rule_fail])])
+
+        client = self._build_client(channel='nightly')
+        with self.assertNumQueries(2):
+            matched_snippets = list(ASRSnippet.objects.match_client(client))
+        self.assertEqual(set(matched_snippets), set(snippets))
+
+    def test_match_client_distinct_targets(self):
+        """
+        If a snippet has multiple targets that match the client, the
+        snippet should only be included in the queryset once.
+        """
+        snippet = ASRSnippetFactory.create(
+            targets=[TargetFactory(on_nightly=True), TargetFactory(on_nightly=True)])
+        client = self._build_client(channel='nightly')
+        self.assertEqual(list(ASRSnippet.objects.match_client(client)), [snippet])
@@ -0,0 +1,84 @@
+import time
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from unittest.mock import patch
+
+from snippets.base import manifest
+from snippets.base.models import BundleManifestEntry
+from snippets.base.tests import LOCMEM_CACHES, TestCase
+
+
+class ManifestTests(TestCase):
+    def test_record(self):
+        self.assertFalse(manifest.exists('foo'))
+
+        manifest.record('foo', 'bundles/bundle_foo.json', 100, ['br', 'identity'])
+        entry = BundleManifestEntry.objects.get(key='foo')
+        self.assertEqual(entry.filename, 'bundles/bundle_foo.json')
+        self.assertEqual(entry.size, 100)
+        self.assertEqual(entry.encodings, 'br,identity')
+
+        with self.assertNumQueries(0):
+            self.assertTrue(manifest.exists('foo'))
+
+    @override_settings(CACHES=LOCMEM_CACHES)
+    def test_exists_cache(self):
+        cache.set(manifest.CACHE_KEY.format('foo'), True)
+        with self.assertNumQueries(0):
+            self.assertTrue(manifest.exists('foo'))
+        self.assertIn('foo', manifest._keys)
+
+    @override_settings(CACHES=LOCMEM_CACHES)
+    def test_exists_database(self):
+        BundleManifestEntry.objects.create(key='foo', filename='bundle_foo.json',
+                                           encodings='identity')
+        with self.assertNumQueries(1):
+            self.assertTrue(manifest.exists('foo'))
+        self.assertTrue(cache.get(manifest.CACHE_KEY.format('foo')))
+        with self.assertNumQueries(0):
+            self.assertTrue(manifest.exists('foo'))
+
+    def test_warm(self):
+        BundleManifestEntry.objects.create(key='foo', filename='bundle_foo.json',
+                                           encodings='identity')
+        BundleManifestEntry.objects.create(key='bar', filename='bundle_bar.json',
+                                           encodings='identity',
+                                           generated=timezone.now() - timedelta(days=2))
+        manifest.warm()
+        self.assertIn('foo', manifest._keys)
+        self.assertNotIn('bar', manifest._keys)
+
+    @override_settings(BUNDLE_MANIFEST_LOCAL_TIMEOUT=60)
+    def test_local_keys_expire(self):
+        keys = manifest.LocalKeys()
+        keys.add('foo')
+        self.assertIn('foo', keys)
+        with patch('snippets.base.manifest.time.time', return_value=time.time() + 61):
+            self.assertNotIn('foo', keys)
+        self.assertEqual(len(keys), 0)
+
+    @override_settings(BUNDLE_MANIFEST_LOCAL_MAX_KEYS=2)
+    def test_local_keys_evict(self):
+        """The least recently used keys get evicted."""
+        keys = manifest.LocalKeys()
+        keys.update(['foo', 'bar'])
+        self.assertIn('foo', keys)
+        keys.add('baz')
+        self.assertNotIn('bar', keys)
+        self.assertIn('foo', keys)
+        self.assertIn('baz', keys)
+
+    def test_record_recompressed(self):
+        manifest.record('foo', 'bundle_foo.json', 100, ['br', 'identity'])
+        manifest.record_recompressed('foo', 30)
+        self.assertEqual(BundleManifestEntry.objects.get(key='foo').size, 70)
+
+    def test_discard(self):
+        manifest.record('foo', 'bundle_foo.json', 100, ['identity'])
+        manifest.discard(['foo'])
+        self.assertFalse(BundleManifestEntry.objects.exists())
+        self.assertFalse(manifest.exists('foo'))
@@ -1,8 +1,12 @@
 from unittest.mock import Mock, patch
 
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import HttpResponse
 from django.test import RequestFactory
+from django.test.utils import override_settings
 
-from snippets.base.middleware import FetchSnippetsMiddleware
+from snippets.base.middleware import FetchSnippetsMiddleware, LoadReplayMiddleware
+from snippets.base.models import ASRSnippet
 from snippets.base.tests import TestCase
 
 
@@ -62,3 +66,30 @@ class FetchSnippetsMiddlewareTests(TestCase):
         """
         request = RequestFactory().get('/admin')
         self.assertEqual(self.middleware(request), self.get_response_mock())
+
+
+class LoadReplayMiddlewareTests(TestCase):
+    @override_settings(LOAD_REPLAY_HEADERS=False)
+    def test_disabled(self):
+        with self.assertRaises(MiddlewareNotUsed):
+            LoadReplayMiddleware(Mock())
+
+    # Queries django-cachalot answers don't reach the database and don't
+    # count, so the second query would go uncounted with it enabled.
+    @override_settings(LOAD_REPLAY_HEADERS=True, CACHALOT_ENABLED=False)
+    def test_headers(self):
+        def get_response(request):
+            list(ASRSnippet.objects.all())
+            list(ASRSnippet.objects.all())
+            request.bundle_outcome = 'cached'
+            return HttpResponse()
+
+        response = LoadReplayMiddleware(get_response)(RequestFactory().get('/'))
+        self.assertEqual(response['X-DB-Queries'], '2')
+        self.assertEqual(response['X-Bundle-Outcome'], 'cached')
+
+    @override_settings(LOAD_REPLAY_HEADERS=True)
+    def test_not_a_bundle(self):
+        response = LoadReplayMiddleware(lambda request: HttpResponse())(RequestFactory().get('/'))
+        self.assertEqual(response['X-DB-Queries'], '0')
+        self.assertFalse(response.has_header('X-Bundle-Outcome'))
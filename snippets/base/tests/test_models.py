@@ -3,15 +3,17 @@ from django.test.utils import override_settings
 from django.urls import reverse
 
 from jinja2 import Markup
-from unittest.mock import MagicMock, Mock, patch
+from unittest.mock import Mock, patch
 from pyquery import PyQuery as pq
 
 from snippets.base.models import (STATUS_CHOICES,
                                   Client,
+                                  ASRSnippet,
                                   Icon,
                                   SimpleTemplate,
                                   UploadedFile,
-                                  _generate_filename)
+                                  _generate_filename,
+                                  load_subtemplates)
 from snippets.base.util import fluent_link_extractor
 from snippets.base.tests import (ASRSnippetFactory,
                                  ClientMatchRuleFactory,
@@ -305,25 +307,16 @@ class UploadedFileTests(TestCase):
 
     @override_settings(CDN_URL='http://example.com')
     def test_url_with_cdn_url(self):
-        test_file = UploadedFile()
-        test_file.file = Mock()
-        test_file.file.url = 'foo'
-        self.assertEqual(test_file.url, 'http://example.com/foo')
+        test_file = UploadedFile(file='files/foo.png')
+        self.assertEqual(test_file.url, 'http://example.com/media/files/foo.png')
 
-    @override_settings(CDN_URL='http://example.com/error/')
+    @override_settings(CDN_URL='', SITE_URL='http://example.com/foo/')
     def test_url_without_cdn_url(self):
-        test_file = UploadedFileFactory.build()
-        test_file.file = Mock()
-        test_file.file.url = 'bar'
-        with patch('snippets.base.models.settings', wraps=settings) as settings_mock:
-            delattr(settings_mock, 'CDN_URL')
-            settings_mock.SITE_URL = 'http://example.com/foo/'
-            self.assertEqual(test_file.url, 'http://example.com/foo/bar')
+        test_file = UploadedFileFactory.build(file='files/bar.png')
+        self.assertEqual(test_file.url, 'http://example.com/media/files/bar.png')
 
     def test_snippets(self):
-        instance = UploadedFileFactory.build()
-        instance.file = MagicMock()
-        instance.file.url = '/media/foo.png'
+        instance = UploadedFileFactory.build(file='files/foo.png')
         snippets = SnippetFactory.create_batch(2, data='lalala {0} foobar'.format(instance.url))
         template = SnippetTemplateFactory.create(code='<foo>{0}</foo>'.format(instance.url))
         more_snippets = SnippetFactory.create_batch(3, template=template)
@@ -387,24 +380,38 @@ class TemplateTests(TestCase):
         subtemplate = snippet.template_relation.subtemplate.subtemplate
         self.assertTrue(type(subtemplate) is SimpleTemplate)
 
+    def test_subtemplate_without_template_type(self):
+        snippet = ASRSnippetFactory()
+        template = snippet.template_relation
+        self.assertEqual(template.template_type, 'simpletemplate')
+
+        template.template_type = ''
+        self.assertTrue(type(template.subtemplate) is SimpleTemplate)
+
+    def test_load_subtemplates(self):
+        ASRSnippetFactory.create_batch(3)
+        templates = [snippet.template_relation for snippet in
+                     ASRSnippet.objects.select_related('template_relation')]
+        with self.assertNumQueries(1):
+            load_subtemplates(templates)
+            subtemplates = [template.subtemplate for template in templates]
+        self.assertTrue(all(type(subtemplate) is SimpleTemplate for subtemplate in subtemplates))
+        self.assertEqual([subtemplate.pk for subtemplate in subtemplates],
+                         [template.pk for template in templates])
+
 
 class IconTests(TestCase):
 
     @override_settings(CDN_URL='http://example.com')
     def test_url_with_cdn_url(self):
-        test_file = Icon()
-        test_file.image = Mock()
-        test_file.image.url = 'foo'
-        self.assertEqual(test_file.url, 'http://example.com/foo')
+        # With its dimensions set the image file doesn't get read.
+        test_file = Icon(image='icons/foo.png', height=16, width=16)
+        self.assertEqual(test_file.url, 'http://example.com/media/icons/foo.png')
 
+    @override_settings(CDN_URL='', SITE_URL='http://second-example.com/')
     def test_url_without_cdn_url(self):
-        test_file = Icon()
-        test_file.image = Mock()
-        test_file.image.url = 'foo'
-        with patch('snippets.base.models.settings', wraps=settings) as settings_mock:
-            delattr(settings_mock, 'CDN_URL')
-            settings_mock.SITE_URL = 'http://second-example.com/'
-            self.assertEqual(test_file.url, 'http://second-example.com/foo')
+        test_file = Icon(image='icons/foo.png', height=16, width=16)
+        self.assertEqual(test_file.url, 'http://second-example.com/media/icons/foo.png')
 
 
 class ASRSnippetTests(TestCase):
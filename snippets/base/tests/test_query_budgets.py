@@ -0,0 +1,211 @@
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+
+from unittest.mock import patch
+
+from snippets.base import invalidation, manifest
+from snippets.base.models import ASRSnippet
+from snippets.base.targeting import asr_index
+from snippets.base.tests import (LOCMEM_CACHES, ASRSnippetFactory, CampaignFactory,
+                                 CategoryFactory, IconFactory, JSONSnippetFactory, SnippetFactory,
+                                 SnippetTemplateFactory, TargetFactory, TestCase, UserFactory)
+
+
+# Numbers of snippets each endpoint gets requested with.
+FIXTURE_SIZES = (10, 100, 1000)
+
+CLIENT_KWARGS = {
+    'startpage_version': 6,
+    'name': 'Firefox',
+    'version': '64.0',
+    'appbuildid': '20190110041606',
+    'build_target': 'default',
+    'locale': 'en-US',
+    'channel': 'release',
+    'os_version': 'Darwin 10.8.0',
+    'distribution': 'default',
+    'distribution_version': 'default',
+}
+
+
+class QueryBudgetMixin(object):
+    """
+    Mixin for TestCases serving a request with 10, 100 and 1,000 snippets
+    and asserting it takes no more queries than a budget every time.
+    TestCases using it define create_snippets(count).
+
+    django-cachalot is disabled, so every query counts like it does on a
+    cache miss in production. Budgets include the statements the database
+    backend adds, like the BEGIN of transactions on SQLite.
+    """
+    def setUp(self):
+        self.snippets = []
+        budget_settings = override_settings(CACHALOT_ENABLED=False, CACHES=LOCMEM_CACHES,
+                                            BUNDLE_QUEUE='')
+        budget_settings.enable()
+        self.addCleanup(budget_settings.disable)
+
+        patcher = patch('snippets.base.bundles.default_storage')
+        default_storage = patcher.start()
+        default_storage.url.return_value = '/media/bundles/bundle.json'
+        self.addCleanup(patcher.stop)
+
+    def clear_bundles(self):
+        """Forget all generated bundles and bundle resolutions."""
+        cache.clear()
+        manifest._keys.clear()
+
+    def assertQueryBudget(self, budget, request, prepare=None):
+        """
+        Assert that request() takes at most budget queries for each of the
+        FIXTURE_SIZES, creating the snippets to serve with create_snippets.
+
+        prepare gets called before each request, after creating the
+        snippets. The targeting index gets built before each request too.
+        """
+        counts = []
+        for size in FIXTURE_SIZES:
+            with invalidation.deferred():
+                self.create_snippets(size - len(self.snippets))
+            if prepare is not None:
+                prepare()
+            asr_index.ensure_current()
+
+            with CaptureQueriesContext(connection) as queries:
+                request()
+            counts.append(len(queries))
+
+        msg = 'Queries with {0} snippets: {1}'.format(FIXTURE_SIZES, counts)
+        for count in counts:
+            self.assertLessEqual(count, budget, msg)
+
+
+class ASRSnippetQueryBudgetTests(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.creator = UserFactory()
+        self.campaign = CampaignFactory(creator=self.creator)
+        self.category = CategoryFactory(creator=self.creator)
+        self.template = SnippetTemplateFactory(startpage=6)
+        self.target = TargetFactory(creator=self.creator, on_release=True)
+        self.icon = IconFactory(creator=self.creator)
+        self.addCleanup(self.icon.image.delete, save=False)
+
+    def create_snippets(self, count):
+        """Create count more snippets for the request to serve."""
+        self.snippets.extend(
+            ASRSnippetFactory(creator=self.creator, campaign=self.campaign,
+                              category=self.category, template=self.template,
+                              targets=[self.target], template_relation__icon=self.icon)
+            for i in range(count))
+
+    def clear_renderings(self):
+        """
+        Forget all generated bundles, stored renderings and cached fragments,
+        so that the request renders every snippet.
+        """
+        ASRSnippet.objects.update(rendered='', rendered_key='')
+        self.clear_bundles()
+
+    def fetch(self, status_code=302, **kwargs):
+        url = reverse('base.fetch_snippets', kwargs=dict(CLIENT_KWARGS, **kwargs))
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='br')
+        self.assertEqual(response.status_code, status_code)
+        return response
+
+    def test_fetch_snippets_uncached(self):
+        # Manifest lookup and record, which takes a transaction and a
+        # savepoint. Snippets come from the targeting index and their stored
+        # renderings.
+        self.assertQueryBudget(6, self.fetch, prepare=self.clear_bundles)
+
+    @override_settings(ASR_TARGETING_INDEX=False)
+    def test_fetch_snippets_uncached_without_index(self):
+        # Matching, versions, manifest lookup, snippets with their targets
+        # and manifest record.
+        self.assertQueryBudget(10, self.fetch, prepare=self.clear_bundles)
+
+    def test_fetch_snippets_unrendered(self):
+        # Like uncached, plus the subtemplates with their icons to render the
+        # snippets with.
+        self.assertQueryBudget(7, self.fetch, prepare=self.clear_renderings)
+
+    @override_settings(ASR_TARGETING_INDEX=False)
+    def test_fetch_snippets_unrendered_without_index(self):
+        self.assertQueryBudget(11, self.fetch, prepare=self.clear_renderings)
+
+    def test_fetch_snippets_cached(self):
+        # The bundle resolution of the client class is cached.
+        self.assertQueryBudget(0, self.fetch, prepare=self.fetch)
+
+    def test_fetch_snippets_empty(self):
+        self.assertQueryBudget(0, lambda: self.fetch(status_code=200, locale='xx'))
+
+    def test_preview_asr_snippet(self):
+        def preview():
+            url = reverse('asr-preview', kwargs={'uuid': self.snippets[0].uuid})
+            self.assertEqual(self.client.get(url).status_code, 200)
+
+        # Snippet, template, subtemplate, icon and campaign.
+        self.assertQueryBudget(5, preview)
+
+    def test_ical_feed(self):
+        def feed():
+            self.assertEqual(self.client.get('/feeds/snippets.ics').status_code, 200)
+
+        # Snippets with their targets and locales.
+        self.assertQueryBudget(3, feed)
+
+
+class JSONSnippetQueryBudgetTests(QueryBudgetMixin, TestCase):
+    def create_snippets(self, count):
+        """Create count more snippets for the request to serve."""
+        self.snippets.extend(JSONSnippetFactory(countries=['us']) for i in range(count))
+
+    def fetch(self):
+        url = reverse('base.fetch_json_snippets',
+                      kwargs=dict(CLIENT_KWARGS, startpage_version=4, name='Fennec'))
+        self.assertEqual(self.client.get(url).status_code, 302)
+
+    def test_fetch_json_snippets_uncached(self):
+        # Matching, versions, manifest lookup, snippets with their countries
+        # and manifest record.
+        self.assertQueryBudget(10, self.fetch, prepare=self.clear_bundles)
+
+    def test_fetch_json_snippets_cached(self):
+        # Matching and versions for the key.
+        self.assertQueryBudget(2, self.fetch, prepare=self.fetch)
+
+
+class SnippetQueryBudgetTests(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.template = SnippetTemplateFactory()
+
+    def create_snippets(self, count):
+        """Create count more snippets for the request to serve."""
+        self.snippets.extend(
+            SnippetFactory(template=self.template, on_release=True, on_startpage_4=True)
+            for i in range(count))
+
+    def fetch(self, startpage_version):
+        url = reverse('base.fetch_snippets',
+                      kwargs=dict(CLIENT_KWARGS, startpage_version=startpage_version))
+        self.assertEqual(self.client.get(url).status_code, 302)
+
+    def test_fetch_snippets_uncached_startpage_4(self):
+        # Matching, versions, manifest lookup, snippets with their countries
+        # and excluded search providers, and manifest record.
+        self.assertQueryBudget(11, lambda: self.fetch(4), prepare=self.clear_bundles)
+
+    def test_fetch_snippets_uncached_startpage_5(self):
+        self.assertQueryBudget(11, lambda: self.fetch(5), prepare=self.clear_bundles)
+
+    def test_fetch_snippets_cached_startpage_4(self):
+        # Matching and versions for the key.
+        self.assertQueryBudget(2, lambda: self.fetch(4), prepare=lambda: self.fetch(4))
+
+    def test_fetch_snippets_cached_startpage_5(self):
+        self.assertQueryBudget(2, lambda: self.fetch(5), prepare=lambda: self.fetch(5))
@@ -0,0 +1,63 @@
+import threading
+import time
+
+from django.core.cache import cache
+from django.test.utils import override_settings
+
+from unittest.mock import DEFAULT, patch
+
+from snippets.base.bundles import ASRSnippetBundle
+from snippets.base.models import Client
+from snippets.base.queues import LocalQueue, process
+from snippets.base.tests import LOCMEM_CACHES, ASRSnippetFactory, TestCase
+
+
+class ProcessTests(TestCase):
+    def setUp(self):
+        ASRSnippetFactory.create()
+        self.client = Client(6, 'Firefox', '64.0', 'default', 'default', 'en-US',
+                             'release', 'default', 'default', 'default')
+
+    @override_settings(CACHES=LOCMEM_CACHES)
+    def test_base(self):
+        key = ASRSnippetBundle(self.client).key
+        cache.set('bundle_queued_' + key, time.time() - 2)
+
+        with patch('snippets.base.bundles.default_storage') as default_storage:
+            default_storage.exists.return_value = False
+            with patch('snippets.base.queues.statsd') as statsd:
+                process({'key': key, 'client': list(self.client)})
+
+        self.assertTrue(default_storage.save.called)
+        self.assertTrue(ASRSnippetBundle(self.client).cached)
+        self.assertIsNone(cache.get('bundle_queued_' + key))
+        self.assertEqual(statsd.timing.call_args[0][0], 'bundle.generate.lag')
+        self.assertTrue(statsd.timing.call_args[0][1] >= 2000)
+
+    @override_settings(CACHES=LOCMEM_CACHES)
+    def test_already_generated(self):
+        bundle = ASRSnippetBundle(self.client)
+        cache.set(bundle.cache_key, True)
+
+        with patch('snippets.base.bundles.ASRSnippetBundle.ensure_generated') as ensure_generated:
+            process({'key': bundle.key, 'client': list(self.client)})
+        self.assertFalse(ensure_generated.called)
+
+    def test_recompress(self):
+        with patch.multiple('snippets.base.bundles', recompress=DEFAULT,
+                            get_bundle=DEFAULT) as mocks:
+            process({'key': 'foo', 'filename': 'bundle_foo.json', 'recompress': True})
+        mocks['recompress'].assert_called_with('foo', 'bundle_foo.json')
+        self.assertFalse(mocks['get_bundle'].called)
+
+
+class LocalQueueTests(TestCase):
+    def test_base(self):
+        processed = threading.Event()
+        local_queue = LocalQueue()
+        with patch('snippets.base.queues.process') as process_mock:
+            process_mock.side_effect = lambda task: processed.set()
+            local_queue.put({'key': 'foo', 'client': []})
+            self.assertTrue(processed.wait(5))
+        process_mock.assert_called_with({'key': 'foo', 'client': []})
+        self.assertEqual(local_queue.depth(), 0)
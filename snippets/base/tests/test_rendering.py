@@ -0,0 +1,123 @@
+import json
+from datetime import timedelta
+
+from django.test.utils import override_settings
+
+from unittest.mock import patch
+
+from snippets.base.models import ASRSnippet, SnippetTemplateVariable, Template
+from snippets.base.rendering import (get_render_key, get_rendered_fragments, get_rendered_json,
+                                     get_stored_rendering, iter_rendered_fragments,
+                                     store_rendered)
+from snippets.base.tests import (LOCMEM_CACHES, ASRSnippetFactory, SnippetFactory,
+                                 SnippetTemplateVariableFactory, TargetFactory, TestCase)
+
+
+class GetRenderedFragmentsTests(TestCase):
+    def test_base(self):
+        snippet_1, snippet_2 = ASRSnippetFactory.create_batch(2)
+        fragments = get_rendered_fragments([snippet_1, snippet_2])
+        self.assertEqual([json.loads(fragment) for fragment in fragments],
+                         [snippet_1.render(), snippet_2.render()])
+
+    @override_settings(CACHES=LOCMEM_CACHES)
+    def test_cached(self):
+        snippet = ASRSnippetFactory.create()
+        fragments = get_rendered_fragments([snippet])
+
+        with patch.object(ASRSnippet, 'render') as render:
+            self.assertEqual(get_rendered_fragments([snippet]), fragments)
+        self.assertFalse(render.called)
+
+    def test_modified(self):
+        snippet = ASRSnippetFactory.create()
+        get_rendered_fragments([snippet])
+
+        snippet.modified += timedelta(seconds=1)
+        with patch.object(ASRSnippet, 'render') as render:
+            render.return_value = {'id': 'new'}
+            self.assertEqual(get_rendered_fragments([snippet]), ['{"id": "new"}'])
+        self.assertTrue(render.called)
+
+    def test_templates_loaded_once(self):
+        ASRSnippetFactory.create_batch(3)
+        ASRSnippet.objects.update(rendered='')
+        snippets = list(ASRSnippet.objects.select_related('template_relation'))
+        with patch('snippets.base.rendering.load_templates') as load_templates:
+            with patch.object(ASRSnippet, 'render', return_value={}):
+                list(iter_rendered_fragments(snippets, batch_size=2))
+        load_templates.assert_called_once_with(snippets)
+
+    def test_stored(self):
+        snippet = ASRSnippetFactory.create()
+        snippet.refresh_from_db()
+        with patch.object(ASRSnippet, 'render') as render:
+            self.assertEqual(get_rendered_fragments([snippet]), [snippet.rendered])
+        self.assertFalse(render.called)
+
+
+class StoreRenderedTests(TestCase):
+    def test_asrsnippet(self):
+        snippet = ASRSnippetFactory.create()
+        snippet.refresh_from_db()
+        self.assertEqual(json.loads(snippet.rendered), snippet.render())
+        self.assertEqual(snippet.rendered_key, get_render_key(snippet))
+
+    def test_snippet(self):
+        snippet = SnippetFactory.create(countries=['us'])
+        snippet.refresh_from_db()
+        self.assertEqual(json.loads(snippet.rendered), json.loads(json.dumps(snippet.to_dict())))
+        self.assertEqual(snippet.rendered_key, get_render_key(snippet))
+        self.assertEqual(get_rendered_json(snippet), snippet.rendered)
+
+    def test_related_changes(self):
+        snippet = ASRSnippetFactory.create()
+        target = TargetFactory.create(jexl_expr='foo')
+        snippet.targets.add(target)
+        snippet.refresh_from_db()
+        self.assertIn('foo', json.loads(snippet.rendered)['targeting'])
+
+        snippet.campaign.slug = 'new-campaign'
+        snippet.campaign.save()
+        snippet.refresh_from_db()
+        self.assertEqual(json.loads(snippet.rendered)['campaign'], 'new-campaign')
+        self.assertEqual(snippet.rendered_key, get_render_key(snippet))
+
+    def test_template_change(self):
+        snippet = SnippetFactory.create()
+        snippet.template.code = '<p>new code</p>'
+        snippet.template.save()
+        snippet.refresh_from_db()
+        self.assertIn('new code', json.loads(snippet.rendered)['code'])
+        self.assertEqual(snippet.rendered_key, get_render_key(snippet))
+
+    def test_asrsnippet_template_change(self):
+        """ASRSnippets without a Template render with their SnippetTemplate."""
+        snippet = ASRSnippetFactory.create(data='{"text": "foo"}')
+        Template.objects.all().delete()
+        snippet = ASRSnippet.objects.get(pk=snippet.pk)
+        old_key = get_render_key(snippet)
+
+        SnippetTemplateVariableFactory(template=snippet.template, name='text',
+                                       type=SnippetTemplateVariable.BODY)
+        snippet.template.save()
+        snippet = ASRSnippet.objects.get(pk=snippet.pk)
+        self.assertNotEqual(snippet.rendered_key, old_key)
+        self.assertEqual(snippet.rendered_key, get_render_key(snippet))
+        self.assertEqual(json.loads(snippet.rendered), snippet.render())
+
+    def test_stale(self):
+        snippet = ASRSnippetFactory.create()
+        snippet.refresh_from_db()
+        snippet.modified += timedelta(seconds=1)
+        self.assertIsNone(get_stored_rendering(snippet))
+
+    def test_render_failure(self):
+        snippet = ASRSnippetFactory.create()
+        ASRSnippet.objects.update(rendered='')
+        with patch.object(ASRSnippet, 'render', side_effect=ValueError):
+            with patch('snippets.base.rendering.logger') as logger:
+                store_rendered(ASRSnippet, [snippet.pk])
+        self.assertTrue(logger.exception.called)
+        snippet.refresh_from_db()
+        self.assertEqual(snippet.rendered, '')
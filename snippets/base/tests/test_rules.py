@@ -0,0 +1,79 @@
+from snippets.base.models import Client
+from snippets.base.rules import CompiledRuleSet
+from snippets.base.tests import ClientMatchRuleFactory, TestCase
+
+
+class CompiledRuleSetTests(TestCase):
+    def _client(self, **kwargs):
+        client_kwargs = dict((key, '') for key in Client._fields)
+        client_kwargs.update(kwargs)
+        return Client(**client_kwargs)
+
+    def _assert_evaluates(self, rules, client):
+        passed, failed = CompiledRuleSet(rules).evaluate(client)
+        self.assertEqual(passed, set(rule.id for rule in rules if rule.matches(client)))
+        self.assertEqual(failed, set(rule.id for rule in rules if not rule.matches(client)))
+        return passed, failed
+
+    def test_string_match(self):
+        pass_rule = ClientMatchRuleFactory(channel='aurora')
+        fail_rule = ClientMatchRuleFactory(channel='nightly')
+
+        passed, failed = self._assert_evaluates([pass_rule, fail_rule],
+                                                self._client(channel='aurora'))
+        self.assertEqual(passed, set([pass_rule.id]))
+        self.assertEqual(failed, set([fail_rule.id]))
+
+    def test_regex_match(self):
+        pass_rule = ClientMatchRuleFactory(version=r'/[\d\.]+/')
+        pass_rule_2 = ClientMatchRuleFactory(version=r'/^15/')
+        fail_rule = ClientMatchRuleFactory(version=r'/\D+/')
+
+        passed, failed = self._assert_evaluates([pass_rule, pass_rule_2, fail_rule],
+                                                self._client(version='15.2.4'))
+        self.assertEqual(passed, set([pass_rule.id, pass_rule_2.id]))
+        self.assertEqual(failed, set([fail_rule.id]))
+
+    def test_merged_regex_no_match(self):
+        rule_1 = ClientMatchRuleFactory(version=r'/^16/')
+        rule_2 = ClientMatchRuleFactory(version=r'/^(17|18)/', is_exclusion=True)
+
+        passed, failed = self._assert_evaluates([rule_1, rule_2], self._client(version='15.0'))
+        self.assertEqual(passed, set([rule_2.id]))
+
+    def test_unmergeable_regex(self):
+        rule_1 = ClientMatchRuleFactory(version=r'/^(\d)\1/')
+        rule_2 = ClientMatchRuleFactory(version=r'/^(1)/')
+
+        rule_set = CompiledRuleSet([rule_1, rule_2])
+        self.assertIsNone(rule_set.merged_patterns['version'])
+        self._assert_evaluates([rule_1, rule_2], self._client(version='11.0'))
+        self._assert_evaluates([rule_1, rule_2], self._client(version='12.0'))
+
+    def test_multi_match(self):
+        pass_rule = ClientMatchRuleFactory(version='1.0', locale='en-US')
+        fail_rule = ClientMatchRuleFactory(version='1.0', locale='fr')
+        fail_rule_2 = ClientMatchRuleFactory(version='/^2/', locale='en-US')
+
+        passed, failed = self._assert_evaluates([pass_rule, fail_rule, fail_rule_2],
+                                                self._client(version='1.0', locale='en-US'))
+        self.assertEqual(passed, set([pass_rule.id]))
+
+    def test_empty_match(self):
+        rule = ClientMatchRuleFactory()
+
+        passed, failed = self._assert_evaluates([rule], self._client(version='1.0'))
+        self.assertEqual(passed, set([rule.id]))
+
+    def test_exclusion_rule_match(self):
+        fail_rule = ClientMatchRuleFactory(channel='aurora', is_exclusion=True)
+        pass_rule = ClientMatchRuleFactory(channel='nightly', is_exclusion=True)
+        regex_fail_rule = ClientMatchRuleFactory(channel='/^aur/', is_exclusion=True)
+
+        passed, failed = self._assert_evaluates([fail_rule, pass_rule, regex_fail_rule],
+                                                self._client(channel='aurora'))
+        self.assertEqual(passed, set([pass_rule.id]))
+        self.assertEqual(failed, set([fail_rule.id, regex_fail_rule.id]))
+
+    def test_no_rules(self):
+        self.assertEqual(CompiledRuleSet([]).evaluate(self._client()), (set(), set()))
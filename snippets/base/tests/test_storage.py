@@ -0,0 +1,73 @@
+from django.core.files.base import ContentFile
+from django.test.utils import override_settings
+
+from unittest.mock import DEFAULT, Mock, patch
+
+from snippets.base.storage import S3Storage, public_url
+from snippets.base.tests import TestCase
+
+
+def signing_storage():
+    storage = Mock()
+    storage.url.side_effect = (
+        lambda name: 'https://bucket.s3.amazonaws.com/media/{0}?Signature=abc'.format(name))
+    return storage
+
+
+@override_settings(CDN_URL='', SITE_URL='http://example.com')
+class PublicURLTests(TestCase):
+    def test_base(self):
+        storage = signing_storage()
+        self.assertEqual(public_url(storage, 'bundles/bundle_foo.html'),
+                         'https://bucket.s3.amazonaws.com/media/bundles/bundle_foo.html')
+        self.assertEqual(public_url(storage, 'icons/bar baz.png'),
+                         'https://bucket.s3.amazonaws.com/media/icons/bar%20baz.png')
+        # Only the URL prefix gets built by the storage, once.
+        self.assertEqual(storage.url.call_count, 1)
+
+    @override_settings(CDN_URL='https://cdn.example.com')
+    def test_cdn_url(self):
+        self.assertEqual(public_url(signing_storage(), 'bundles/bundle_foo.html'),
+                         'https://cdn.example.com/media/bundles/bundle_foo.html')
+
+    def test_site_url(self):
+        storage = Mock()
+        storage.url.side_effect = lambda name: '/media/' + name
+        self.assertEqual(public_url(storage, 'bundles/bundle_foo.html'),
+                         'http://example.com/media/bundles/bundle_foo.html')
+
+    def test_settings_changed(self):
+        storage = signing_storage()
+        public_url(storage, 'bundles/bundle_foo.html')
+        with override_settings(CDN_URL='https://cdn.example.com'):
+            self.assertEqual(public_url(storage, 'bundles/bundle_foo.html'),
+                             'https://cdn.example.com/media/bundles/bundle_foo.html')
+        self.assertEqual(public_url(storage, 'bundles/bundle_foo.html'),
+                         'https://bucket.s3.amazonaws.com/media/bundles/bundle_foo.html')
+
+    def test_unknown_url_layout(self):
+        """Storages not appending names to a prefix get asked for each URL."""
+        storage = Mock()
+        storage.url.side_effect = lambda name: '/media/{0}/index.html?v=1'.format(name)
+        self.assertEqual(public_url(storage, 'foo'), 'http://example.com/media/foo/index.html')
+        self.assertEqual(public_url(storage, 'bar'), 'http://example.com/media/bar/index.html')
+        self.assertEqual(storage.url.call_count, 3)
+
+
+class S3StorageTests(TestCase):
+    def _save(self, content):
+        storage = S3Storage(access_key='foo', secret_key='bar', bucket='snippets')
+        storage.cache_control_headers = {'bundles/': 'max-age=2592000'}
+        with patch.multiple(S3Storage, bucket=DEFAULT, _save_content=DEFAULT) as mocks:
+            storage._save('bundles/bundle_foo.json.br', content)
+        return mocks['_save_content'].call_args[1]['headers']
+
+    def test_cache_control(self):
+        headers = self._save(ContentFile(b'foo'))
+        self.assertEqual(headers['Cache-Control'], 'max-age=2592000')
+
+    def test_content_cache_control(self):
+        content = ContentFile(b'foo')
+        content.cache_control = 'max-age=600'
+        headers = self._save(content)
+        self.assertEqual(headers['Cache-Control'], 'max-age=600')
@@ -0,0 +1,213 @@
+import threading
+import time
+from datetime import datetime, timedelta
+
+from django.test.utils import override_settings
+
+from unittest.mock import patch
+
+from snippets.base.models import STATUS_CHOICES, Client
+from snippets.base.targeting import ASRSnippetIndex, get_index_version, invalidate_index
+from snippets.base.tests import (LOCMEM_CACHES, ASRSnippetFactory, ClientMatchRuleFactory,
+                                 TargetFactory, TestCase)
+
+
+class ASRSnippetIndexTests(TestCase):
+    def setUp(self):
+        invalidate_index()
+        self.index = ASRSnippetIndex()
+
+    def _build_client(self, **client_attrs):
+        params = {'startpage_version': 6,
+                  'name': 'Firefox',
+                  'version': '64.0',
+                  'appbuildid': '20180510041606',
+                  'build_target': 'Darwin_Universal-gcc3',
+                  'locale': 'en-US',
+                  'channel': 'release',
+                  'os_version': 'Darwin 10.8.0',
+                  'distribution': 'default',
+                  'distribution_version': 'default_version'}
+        params.update(client_attrs)
+        return Client(**params)
+
+    def _assert_consistent(self, client):
+        self.assertEqual(self.index.verify(client), (set(), set()))
+
+    def test_match_client_base(self):
+        client_match_rule_pass_1 = ClientMatchRuleFactory(channel='nightly')
+        client_match_rule_pass_2 = ClientMatchRuleFactory(channel='/(beta|nightly)/')
+        client_match_rule_fail = ClientMatchRuleFactory(channel='release')
+
+        # Matching snippets.
+        snippet_1 = ASRSnippetFactory.create(
+            targets=[
+                TargetFactory(on_release=False, on_nightly=True,
+                              client_match_rules=[client_match_rule_pass_1])
+            ])
+        snippet_2 = ASRSnippetFactory.create(
+            targets=[
+                TargetFactory(on_release=False, on_beta=True, on_nightly=True,
+                              client_match_rules=[client_match_rule_pass_2])
+            ])
+        snippet_3 = ASRSnippetFactory.create(
+            targets=[TargetFactory(on_release=False, on_nightly=True)])
+
+        # Not matching snippets.
+        ASRSnippetFactory.create(targets=[TargetFactory(on_release=False, on_beta=True)])
+        ASRSnippetFactory.create(
+            targets=[
+                TargetFactory(on_nightly=True, client_match_rules=[client_match_rule_fail])
+            ])
+        ASRSnippetFactory.create(
+            targets=[
+                TargetFactory(on_nightly=True,
+                              client_match_rules=[client_match_rule_fail, client_match_rule_pass_2])
+            ])
+        ASRSnippetFactory.create(targets=[TargetFactory(on_release=False, on_nightly=True)],
+                                 status=STATUS_CHOICES['Approved'])
+
+        client = self._build_client(channel='nightly')
+        self.assertEqual(set(self.index.get_snippets(client)),
+                         set([snippet_1, snippet_2, snippet_3]))
+        self._assert_consistent(client)
+
+    @patch('snippets.base.managers.LANGUAGE_VALUES', ['es-mx', 'es', 'fr'])
+    def test_match_client_locales(self):
+        snippet_1 = ASRSnippetFactory.create(locales=['es'])
+        snippet_2 = ASRSnippetFactory.create(locales=['es-mx', 'es'])
+        snippet_3 = ASRSnippetFactory.create(locales=[])
+        ASRSnippetFactory.create(locales=['fr'])
+
+        client = self._build_client(locale='es-MX')
+        self.assertEqual(set(self.index.get_snippets(client)), set([snippet_1, snippet_2]))
+
+        client = self._build_client(locale='foo')
+        self.assertEqual(set(self.index.get_snippets(client)), set([snippet_3]))
+
+    def test_filter_by_available(self):
+        now = datetime.utcnow()
+        snippet = ASRSnippetFactory.create(publish_start=now - timedelta(days=1))
+        ASRSnippetFactory.create(publish_start=now + timedelta(days=1))
+        ASRSnippetFactory.create(publish_end=now - timedelta(days=1))
+
+        client = self._build_client()
+        self.assertEqual(self.index.get_snippets(client), [snippet])
+        self._assert_consistent(client)
+
+    def test_ordering(self):
+        snippet_1 = ASRSnippetFactory.create()
+        snippet_2 = ASRSnippetFactory.create()
+        self.assertEqual(self.index.get_snippets(self._build_client()), [snippet_2, snippet_1])
+
+    def test_rebuild_on_change(self):
+        client = self._build_client()
+        self.assertEqual(self.index.get_snippets(client), [])
+        version = self.index.version
+
+        snippet = ASRSnippetFactory.create()
+        self.assertNotEqual(get_index_version(), version)
+        self.assertEqual(self.index.get_snippets(client), [snippet])
+
+        snippet.targets.clear()
+        self.assertEqual(self.index.get_snippets(client), [])
+
+    def test_no_queries_when_current(self):
+        ASRSnippetFactory.create()
+        client = self._build_client()
+        self.index.get_snippets(client)
+
+        with self.assertNumQueries(0):
+            self.index.get_snippets(client)
+
+    def test_client_class(self):
+        rule = ClientMatchRuleFactory(version='/^64/')
+        ASRSnippetFactory.create(targets=[TargetFactory(client_match_rules=[rule])])
+
+        client_1 = self._build_client(appbuildid='20180510041606', os_version='Darwin 10.8.0')
+        client_2 = self._build_client(appbuildid='20180610041606', os_version='Windows_NT 10')
+        self.assertEqual(self.index.client_class(client_1), self.index.client_class(client_2))
+
+        client_class = self.index.client_class(client_1)
+        self.assertEqual(client_class.channel, 'release')
+        self.assertEqual(client_class.locales, ('en-us',))
+        self.assertEqual(client_class.passed_rules, (rule.id,))
+
+        # Different ClientMatchRule outcome.
+        client_3 = self._build_client(version='65.0')
+        self.assertNotEqual(self.index.client_class(client_1), self.index.client_class(client_3))
+
+        # Channels resolve to the same channel.
+        client_4 = self._build_client(channel='release-cck-mozilla14')
+        self.assertEqual(self.index.client_class(client_1), self.index.client_class(client_4))
+
+    @override_settings(CACHES=LOCMEM_CACHES)
+    def test_resolution(self):
+        ASRSnippetFactory.create()
+        client_class = self.index.client_class(self._build_client())
+        self.assertIsNone(self.index.get_resolution(client_class))
+
+        self.index.set_resolution(client_class, 'foo', False)
+        self.assertEqual(self.index.get_resolution(client_class),
+                         {'key': 'foo', 'empty': False, 'expires': None})
+
+        # Resolutions get invalidated when the index changes.
+        ASRSnippetFactory.create()
+        client_class = self.index.client_class(self._build_client())
+        self.assertIsNone(self.index.get_resolution(client_class))
+
+    def test_resolution_expires(self):
+        ASRSnippetFactory.create()
+        client_class = self.index.client_class(self._build_client())
+
+        expires = datetime.utcnow() + timedelta(seconds=30)
+        with patch('snippets.base.targeting.cache') as cache_mock:
+            with self.settings(BUNDLE_CLIENT_CLASS_TIMEOUT=60):
+                self.index.set_resolution(client_class, 'foo', False, expires)
+        self.assertTrue(cache_mock.set.call_args[0][2] <= 30)
+
+        # Expired resolutions don't get cached.
+        self.index.set_resolution(client_class, 'foo', False, datetime.utcnow())
+        self.assertIsNone(self.index.get_resolution(client_class))
+
+    def test_rebuild_on_timeout(self):
+        self.index.build()
+        with patch.object(self.index, 'build') as build_mock:
+            with self.settings(ASR_TARGETING_INDEX_TIMEOUT=0):
+                self.index.state = self.index.state._replace(
+                    built_at=datetime.utcnow() - timedelta(seconds=1))
+                self.index.ensure_current()
+        self.assertTrue(build_mock.called)
+
+    @override_settings(CACHES=LOCMEM_CACHES)
+    def test_fixed_version(self):
+        """Indexes with a fixed version don't follow the version in the cache."""
+        index = ASRSnippetIndex(fixed_version='foo')
+        index.build()
+        self.assertEqual(index.version, 'foo')
+        invalidate_index()
+        self.assertFalse(index.stale)
+
+        # Resolutions don't mix with the ones of the shared index.
+        self.index.build()
+        client_class = index.client_class(self._build_client())
+        index.set_resolution(client_class, 'foo', False)
+        self.assertIsNone(self.index.get_resolution(client_class))
+
+    @override_settings(CACHES=LOCMEM_CACHES)
+    def test_concurrent_rebuild(self):
+        """Threads finding the index stale at once wait for a single rebuild."""
+        state = self.index._build_state()
+
+        def _build_state():
+            time.sleep(0.1)
+            return state
+
+        with patch.object(self.index, '_build_state', side_effect=_build_state) as build_state:
+            threads = [threading.Thread(target=self.index.ensure_current) for i in range(3)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(build_state.call_count, 1)
+        self.assertIs(self.index.state, state)
@@ -1,7 +1,10 @@
+from datetime import datetime, timedelta
+
 from snippets.base.models import Snippet
 from snippets.base.tests import SnippetFactory, TestCase
-from snippets.base.util import (deep_search_and_replace, first,
-                                fluent_link_extractor, get_object_or_none)
+from snippets.base.util import (deep_search_and_replace, filter_by_available, first,
+                                fluent_link_extractor, get_object_or_none, negotiate_encoding,
+                                next_transition, seconds_until)
 
 
 class TestGetObjectOrNone(TestCase):
@@ -127,3 +130,63 @@ class DeepSearchAndReplaceTests(TestCase):
             }
         }
         self.assertEqual(generated_data, expected_data)
+
+
+class NextTransitionTests(TestCase):
+    def test_filter_by_available(self):
+        now = datetime(2019, 1, 10, 12, 0)
+        available = [
+            Snippet(publish_start=datetime(2019, 1, 1), publish_end=datetime(2019, 1, 11)),
+            Snippet(),
+        ]
+        snippets = available + [
+            Snippet(publish_start=datetime(2019, 1, 12)),
+            Snippet(publish_end=datetime(2019, 1, 5)),
+        ]
+        self.assertEqual(filter_by_available(snippets, now), available)
+
+    def test_base(self):
+        now = datetime(2019, 1, 10, 12, 0)
+        snippets = [
+            Snippet(publish_start=datetime(2019, 1, 12)),
+            Snippet(publish_start=datetime(2019, 1, 1), publish_end=datetime(2019, 1, 11)),
+            Snippet(publish_end=datetime(2019, 1, 5)),
+            Snippet(),
+        ]
+        self.assertEqual(next_transition(snippets, now), datetime(2019, 1, 11))
+
+    def test_no_transition(self):
+        now = datetime(2019, 1, 10, 12, 0)
+        snippets = [
+            Snippet(publish_start=datetime(2019, 1, 1)),
+            Snippet(publish_end=datetime(2019, 1, 5)),
+            Snippet(),
+        ]
+        self.assertIsNone(next_transition(snippets, now))
+        self.assertIsNone(next_transition([], now))
+
+    def test_seconds_until(self):
+        now = datetime(2019, 1, 10, 12, 0)
+        self.assertEqual(seconds_until(now + timedelta(seconds=90.5), now), 90)
+        self.assertEqual(seconds_until(now - timedelta(seconds=90), now), 0)
+
+
+class NegotiateEncodingTests(TestCase):
+    encodings = ['br', 'gzip', 'identity']
+
+    def test_preference(self):
+        self.assertEqual(negotiate_encoding('gzip, deflate, br', self.encodings), 'br')
+        self.assertEqual(negotiate_encoding('gzip, deflate', self.encodings), 'gzip')
+        self.assertEqual(negotiate_encoding('br;q=0.5, gzip', self.encodings), 'gzip')
+        self.assertEqual(negotiate_encoding('GZIP;Q=0.8', self.encodings), 'gzip')
+
+    def test_identity(self):
+        self.assertEqual(negotiate_encoding('', self.encodings), 'identity')
+        self.assertEqual(negotiate_encoding('deflate', self.encodings), 'identity')
+        self.assertEqual(negotiate_encoding('br;q=0, gzip;q=0', self.encodings), 'identity')
+        self.assertEqual(negotiate_encoding('br', ['identity']), 'identity')
+
+    def test_wildcard(self):
+        self.assertEqual(negotiate_encoding('*', self.encodings), 'br')
+        self.assertEqual(negotiate_encoding('*;q=0.5, gzip', self.encodings), 'gzip')
+        self.assertEqual(negotiate_encoding('*;q=0, identity', self.encodings), 'identity')
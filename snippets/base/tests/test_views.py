@@ -1,5 +1,6 @@
 import json
 from collections import OrderedDict
+from datetime import datetime, timedelta
 
 from django.contrib.auth.models import User
 from django.test.client import RequestFactory
@@ -10,6 +11,7 @@ from unittest.mock import patch
 
 import snippets.base.models
 from snippets.base import views
+from snippets.base.locks import NoGenerationSlot
 from snippets.base.models import Client
 from snippets.base.tests import (ASRSnippetFactory, JSONSnippetFactory, SnippetFactory,
                                  SnippetTemplateFactory, TestCase)
@@ -18,6 +20,7 @@ snippets.base.models.CHANNELS = ('release', 'beta', 'aurora', 'nightly')
 
 
 class JSONSnippetsTests(TestCase):
+    @override_settings(BUNDLE_QUEUE='')
     def test_base(self):
         # Matching snippets.
         snippet_1 = JSONSnippetFactory.create(on_nightly=True, weight=66)
@@ -31,8 +34,14 @@ class JSONSnippetsTests(TestCase):
         params = ('4', 'Fennec', '23.0a1', '20130510041606',
                   'Darwin_Universal-gcc3', 'en-US', 'nightly',
                   'Darwin%2010.8.0', 'default', 'default_version')
-        response = self.client.get('/json/{0}/'.format('/'.join(params)))
-        data = json.loads(response.content)
+        with patch('snippets.base.bundles.default_storage') as default_storage:
+            default_storage.url.return_value = '/media/bundles/bundle.json'
+            response = self.client.get('/json/{0}/'.format('/'.join(params)))
+        self.assertEqual(response.status_code, 302)
+
+        # Check content of the saved bundle.
+        content_file = default_storage.save.call_args[0][1]
+        data = json.loads(content_file.read().decode('utf-8'))
         self.assertEqual(len(data), 1)
         self.assertEqual(data[0]['id'], snippet_1.id)
         self.assertEqual(data[0]['weight'], 66)
@@ -72,7 +81,7 @@ class JSONSnippetsTests(TestCase):
         response = self.client.get('/json/{0}/'.format('/'.join(params)))
         cache_headers = [header.strip() for header in response['Cache-control'].split(',')]
         self.assertEqual(set(cache_headers), set(['public', 'max-age=75']))
-        self.assertTrue('Vary' not in response)
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
 
     def test_response(self):
         params = ('1', 'Fennec', '23.0a1', '20130510041606',
@@ -80,6 +89,7 @@ class JSONSnippetsTests(TestCase):
                   'Darwin%2010.8.0', 'default', 'default_version')
         response = self.client.get('/json/{0}/'.format('/'.join(params)))
         self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(response.content, b'[]')
 
 
 class PreviewSnippetTests(TestCase):
@@ -216,7 +226,7 @@ class FetchSnippetsTests(TestCase):
         self.assertEqual(SnippetBundle.call_args[0][0].locale, 'en-US')
 
         # Do not generate bundle when not expired.
-        self.assertTrue(not SnippetBundle.return_value.generate.called)
+        self.assertTrue(not SnippetBundle.return_value.ensure_generated.called)
 
     def test_normal_asr(self):
         with patch.object(views, 'ASRSnippetBundle') as ASRSnippetBundle:
@@ -233,7 +243,7 @@ class FetchSnippetsTests(TestCase):
         self.assertEqual(ASRSnippetBundle.call_args[0][0].locale, 'en-US')
 
         # Do not generate bundle when not expired.
-        self.assertTrue(not ASRSnippetBundle.return_value.generate.called)
+        self.assertTrue(not ASRSnippetBundle.return_value.ensure_generated.called)
 
     def test_regenerate(self):
         """If the bundle has expired, re-generate it."""
@@ -242,13 +252,33 @@ class FetchSnippetsTests(TestCase):
             bundle.url = '/foo/bar'
             bundle.empty = False
             bundle.cached = False
+            bundle.stale_url = None
             response = views.fetch_snippets(self.request, **self.client_kwargs)
 
         self.assertEqual(response.status_code, 302)
         self.assertEqual(response['Location'], '/foo/bar')
 
         # Since the bundle was expired, ensure it was re-generated.
-        self.assertTrue(SnippetBundle.return_value.generate.called)
+        SnippetBundle.return_value.ensure_generated.assert_called_with(inline=True)
+
+    @override_settings(BUNDLE_QUEUE='local')
+    def test_busy(self):
+        """
+        If no generation slot frees up in time, queue the bundle and ask the
+        client to retry.
+        """
+        with patch.object(views, 'SnippetBundle') as SnippetBundle:
+            bundle = SnippetBundle.return_value
+            bundle.empty = False
+            bundle.cached = False
+            bundle.stale_url = None
+            bundle.ensure_generated.side_effect = NoGenerationSlot
+            response = views.fetch_snippets(self.request, **self.client_kwargs)
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], str(views.BUSY_RETRY_AFTER))
+        self.assertIn('max-age=0', response['Cache-Control'])
+        self.assertTrue(bundle.enqueue.called)
 
     def test_empty(self):
         """If the bundle is empty return 200 and empty string."""
@@ -281,6 +311,103 @@ class FetchSnippetsTests(TestCase):
         self.client.get('/{0}/'.format('/'.join(['{}'.format(x) for x in params])))
         ClientMock.assert_called_with(**self.client_kwargs)
 
+    def test_stale(self):
+        """
+        If the bundle isn't generated yet, redirect to the last good bundle
+        and queue the bundle for generation.
+        """
+        with patch.object(views, 'SnippetBundle') as SnippetBundle:
+            bundle = SnippetBundle.return_value
+            bundle.url = '/foo/bar'
+            bundle.stale_url = '/foo/old'
+            bundle.empty = False
+            bundle.cached = False
+            response = views.fetch_snippets(self.request, **self.client_kwargs)
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response['Location'], '/foo/old')
+        self.assertIn('max-age=0', response['Cache-Control'])
+        self.assertTrue(bundle.enqueue.called)
+        self.assertFalse(bundle.ensure_generated.called)
+
+    @override_settings(BUNDLE_ENCODINGS=['br', 'gzip'])
+    def test_encoding(self):
+        """
+        Redirect to the bundle variant in the encoding the client prefers
+        and vary the response on Accept-Encoding.
+        """
+        request = self.factory.get('/', HTTP_ACCEPT_ENCODING='gzip, deflate')
+        with patch.object(views, 'SnippetBundle') as SnippetBundle:
+            bundle = SnippetBundle.return_value
+            bundle.url = '/foo/bar.gz'
+            bundle.empty = False
+            bundle.cached = True
+            response = views.fetch_snippets(request, **self.client_kwargs)
+
+        self.assertEqual(bundle.encoding, 'gzip')
+        self.assertEqual(response['Location'], '/foo/bar.gz')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+
+    @override_settings(BUNDLE_SERVE_DIRECT=True, BUNDLE_ENCODINGS=['br'])
+    def test_serve_direct(self):
+        request = self.factory.get('/', HTTP_ACCEPT_ENCODING='br')
+        with patch.object(views, 'SnippetBundle') as SnippetBundle:
+            bundle = SnippetBundle.return_value
+            bundle.key = 'foo'
+            bundle.filename = 'bundles/bundle_foo.html'
+            bundle.empty = False
+            bundle.cached = True
+            bundle.max_age = 60
+            with patch('snippets.base.views.bodies.get_body') as get_body:
+                get_body.return_value = b'body'
+                response = views.fetch_snippets(request, **self.client_kwargs)
+
+        get_body.assert_called_with('bundles/bundle_foo.html.br')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b'body')
+        self.assertEqual(response['Content-Type'], 'text/html')
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertEqual(response['ETag'], 'W/"foo"')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+
+    @override_settings(BUNDLE_SERVE_DIRECT=True)
+    def test_serve_direct_not_modified(self):
+        request = self.factory.get('/', HTTP_IF_NONE_MATCH='W/"bar", W/"foo"')
+        with patch.object(views, 'SnippetBundle') as SnippetBundle:
+            bundle = SnippetBundle.return_value
+            bundle.key = 'foo'
+            bundle.empty = False
+            bundle.cached = True
+            bundle.max_age = 60
+            with patch('snippets.base.views.bodies.get_body') as get_body:
+                response = views.fetch_snippets(request, **self.client_kwargs)
+
+        self.assertFalse(get_body.called)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['ETag'], 'W/"foo"')
+        self.assertIn('max-age=60', response['Cache-Control'])
+
+    @override_settings(BUNDLE_SERVE_DIRECT=True)
+    def test_serve_direct_stale(self):
+        with patch.object(views, 'SnippetBundle') as SnippetBundle:
+            bundle = SnippetBundle.return_value
+            bundle.key = 'foo'
+            bundle.stale = {'key': 'old', 'filename': 'bundles/bundle_old.html',
+                            'encoding': 'identity'}
+            bundle.empty = False
+            bundle.cached = False
+            with patch('snippets.base.views.bodies.get_body') as get_body:
+                get_body.return_value = b'old body'
+                response = views.fetch_snippets(self.request, **self.client_kwargs)
+
+        get_body.assert_called_with('bundles/bundle_old.html')
+        self.assertEqual(response.content, b'old body')
+        self.assertEqual(response['ETag'], 'W/"old"')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertIn('max-age=0', response['Cache-Control'])
+        self.assertTrue(bundle.enqueue.called)
+
     @override_settings(SNIPPET_BUNDLE_TIMEOUT=75)
     def test_cache_headers(self):
         """
@@ -292,6 +419,23 @@ class FetchSnippetsTests(TestCase):
         cache_headers = [header.strip() for header in response['Cache-control'].split(',')]
         self.assertEqual(set(cache_headers), set(['public', 'max-age=75']))
 
+    @override_settings(SNIPPET_BUNDLE_TIMEOUT=3600, BUNDLE_QUEUE='')
+    def test_cache_headers_capped_at_transition(self):
+        """
+        max-age should not exceed the time until a matching snippet
+        becomes available or unavailable.
+        """
+        ASRSnippetFactory.create(publish_end=datetime.utcnow() + timedelta(minutes=30))
+        params = self.asrclient_kwargs.values()
+        with patch('snippets.base.bundles.default_storage') as default_storage:
+            default_storage.url.return_value = '/media/bundles/foo.json'
+            response = self.client.get(
+                '/{0}/'.format('/'.join(['{}'.format(x) for x in params])))
+        cache_headers = dict(
+            header.strip().partition('=')[::2] for header in response['Cache-control'].split(','))
+        self.assertIn('public', cache_headers)
+        self.assertTrue(1700 < int(cache_headers['max-age']) <= 1800)
+
 
 class PreviewASRSnippetTests(TestCase):
     def test_base(self):
@@ -0,0 +1,37 @@
+import hashlib
+
+from unittest.mock import patch
+
+from snippets.base import manifest
+from snippets.base.models import template_cache
+from snippets.base.targeting import asr_index
+from snippets.base.tests import ASRSnippetFactory, SnippetFactory, TestCase
+from snippets.base.warmup import WARM_UP_STEPS, warm_up
+
+
+class WarmUpTests(TestCase):
+    def test_base(self):
+        snippet = SnippetFactory.create()
+        SnippetFactory.create(published=False)
+        ASRSnippetFactory.create()
+        template_cache.clear()
+
+        with patch.object(asr_index, 'warm') as warm_index:
+            with patch.object(manifest, 'warm') as warm_manifest:
+                durations = warm_up()
+
+        self.assertEqual(list(durations), [step.__name__ for step in WARM_UP_STEPS])
+        # Only the templates of published snippets get compiled.
+        self.assertEqual(len(template_cache), 1)
+        self.assertIn(hashlib.sha1(snippet.template.code.encode('utf-8')).hexdigest(),
+                      template_cache)
+        self.assertTrue(warm_index.called)
+        self.assertTrue(warm_manifest.called)
+
+    def test_failing_step(self):
+        with patch('snippets.base.warmup.util.current_firefox_major_version',
+                   side_effect=Exception):
+            with patch.object(asr_index, 'warm') as warm_index:
+                durations = warm_up()
+        self.assertIn('warm_product_details', durations)
+        self.assertTrue(warm_index.called)
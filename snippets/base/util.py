@@ -27,6 +27,79 @@ def first(collection, callback):
     return next((item for item in collection if callback(item)), None)
 
 
+def filter_by_available(snippets, now=None):
+    """
+    Return the snippets that are available at now based on their
+    publish_start and publish_end.
+    """
+    now = now or datetime.datetime.utcnow()
+    return [
+        snippet for snippet in snippets if
+        (not snippet.publish_start or snippet.publish_start <= now) and
+        (not snippet.publish_end or snippet.publish_end >= now)
+    ]
+
+
+def next_transition(snippets, now=None):
+    """
+    Return the earliest datetime after now at which any of snippets becomes
+    available or unavailable based on its publish_start and publish_end, or
+    None if the availability of snippets won't change.
+    """
+    now = now or datetime.datetime.utcnow()
+    transitions = []
+    for snippet in snippets:
+        if snippet.publish_start and snippet.publish_start > now:
+            transitions.append(snippet.publish_start)
+        if snippet.publish_end and snippet.publish_end >= now:
+            transitions.append(snippet.publish_end)
+    return min(transitions, default=None)
+
+
+def seconds_until(moment, now=None):
+    """Return the whole number of seconds from now until moment, at least 0."""
+    now = now or datetime.datetime.utcnow()
+    return max(int((moment - now).total_seconds()), 0)
+
+
+def negotiate_encoding(accept_encoding, encodings):
+    """
+    Return the one of encodings the Accept-Encoding header value
+    accept_encoding prefers, or identity if it accepts none of them.
+
+    On equal quality values the encoding listed first in encodings wins.
+    """
+    qualities = {}
+    for item in accept_encoding.lower().split(','):
+        coding, _, params = item.partition(';')
+        coding = coding.strip()
+        if not coding:
+            continue
+
+        quality = 1.0
+        name, _, value = params.partition('=')
+        if name.strip() == 'q':
+            try:
+                quality = float(value)
+            except ValueError:
+                quality = 0.0
+        qualities[coding] = quality
+
+    best_encoding, best_quality = 'identity', 0.0
+    for encoding in encodings:
+        if encoding in qualities:
+            quality = qualities[encoding]
+        elif encoding == 'identity':
+            # Identity is acceptable unless excluded, but least preferred.
+            quality = min(qualities.get('*', 0.001), 0.001)
+        else:
+            quality = qualities.get('*', 0.0)
+
+        if quality > best_quality:
+            best_encoding, best_quality = encoding, quality
+    return best_encoding
+
+
 def create_locales():
     from snippets.base.models import TargetedLocale
 
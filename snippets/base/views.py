@@ -1,15 +1,18 @@
 import json
 import logging
+import mimetypes
 
 from distutils.util import strtobool
 
 from django.conf import settings
 from django.contrib.auth.decorators import permission_required
 from django.core.exceptions import ValidationError
-from django.http import Http404, HttpResponse, HttpResponseBadRequest, HttpResponseRedirect
+from django.http import (Http404, HttpResponse, HttpResponseBadRequest, HttpResponseNotModified,
+                         HttpResponseRedirect)
 from django.shortcuts import get_object_or_404, render
+from django.utils.cache import patch_cache_control, patch_vary_headers
 from django.utils.functional import lazy
-from django.views.decorators.cache import cache_control
+from django.utils.http import parse_etags
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST
 from django.views.generic import TemplateView
@@ -17,11 +20,13 @@ from django.views.generic import TemplateView
 from django_statsd.clients import statsd
 from raven.contrib.django.models import client as sentry_client
 
-from snippets.base import util
-from snippets.base.bundles import ASRSnippetBundle, SnippetBundle
+from snippets.base import bodies, util
+from snippets.base.bundles import (ENCODING_SUFFIXES, ASRSnippetBundle, JSONSnippetBundle,
+                                   SnippetBundle, get_encodings)
 from snippets.base.decorators import access_control
-from snippets.base.encoders import JSONSnippetEncoder
-from snippets.base.models import ASRSnippet, Client, JSONSnippet, Snippet, SnippetTemplate
+from snippets.base.locks import NoGenerationSlot
+from snippets.base.models import ASRSnippet, Client, Snippet, SnippetTemplate
+from snippets.base.queues import get_queue
 from snippets.base.util import get_object_or_none
 
 
@@ -29,56 +34,135 @@ def _bundle_timeout():
     return getattr(settings, 'SNIPPET_BUNDLE_TIMEOUT')
 SNIPPET_BUNDLE_TIMEOUT = lazy(_bundle_timeout, int)()  # noqa
 
+# Seconds clients get told to wait before retrying when no bundle can be
+# generated for them.
+BUSY_RETRY_AFTER = 5
+
 
 class HomeView(TemplateView):
     template_name = 'base/home.jinja'
 
 
-@cache_control(public=True, max_age=SNIPPET_BUNDLE_TIMEOUT)
-@access_control(max_age=SNIPPET_BUNDLE_TIMEOUT)
-def fetch_snippets(request, **kwargs):
+def _bundle_response(request, bundle, stale=False):
+    """
+    Return the response for the bundle, or its last good bundle if stale.
+
+    That's a redirect to the bundle or, with BUNDLE_SERVE_DIRECT, its body
+    with the bundle key as ETag.
+    """
+    if not settings.BUNDLE_SERVE_DIRECT:
+        return HttpResponseRedirect(bundle.stale_url if stale else bundle.url)
+
+    if stale:
+        key, filename, encoding = (bundle.stale['key'], bundle.stale['filename'],
+                                   bundle.stale['encoding'])
+    else:
+        key, filename, encoding = bundle.key, bundle.filename, bundle.encoding
+
+    # The ETag is weak since it's the same for all encodings of the bundle.
+    etag = 'W/"{0}"'.format(key)
+    if_none_match = [tag.replace('W/', '', 1).strip('"') for tag in
+                     parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))]
+    if key in if_none_match or '*' in if_none_match:
+        statsd.incr('bundle.not_modified')
+        response = HttpResponseNotModified()
+    else:
+        body = bodies.get_body(filename + ENCODING_SUFFIXES[encoding])
+        response = HttpResponse(body, content_type=mimetypes.guess_type(filename)[0])
+        if encoding != 'identity':
+            response['Content-Encoding'] = encoding
+    response['ETag'] = etag
+    return response
+
+
+def _count_outcome(request, outcome):
+    """Count how the bundle got served, see LoadReplayMiddleware."""
+    statsd.incr('bundle.' + outcome)
+    request.bundle_outcome = outcome
+
+
+def _serve_bundle(request, bundle, empty_response):
     """
     Return one of the following responses:
-    - 200 with empty body when the bundle is empty
+    - empty_response when the bundle is empty
     - 302 to a bundle URL after generating it if not cached.
+    - 302 to the last good bundle URL of the client while the bundle gets
+      generated in the background.
+    - 503 with Retry-After when all generation slots of the node are taken.
+      The bundle gets queued for generation, if a queue is enabled.
+
+    Redirects point to the bundle variant in the encoding the client
+    prefers according to its Accept-Encoding header. With
+    BUNDLE_SERVE_DIRECT the variant gets served instead of redirected to,
+    or 304 if the client already has it.
+
+    Responses are cacheable until the bundle expires, i.e. until a
+    matching snippet becomes available or unavailable, but at most for
+    SNIPPET_BUNDLE_TIMEOUT seconds.
     """
+    bundle.encoding = util.negotiate_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''),
+                                              get_encodings())
+
+    if bundle.empty:
+        _count_outcome(request, 'empty')
+        response = empty_response
+    elif bundle.cached:
+        _count_outcome(request, 'cached')
+        response = _bundle_response(request, bundle)
+    elif bundle.stale_url:
+        # Serve the last good bundle while the new one gets generated in
+        # the background. Don't let clients cache the stale response.
+        _count_outcome(request, 'stale')
+        bundle.enqueue()
+        response = _bundle_response(request, bundle, stale=True)
+        patch_cache_control(response, public=True, max_age=0)
+        patch_vary_headers(response, ['Accept-Encoding'])
+        return response
+    else:
+        _count_outcome(request, 'generate')
+        try:
+            bundle.ensure_generated(inline=True)
+        except NoGenerationSlot:
+            _count_outcome(request, 'busy')
+            if get_queue() is not None:
+                bundle.enqueue()
+            response = HttpResponse(status=503)
+            response['Retry-After'] = BUSY_RETRY_AFTER
+            patch_cache_control(response, max_age=0)
+            return response
+        response = _bundle_response(request, bundle)
+
+    patch_cache_control(response, public=True, max_age=bundle.max_age)
+    patch_vary_headers(response, ['Accept-Encoding'])
+    return response
+
+
+@access_control(max_age=SNIPPET_BUNDLE_TIMEOUT)
+def fetch_snippets(request, **kwargs):
+    """Serve the bundle of the client, see _serve_bundle."""
     statsd.incr('serve.snippets')
 
     client = Client(**kwargs)
     if client.startpage_version == 6:
         bundle = ASRSnippetBundle(client)
+        # Return valid JSON for Activity Stream Router
+        empty_response = HttpResponse(status=200, content='{}', content_type='application/json')
     else:
         bundle = SnippetBundle(client)
-    if bundle.empty:
-        statsd.incr('bundle.empty')
-
-        if client.startpage_version == 6:
-            # Return valid JSON for Activity Stream Router
-            return HttpResponse(status=200, content='{}', content_type='application/json')
-
         # This is not a 204 because Activity Stream expects content, even if
         # it's empty.
-        return HttpResponse(status=200, content='')
-    elif bundle.cached:
-        statsd.incr('bundle.cached')
-    else:
-        statsd.incr('bundle.generate')
-        bundle.generate()
+        empty_response = HttpResponse(status=200, content='')
 
-    return HttpResponseRedirect(bundle.url)
+    return _serve_bundle(request, bundle, empty_response)
 
 
-@cache_control(public=True, max_age=SNIPPET_BUNDLE_TIMEOUT)
 @access_control(max_age=SNIPPET_BUNDLE_TIMEOUT)
 def fetch_json_snippets(request, **kwargs):
+    """Serve the JSON bundle of the client, see _serve_bundle."""
     statsd.incr('serve.json_snippets')
     client = Client(**kwargs)
-    matching_snippets = (JSONSnippet.objects
-                         .filter(published=True)
-                         .match_client(client)
-                         .filter_by_available())
-    return HttpResponse(json.dumps(matching_snippets, cls=JSONSnippetEncoder),
-                        content_type='application/json')
+    empty_response = HttpResponse('[]', content_type='application/json')
+    return _serve_bundle(request, JSONSnippetBundle(client), empty_response)
 
 
 def preview_asr_snippet(request, uuid):
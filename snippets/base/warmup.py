@@ -0,0 +1,78 @@
+import logging
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.template.loader import get_template
+from django.urls import get_resolver
+
+from django_statsd.clients import statsd
+
+from snippets.base import manifest, util
+from snippets.base.models import SnippetTemplate, template_cache
+from snippets.base.storage import public_url
+from snippets.base.targeting import asr_index
+
+
+logger = logging.getLogger(__name__)
+
+# Templates every bundle gets rendered with.
+BUNDLE_TEMPLATES = ('base/fetch_snippets.jinja', 'base/fetch_snippets_as.jinja')
+
+
+def warm_urls():
+    """Import the views, and with them the bundle code, through the URLconf."""
+    get_resolver().url_patterns
+
+
+def warm_templates():
+    """Compile the bundle templates and the SnippetTemplates of published snippets."""
+    for template_name in BUNDLE_TEMPLATES:
+        get_template(template_name)
+
+    templates = (SnippetTemplate.objects
+                 .filter(snippet__published=True)
+                 .distinct()
+                 .order_by('-modified')[:template_cache.capacity])
+    for template in templates:
+        template.get_compiled()
+
+
+def warm_product_details():
+    """Load the product details bundle keys depend on."""
+    util.current_firefox_major_version()
+
+
+def warm_storage():
+    """Set up the storage client and the public URL prefix of bundles."""
+    public_url(default_storage, settings.MEDIA_BUNDLES_ROOT)
+
+
+def warm_targeting():
+    """Build the targeting index and load the bundle manifest."""
+    asr_index.warm()
+    manifest.warm()
+
+
+WARM_UP_STEPS = (warm_urls, warm_templates, warm_product_details, warm_storage,
+                 warm_targeting)
+
+
+def warm_up():
+    """
+    Prime the caches of this process ahead of its first request.
+
+    Failing steps get logged and skipped, since everything gets loaded on
+    demand anyway. Returns the duration of each step in seconds.
+    """
+    durations = OrderedDict()
+    for step in WARM_UP_STEPS:
+        start = time.perf_counter()
+        try:
+            step()
+        except Exception:
+            logger.exception('Failed to warm up with %s.', step.__name__)
+        durations[step.__name__] = time.perf_counter() - start
+        statsd.timing('worker.{0}'.format(step.__name__), int(durations[step.__name__] * 1000))
+    return durations
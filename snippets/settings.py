@@ -1,5 +1,6 @@
 import os
 import platform
+import tempfile
 
 import dj_database_url
 import django_cache_url
@@ -64,6 +65,7 @@ for app in config('EXTRA_APPS', default='', cast=Csv()):
     INSTALLED_APPS.append(app)
 
 MIDDLEWARE = (
+    'snippets.base.middleware.LoadReplayMiddleware',
     'snippets.base.middleware.HostnameMiddleware',
     'allow_cidr.middleware.AllowCIDRMiddleware',
     'django.middleware.security.SecurityMiddleware',
@@ -87,6 +89,9 @@ DEIS_APP = config('DEIS_APP', default=None)
 DEIS_DOMAIN = config('DEIS_DOMAIN', default=None)
 ENABLE_HOSTNAME_MIDDLEWARE = config('ENABLE_HOSTNAME_MIDDLEWARE',
                                     default=bool(DEIS_APP), cast=bool)
+# Report queries and bundle outcomes of each request in response headers,
+# for `./manage.py replay_fetch_urls`. Never enable in production.
+LOAD_REPLAY_HEADERS = config('LOAD_REPLAY_HEADERS', default=False, cast=bool)
 
 ROOT_URLCONF = 'snippets.urls'
 
@@ -216,7 +221,71 @@ CSRF_COOKIE_SAMESITE = config('CSRF_COOKIE_SAMESITE', default='Lax')
 
 SNIPPET_BUNDLE_TIMEOUT = config('SNIPPET_BUNDLE_TIMEOUT', default=15 * 60, cast=int)  # 15 minutes
 
-BUNDLE_BROTLI_COMPRESS = config('BUNDLE_BROTLI_COMPRESS', default=False, cast=bool)
+# Encodings bundles get stored in besides uncompressed, out of br and gzip.
+# Clients get redirected to the best one they accept.
+BUNDLE_ENCODINGS = config('BUNDLE_ENCODINGS', default='br,gzip', cast=Csv())
+# Brotli quality, 0 to 11, of bundles generated while a client waits for
+# them. They get recompressed at BUNDLE_BROTLI_QUALITY in the background
+# through BUNDLE_QUEUE, if enabled.
+BUNDLE_BROTLI_INLINE_QUALITY = config('BUNDLE_BROTLI_INLINE_QUALITY', default=5, cast=int)
+BUNDLE_BROTLI_QUALITY = config('BUNDLE_BROTLI_QUALITY', default=11, cast=int)
+# Recompressed variants replace the inline ones under the same name, so CDNs
+# and clients only cache inline variants for this many seconds instead of
+# the max-age of AWS_CACHE_CONTROL_HEADERS.
+BUNDLE_BROTLI_INLINE_MAX_AGE = config('BUNDLE_BROTLI_INLINE_MAX_AGE', default=10 * 60, cast=int)
+
+# Match ASRSnippets against an in-process index instead of querying the
+# database on every request. The index gets rebuilt when the data changes or
+# when it gets older than ASR_TARGETING_INDEX_TIMEOUT seconds.
+ASR_TARGETING_INDEX = config('ASR_TARGETING_INDEX', default=True, cast=bool)
+ASR_TARGETING_INDEX_TIMEOUT = config('ASR_TARGETING_INDEX_TIMEOUT', default=5 * 60, cast=int)
+
+# For how long to remember the bundle of a client equivalence class. See
+# snippets.base.targeting.ClientClass.
+BUNDLE_CLIENT_CLASS_TIMEOUT = config('BUNDLE_CLIENT_CLASS_TIMEOUT', default=60, cast=int)
+
+# Only one process generates a bundle at a time. The others wait up to
+# BUNDLE_GENERATION_LOCK_WAIT seconds for it, taking over one at a time if
+# the lock gets released without the bundle, before requests generate it
+# themselves. The lock expires after BUNDLE_GENERATION_LOCK_TIMEOUT seconds
+# in case the generating process dies.
+BUNDLE_GENERATION_LOCK_TIMEOUT = config('BUNDLE_GENERATION_LOCK_TIMEOUT', default=60, cast=int)
+BUNDLE_GENERATION_LOCK_WAIT = config('BUNDLE_GENERATION_LOCK_WAIT', default=5, cast=float)
+# Maximum number of bundles generated concurrently by all processes of a node.
+# Requests wait up to BUNDLE_GENERATION_SLOT_WAIT seconds for a free slot,
+# background generation up to BUNDLE_GENERATION_LOCK_TIMEOUT seconds. Keep
+# the lock and slot waits of requests well under the timeout of workers.
+BUNDLE_GENERATION_CONCURRENCY = config('BUNDLE_GENERATION_CONCURRENCY', default=2, cast=int)
+BUNDLE_GENERATION_SLOT_WAIT = config('BUNDLE_GENERATION_SLOT_WAIT', default=2, cast=float)
+BUNDLE_GENERATION_SLOTS_DIR = config('BUNDLE_GENERATION_SLOTS_DIR',
+                                     default=os.path.join(tempfile.gettempdir(), 'snippets'))
+
+# Queue to generate bundles in the background with, while serving the last
+# good bundle of the client for up to BUNDLE_MAX_STALENESS seconds. One of
+# 'local' (a thread of each web process), 'redis' (processed by
+# `./manage.py process_bundle_queue`) or empty to always generate bundles
+# in the request. Disabled unless a deployment enables it.
+BUNDLE_QUEUE = config('BUNDLE_QUEUE', default='')
+BUNDLE_MAX_STALENESS = config('BUNDLE_MAX_STALENESS', default=10 * 60, cast=int)
+
+# Serve bundle bodies from fetch_snippets with an ETag instead of
+# redirecting to storage. Bodies get kept in each process, up to
+# BUNDLE_BODY_CACHE_MAX_BYTES in total evicting the least recently used, and
+# in the cache for BUNDLE_BODY_CACHE_TIMEOUT seconds.
+BUNDLE_SERVE_DIRECT = config('BUNDLE_SERVE_DIRECT', default=False, cast=bool)
+BUNDLE_BODY_CACHE_MAX_BYTES = config('BUNDLE_BODY_CACHE_MAX_BYTES',
+                                     default=64 * 1024 * 1024, cast=int)
+BUNDLE_BODY_CACHE_MAX_ITEM_BYTES = config('BUNDLE_BODY_CACHE_MAX_ITEM_BYTES',
+                                          default=4 * 1024 * 1024, cast=int)
+BUNDLE_BODY_CACHE_TIMEOUT = config('BUNDLE_BODY_CACHE_TIMEOUT', default=60 * 60 * 24, cast=int)
+
+# Each process remembers up to BUNDLE_MANIFEST_LOCAL_MAX_KEYS bundles to be
+# saved to storage, for BUNDLE_MANIFEST_LOCAL_TIMEOUT seconds each. Bundles
+# removed by `./manage.py repair_bundle_manifest` may get served for that
+# long by other processes.
+BUNDLE_MANIFEST_LOCAL_MAX_KEYS = config('BUNDLE_MANIFEST_LOCAL_MAX_KEYS',
+                                        default=50000, cast=int)
+BUNDLE_MANIFEST_LOCAL_TIMEOUT = config('BUNDLE_MANIFEST_LOCAL_TIMEOUT', default=60, cast=int)
 
 METRICS_URL = config('METRICS_URL', default='https://snippets-stats.moz.works/foo')
 METRICS_SAMPLE_RATE = config('METRICS_SAMPLE_RATE', default=0.1, cast=float)
@@ -278,6 +347,8 @@ DEAD_MANS_SNITCH_CSV_EXPORT = config('DEAD_MANS_SNITCH_CSV_EXPORT', default=None
 
 DEAD_MANS_SNITCH_PRODUCT_DETAILS = config('DEAD_MANS_SNITCH_PRODUCT_DETAILS', default=None)
 DEAD_MANS_SNITCH_DISABLE_SNIPPETS = config('DEAD_MANS_SNITCH_DISABLE_SNIPPETS', default=None)
+DEAD_MANS_SNITCH_PREGENERATE_BUNDLES = config('DEAD_MANS_SNITCH_PREGENERATE_BUNDLES',
+                                              default=None)
 
 SNIPPETS_PER_PAGE = config('SNIPPETS_PER_PAGE', default=50)
 
@@ -1,3 +1,5 @@
+import mimetypes
+
 from django.conf import settings
 from django.contrib import admin
 from django.contrib.staticfiles.urls import staticfiles_urlpatterns
@@ -6,6 +8,8 @@ from django.views.generic import RedirectView
 from django.views.static import serve as static_serve
 from django.urls import include, path, re_path
 
+from snippets.base.bundles import ENCODING_SUFFIXES
+
 
 def robots_txt(request):
     permission = 'Allow' if settings.ENGAGE_ROBOTS else 'Disallow'
@@ -43,9 +47,12 @@ if settings.DEBUG:
     def serve_media(*args, **kwargs):
         response = static_serve(*args, **kwargs)
         response['Access-Control-Allow-Origin'] = '*'
-        if ((settings.BUNDLE_BROTLI_COMPRESS and
-             kwargs['path'].startswith(settings.MEDIA_BUNDLES_ROOT))):
-            response['Content-Encoding'] = 'br'
+        if kwargs['path'].startswith(settings.MEDIA_BUNDLES_ROOT):
+            for encoding, suffix in ENCODING_SUFFIXES.items():
+                if suffix and kwargs['path'].endswith(suffix):
+                    content_type = mimetypes.guess_type(kwargs['path'][:-len(suffix)])[0]
+                    response['Content-Type'] = content_type or 'application/octet-stream'
+                    response['Content-Encoding'] = encoding
         return response
 
     urlpatterns += [
@@ -12,4 +12,39 @@ loglevel = getenv('WSGI_LOG_LEVEL', 'info')
 # Larger keep-alive values maybe needed when directly talking to ELBs
 # See https://github.com/benoitc/gunicorn/issues/1194
 keepalive = getenv('WSGI_KEEP_ALIVE', 2)
+# Requests generating bundles wait for a generation lock and slot, see
+# BUNDLE_GENERATION_LOCK_WAIT and BUNDLE_GENERATION_SLOT_WAIT, well within
+# this timeout.
+timeout = getenv('WSGI_TIMEOUT', 30)
 worker_class = getenv('GUNICORN_WORKER_CLASS', 'meinheld.gmeinheld.MeinheldWorker')
+
+
+# Load the application in the master before forking workers, so that they
+# share the imported code and don't pay for loading it on their own.
+preload_app = getenv('WSGI_PRELOAD_APP', False)
+
+
+def warm_up_worker(worker):
+    # Load the views, compile templates, load product details, set up the
+    # storage client, build the in-process targeting index and load the
+    # bundle manifest before serving the first request.
+    from django.db import connections
+    from snippets.base.warmup import warm_up
+
+    # Workers must not share the connections of the master.
+    connections.close_all()
+    durations = warm_up()
+    worker.log.info('Warmed up in %.1f ms (%s).', sum(durations.values()) * 1000,
+                    ', '.join('{0}: {1:.1f} ms'.format(step, duration * 1000)
+                              for step, duration in durations.items()))
+
+
+def post_fork(server, worker):
+    # Without preloading, the application only gets loaded after forking.
+    if server.cfg.preload_app:
+        warm_up_worker(worker)
+
+
+def post_worker_init(worker):
+    if not worker.cfg.preload_app:
+        warm_up_worker(worker)